@@ -1,11 +1,30 @@
+from accounts.services import UserService
 from django.contrib.auth.models import User
 from rest_framework import serializers, exceptions
+from utils.hydration import HydratedListSerializer
 
 
 class UserSerializer(serializers.ModelSerializer):
+    # 粉丝数和关注数读的是 profile 上的计数，profile 走 memcached，不需要 COUNT(*)
+    followers_count = serializers.SerializerMethodField()
+    followings_count = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ('id', 'username', 'email')
+        fields = ('id', 'username', 'email', 'followers_count', 'followings_count')
+        # 一组 users 的 profile 用一次 multi-get 取出来
+        list_serializer_class = HydratedListSerializer
+
+    def batch_load(self, users):
+        UserService.hydrate_profiles(users)
+
+    def get_followers_count(self, obj):
+        profile = UserService.get_profile(obj)
+        return profile.followers_count if profile else 0
+
+    def get_followings_count(self, obj):
+        profile = UserService.get_profile(obj)
+        return profile.followings_count if profile else 0
 
 
 class UserSerializerForTweet(serializers.ModelSerializer):
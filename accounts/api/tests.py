@@ -52,6 +52,8 @@ class AccountApiTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertNotEqual(response.data['user'], None)
         self.assertEqual(response.data['user']['email'], 'daiertang9@gmail.com')
+        self.assertEqual(response.data['user']['followers_count'], 0)
+        self.assertEqual(response.data['user']['followings_count'], 0)
         # 验证已经登录了
         # login_status用get
         response = self.client.get(LOGIN_STATUS_URL)
@@ -123,4 +125,4 @@ class AccountApiTests(TestCase):
         # 验证用户已经登入
         response = self.client.get(LOGIN_STATUS_URL)
         self.assertEqual(response.data['has_logged_in'], True)
-
+        self.assertEqual(response.data['user']['followers_count'], 0)
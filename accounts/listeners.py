@@ -0,0 +1,7 @@
+def create_user_profile(sender, instance, created, **kwargs):
+    if not created:
+        return
+
+    from accounts.models import UserProfile
+    # 直接挂到 user 上，之后访问 user.profile 不需要再查一次
+    instance.profile = UserProfile.objects.create(user=instance)
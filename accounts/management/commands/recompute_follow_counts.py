@@ -0,0 +1,86 @@
+from accounts.models import UserProfile
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from friendships.models import Friendship
+from utils.memcached_helper import MemcachedHelper
+
+
+class Command(BaseCommand):
+    """
+    python manage.py recompute_follow_counts [--batch-size 1000] [--dry-run]
+    profile.followers_count / profile.followings_count 是用 F() 增量维护的，
+    如果中间出过问题（比如 bulk 操作没有触发 signal），数字会和真实的 COUNT(*) 对不上
+    这个 command 按 user id 分批重新数一遍，只修改对不上的那些行，没有 profile 的 user 顺便补上
+    """
+    help = 'Recompute denormalized followers_count / followings_count in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        created, fixed = 0, 0
+        last_id = 0
+        while True:
+            # 按 id 翻页，不用 OFFSET
+            user_ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            batch_created, batch_fixed = self.recompute(user_ids)
+            created += batch_created
+            fixed += batch_fixed
+
+        self.stdout.write('user profiles: {} created'.format(created))
+        self.stdout.write('followers_count / followings_count: {} fixed'.format(fixed))
+
+    def count(self, user_field, user_ids):
+        # 分别用到 friendship 上 (to_user_id, created_at) 和 (from_user_id, created_at) 的联合索引
+        # order_by() 去掉默认排序，否则会被加进 GROUP BY
+        return dict(
+            Friendship.objects.filter(**{
+                '{}__in'.format(user_field): user_ids,
+            }).order_by().values(user_field).annotate(
+                count=Count('id'),
+            ).values_list(user_field, 'count')
+        )
+
+    def recompute(self, user_ids):
+        profiles = UserProfile.objects.in_bulk(user_ids)
+        missing_ids = [user_id for user_id in user_ids if user_id not in profiles]
+        if missing_ids and not self.dry_run:
+            UserProfile.objects.bulk_create(
+                [UserProfile(user_id=user_id) for user_id in missing_ids],
+                ignore_conflicts=True,
+            )
+            profiles = UserProfile.objects.in_bulk(user_ids)
+
+        followers_counts = self.count('to_user_id', user_ids)
+        followings_counts = self.count('from_user_id', user_ids)
+        fixed = 0
+        for user_id in user_ids:
+            followers_count = followers_counts.get(user_id, 0)
+            followings_count = followings_counts.get(user_id, 0)
+            profile = profiles.get(user_id)
+            if profile is not None \
+                    and profile.followers_count == followers_count \
+                    and profile.followings_count == followings_count:
+                continue
+            if profile is not None:
+                fixed += 1
+            if self.dry_run:
+                continue
+            UserProfile.objects.filter(user_id=user_id).update(
+                followers_count=followers_count,
+                followings_count=followings_count,
+            )
+            MemcachedHelper.invalidate_cached_object(UserProfile, user_id)
+        return len(missing_ids), fixed
@@ -0,0 +1,66 @@
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def count_friendships(Friendship, user_field, user_ids):
+    return dict(
+        Friendship.objects.filter(**{
+            '{}__in'.format(user_field): user_ids,
+        }).order_by().values(user_field).annotate(
+            count=Count('id'),
+        ).values_list(user_field, 'count')
+    )
+
+
+def backfill_user_profiles(apps, schema_editor):
+    # profile 是注册的时候创建的，加 UserProfile 之前注册的用户没有 profile，
+    # 粉丝数会被当成 0，F() 的 update 也改不到任何行，这里按 user id 分批补上，顺便把计数数好
+    # 和 python manage.py recompute_follow_counts 做的事情一样
+    User = apps.get_model('auth', 'User')
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    Friendship = apps.get_model('friendships', 'Friendship')
+
+    last_id = 0
+    while True:
+        user_ids = list(
+            User.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        existing_ids = set(
+            UserProfile.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True)
+        )
+        missing_ids = [user_id for user_id in user_ids if user_id not in existing_ids]
+        if not missing_ids:
+            continue
+        followers_counts = count_friendships(Friendship, 'to_user_id', missing_ids)
+        followings_counts = count_friendships(Friendship, 'from_user_id', missing_ids)
+        UserProfile.objects.bulk_create(
+            [
+                UserProfile(
+                    user_id=user_id,
+                    followers_count=followers_counts.get(user_id, 0),
+                    followings_count=followings_counts.get(user_id, 0),
+                )
+                for user_id in missing_ids
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('friendships', '0002_auto_20220626_0713'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user_profiles, migrations.RunPython.noop),
+    ]
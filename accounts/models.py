@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models.signals import post_save
+from accounts.listeners import create_user_profile
+from utils.memcached_helper import MemcachedHelper
+
+
+class UserProfile(models.Model):
+    # 用 user 做主键，profile 的 id 就是 user 的 id，按 user id 就可以直接从 memcached 里取
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='profile',
+    )
+    # 粉丝数和关注数，关注 / 取关的时候用 F() 增量维护，不用每次都去 friendship 表里 COUNT(*)
+    # 如果出现了偏差，用 python manage.py recompute_follow_counts 修复
+    followers_count = models.IntegerField(default=0)
+    followings_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '{} followers: {} followings: {}'.format(
+            self.user_id,
+            self.followers_count,
+            self.followings_count,
+        )
+
+
+# User 是 django 自带的 model，没法在它的 models.py 里加代码，所以放在这里
+# user 被修改或者删除的时候，把 memcached 里的 user 删掉
+MemcachedHelper.register(User)
+MemcachedHelper.register(UserProfile)
+# 注册的时候创建 profile
+post_save.connect(create_user_profile, sender=User)
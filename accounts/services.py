@@ -0,0 +1,57 @@
+from accounts.models import UserProfile
+from django.contrib.auth.models import User
+from django.db.models import F
+from utils.memcached_helper import MemcachedHelper
+
+
+class UserService(object):
+
+    @classmethod
+    def get_profiles(cls, user_ids):
+        """
+        批量获取 profile，返回 {user_id: profile}
+        profile 的主键就是 user id，用一次 multi-get 从 memcached 里拿，没有的再用一条 IN Query
+        """
+        return MemcachedHelper.get_objects_through_cache(UserProfile, user_ids)
+
+    @classmethod
+    def hydrate_profiles(cls, users):
+        """
+        把一组 users 的 profile 一次性取出来挂到每个 user 上，之后访问 user.profile 不会再查数据库
+        已经挂过 profile 的不会重复取
+        """
+        related = User.profile.related
+        missing_users = [
+            user
+            for user in users
+            if user is not None and not related.is_cached(user)
+        ]
+        if not missing_users:
+            return
+        profiles = cls.get_profiles([user.id for user in missing_users])
+        for user in missing_users:
+            related.set_cached_value(user, profiles.get(user.id))
+
+    @classmethod
+    def get_profile(cls, user):
+        # 没有 profile 的老用户返回 None，跑一遍 recompute_follow_counts 就会补上
+        cls.hydrate_profiles([user])
+        return User.profile.related.get_cached_value(user)
+
+    @classmethod
+    def update_follow_counts(cls, from_user_id, to_user_ids, delta):
+        """
+        from_user 关注（delta=1）/ 取关（delta=-1）了 to_user_ids 里的人
+        用 F() 在数据库里做加减，并发的时候不会互相覆盖
+        """
+        if not to_user_ids:
+            return
+        UserProfile.objects.filter(user_id=from_user_id).update(
+            followings_count=F('followings_count') + delta * len(to_user_ids),
+        )
+        UserProfile.objects.filter(user_id__in=to_user_ids).update(
+            followers_count=F('followers_count') + delta,
+        )
+        # update 不会触发 post_save，memcached 里的 profile 要手动删掉
+        for user_id in [from_user_id] + list(to_user_ids):
+            MemcachedHelper.invalidate_cached_object(UserProfile, user_id)
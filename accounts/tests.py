@@ -0,0 +1,69 @@
+from accounts.models import UserProfile
+from accounts.services import UserService
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from friendships.services import FriendshipService
+from io import StringIO
+from testing.testcases import TestCase
+
+
+class UserProfileTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+
+    def get_counts(self, user):
+        profile = UserProfile.objects.get(user=user)
+        return profile.followers_count, profile.followings_count
+
+    def test_profile_is_created_with_user(self):
+        self.assertEqual(UserProfile.objects.filter(user=self.linghu).exists(), True)
+        self.assertEqual(self.get_counts(self.linghu), (0, 0))
+
+    def test_follow_counts(self):
+        friendship = self.create_friendship(self.linghu, self.dongxie)
+        self.assertEqual(self.get_counts(self.linghu), (0, 1))
+        self.assertEqual(self.get_counts(self.dongxie), (1, 0))
+
+        # cache 里的 profile 也要是最新的计数
+        self.assertEqual(UserService.get_profiles([self.dongxie.id])[self.dongxie.id].followers_count, 1)
+        FriendshipService.unfollow(friendship.from_user_id, friendship.to_user_id)
+        self.assertEqual(UserService.get_profiles([self.dongxie.id])[self.dongxie.id].followers_count, 0)
+        self.assertEqual(self.get_counts(self.linghu), (0, 0))
+
+    def test_hydrate_profiles(self):
+        self.create_friendship(self.linghu, self.dongxie)
+        users = list(User.objects.filter(id__in=[self.linghu.id, self.dongxie.id]))
+        with self.assertNumQueries(1):
+            UserService.hydrate_profiles(users)
+        with self.assertNumQueries(0):
+            UserService.hydrate_profiles(users)
+            counts = {user.id: user.profile.followers_count for user in users}
+        self.assertEqual(counts, {self.linghu.id: 0, self.dongxie.id: 1})
+
+        # 没有 profile 的用户不会报错
+        UserProfile.objects.filter(user=self.linghu).delete()
+        self.clear_cache()
+        linghu = User.objects.get(id=self.linghu.id)
+        self.assertEqual(UserService.get_profile(linghu), None)
+
+    def test_recompute_follow_counts(self):
+        self.create_friendship(self.linghu, self.dongxie)
+        self.create_friendship(self.dongxie, self.linghu)
+        # 模拟计数出现了偏差，以及没有 profile 的老用户
+        UserProfile.objects.filter(user=self.linghu).update(followers_count=5)
+        UserProfile.objects.filter(user=self.dongxie).delete()
+
+        out = StringIO()
+        call_command('recompute_follow_counts', '--dry-run', stdout=out)
+        self.assertIn('user profiles: 1 created', out.getvalue())
+        self.assertIn('followers_count / followings_count: 1 fixed', out.getvalue())
+        self.assertEqual(self.get_counts(self.linghu), (5, 1))
+        self.assertEqual(UserProfile.objects.filter(user=self.dongxie).exists(), False)
+
+        out = StringIO()
+        call_command('recompute_follow_counts', '--batch-size', '1', stdout=out)
+        self.assertIn('user profiles: 1 created', out.getvalue())
+        self.assertEqual(self.get_counts(self.linghu), (1, 1))
+        self.assertEqual(self.get_counts(self.dongxie), (1, 1))
@@ -0,0 +1,8 @@
+'''
+性能基准测试，不是单元测试，默认的 python manage.py test 不会跑到（文件名不是 test*.py）
+单独跑：
+
+    python manage.py test benchmarks -p "bench_*.py"
+
+规模可以用环境变量调大，具体看每个 bench_*.py 文件开头的说明
+'''
@@ -0,0 +1,112 @@
+import os
+import random
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from benchmarks.runner import format_report, load_report, measure, save_report
+from benchmarks.seed import GraphConfig, seed_graph
+from testing.testcases import TestCase
+
+'''
+核心 API 的 benchmark，在进程内用 APIClient 发请求，不经过网络，量的是 Django 这一层的开销
+
+    python manage.py test benchmarks.bench_api -p "bench_*.py"
+
+环境变量：
+- BENCH_USERS / BENCH_FOLLOWINGS_PER_USER / BENCH_TWEETS_PER_USER /
+  BENCH_LIKES_PER_TWEET / BENCH_COMMENTS_PER_TWEET / BENCH_SEED  数据规模，见 benchmarks/seed.py
+- BENCH_ITERATIONS  每个 endpoint 发多少个请求，默认 100
+- BENCH_OUTPUT  这一次的结果写到哪里，默认 benchmarks/results/api.json
+- BENCH_BASELINE  和哪个 baseline 比较，默认 benchmarks/baselines/api.json
+- BENCH_SAVE_BASELINE=1  把这一次的结果存成新的 baseline
+
+绝对的耗时和机器有关，不同机器上的 baseline 不能直接比较，queries_avg 和机器无关
+'''
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ITERATIONS = int(os.environ.get('BENCH_ITERATIONS', '100'))
+OUTPUT_PATH = os.environ.get(
+    'BENCH_OUTPUT',
+    os.path.join(BENCH_DIR, 'results', 'api.json'),
+)
+BASELINE_PATH = os.environ.get(
+    'BENCH_BASELINE',
+    os.path.join(BENCH_DIR, 'baselines', 'api.json'),
+)
+# 读请求轮流用这么多个用户的身份发，warmup 的时候每个用户都先请求一次
+CLIENT_POOL_SIZE = 10
+
+
+class ApiBenchmark(TestCase):
+
+    def setUp(self):
+        self.config = GraphConfig.from_env(os.environ)
+        self.graph = seed_graph(self.config)
+        self.rng = random.Random(self.config.seed)
+        self.clients = []
+        for user_id in self.graph['user_ids'][:CLIENT_POOL_SIZE]:
+            client = APIClient()
+            client.force_authenticate(User.objects.get(id=user_id))
+            self.clients.append((user_id, client))
+
+    def _client(self, i):
+        return self.clients[i % len(self.clients)]
+
+    def _random_user_id(self):
+        return self.rng.choice(self.graph['user_ids'])
+
+    def _random_tweet_id(self):
+        return self.rng.choice(self.graph['tweet_ids'])
+
+    def scenarios(self):
+        anonymous = self.anonymous_client
+        return OrderedDict([
+            ('tweets.list', lambda i: anonymous.get(
+                '/api/tweets/',
+                {'user_id': self._random_user_id()},
+            )),
+            ('tweets.create', lambda i: self._client(i)[1].post(
+                '/api/tweets/',
+                {'content': 'bench create tweet {}'.format(i)},
+            )),
+            ('newsfeeds.list', lambda i: self._client(i)[1].get('/api/newsfeeds/')),
+            ('friendships.followers', lambda i: anonymous.get(
+                '/api/friendships/{}/followers/'.format(self._random_user_id()),
+            )),
+            ('comments.list', lambda i: anonymous.get(
+                '/api/comments/',
+                {'tweet_id': self._random_tweet_id()},
+            )),
+            ('comments.create', lambda i: self._client(i)[1].post(
+                '/api/comments/',
+                {'tweet_id': self._random_tweet_id(), 'content': 'bench comment'},
+            )),
+            ('likes.list', lambda i: anonymous.get(
+                '/api/likes/',
+                {'content_type': 'tweet', 'object_id': self._random_tweet_id()},
+            )),
+            ('likes.create', lambda i: self._client(i)[1].post(
+                '/api/likes/',
+                {'content_type': 'tweet', 'object_id': self._random_tweet_id()},
+            )),
+        ])
+
+    def test_api(self):
+        results = OrderedDict()
+        for name, send_request in self.scenarios().items():
+            results[name] = measure(
+                send_request,
+                ITERATIONS,
+                warmup=len(self.clients),
+            )
+
+        baseline = load_report(BASELINE_PATH)
+        print()
+        print(format_report(results, baseline and baseline['results']))
+
+        report = {'config': self.config.to_dict(), 'results': results}
+        save_report(OUTPUT_PATH, report)
+        if os.environ.get('BENCH_SAVE_BASELINE') == '1':
+            save_report(BASELINE_PATH, report)
@@ -0,0 +1,94 @@
+import os
+import tracemalloc
+from unittest import mock
+
+from django.contrib.auth.models import User
+
+from friendships.models import Friendship
+from newsfeeds import tasks
+from newsfeeds.models import NewsFeed
+from newsfeeds.tasks import fanout_newsfeeds_main_task
+from testing.testcases import TestCase
+
+'''
+对比 fanout 的峰值内存：
+- legacy: 一次性把所有粉丝 id 读进内存，一次性 new 出所有 NewsFeed 再 bulk_create
+- streaming: fanout_newsfeeds_main_task，粉丝 id 从数据库里流式读，每个 batch 单独写
+
+    BENCH_FANOUT_SIZES=1000,5000,20000 BENCH_FANOUT_BATCH_SIZE=500 \
+        python manage.py test benchmarks.bench_fanout -p "bench_*.py"
+
+streaming 的峰值内存只和 batch size 有关，粉丝数变多的时候应该基本不变，
+legacy 的峰值内存和粉丝数成正比
+'''
+
+FANOUT_SIZES = [
+    int(size)
+    for size in os.environ.get('BENCH_FANOUT_SIZES', '1000,4000,16000').split(',')
+]
+FANOUT_BATCH_SIZE = int(os.environ.get('BENCH_FANOUT_BATCH_SIZE', '500'))
+
+
+def legacy_fanout(tweet_id, tweet_user_id):
+    follower_ids = list(Friendship.objects.filter(
+        to_user_id=tweet_user_id,
+    ).order_by().values_list('from_user_id', flat=True))
+    newsfeeds = [
+        NewsFeed(user_id=follower_id, tweet_id=tweet_id)
+        for follower_id in follower_ids
+    ]
+    NewsFeed.objects.bulk_create(newsfeeds)
+
+
+def measure_peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+class FanoutMemoryBenchmark(TestCase):
+
+    def seed_followers(self, author, count, prefix):
+        # 不走 create_user / create_friendship，bulk_create 不触发 signal，造数据快很多
+        User.objects.bulk_create([
+            User(username='{}{}'.format(prefix, i))
+            for i in range(count)
+        ], batch_size=1000)
+        follower_ids = User.objects.filter(
+            username__startswith=prefix,
+        ).values_list('id', flat=True)
+        Friendship.objects.bulk_create([
+            Friendship(from_user_id=follower_id, to_user_id=author.id)
+            for follower_id in follower_ids.iterator()
+        ], batch_size=1000)
+
+    def test_fanout_peak_memory(self):
+        print()
+        print('{:>10} {:>14} {:>14}'.format('followers', 'legacy(KiB)', 'streaming(KiB)'))
+        seeded = 0
+        author = self.create_user('author')
+        for size in FANOUT_SIZES:
+            self.seed_followers(author, size - seeded, 'f{}_'.format(size))
+            seeded = size
+
+            tweet = self.create_tweet(author, 'legacy {}'.format(size))
+            legacy_peak = measure_peak_memory(legacy_fanout, tweet.id, author.id)
+
+            tweet = self.create_tweet(author, 'streaming {}'.format(size))
+            with mock.patch.object(tasks, 'FANOUT_BATCH_SIZE', FANOUT_BATCH_SIZE):
+                streaming_peak = measure_peak_memory(
+                    fanout_newsfeeds_main_task,
+                    tweet.id,
+                    author.id,
+                )
+            self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), size)
+
+            print('{:>10} {:>14.1f} {:>14.1f}'.format(
+                size,
+                legacy_peak / 1024,
+                streaming_peak / 1024,
+            ))
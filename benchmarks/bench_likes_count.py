@@ -0,0 +1,60 @@
+import os
+import time
+from unittest import mock
+
+from django.test import override_settings
+
+from likes.services import LikeService, LikesCountBuffer
+from testing.testcases import TestCase
+from tweets.models import Tweet
+
+'''
+同一个热门 tweet 连续被点赞 N 次，对比两种维护 likes_count 的方式的吞吐量：
+- per-request: 每个赞一条 update tweet set likes_count = likes_count + 1
+- write-behind: 每个赞一次 HINCRBY，最后一次 flush 写回数据库（flush 的时间也算在内）
+
+    BENCH_LIKES=5000 python manage.py test benchmarks.bench_likes_count -p "bench_*.py"
+
+进程内串行执行，量到的只是每个赞本身的开销。线上 MySQL 里并发的 update 还要排队等同一行的行锁，
+per-request 的实际差距会比这里更大
+
+注意测试环境的 REDIS_BACKEND 是 'local'，write-behind 的 HINCRBY 打的是进程内的 LocalRedis，
+没有网络往返，所以这里的结果说明不了真的 redis 上的表现，要看线上的数字得在真的 redis-server 上重新测
+'''
+
+LIKES = int(os.environ.get('BENCH_LIKES', '2000'))
+
+
+class LikesCountBenchmark(TestCase):
+
+    def setUp(self):
+        self.tweet = self.create_tweet(self.create_user('author'))
+
+    def run_per_request(self):
+        started_at = time.perf_counter()
+        with override_settings(LIKES_COUNT_WRITE_BEHIND=False):
+            for _ in range(LIKES):
+                LikeService.update_likes_count(Tweet, self.tweet.id, 1)
+        return time.perf_counter() - started_at
+
+    def run_write_behind(self):
+        # update_likes_count 是在 commit 之后才 add 的，TestCase 里不会 commit，这里直接调 add
+        started_at = time.perf_counter()
+        with override_settings(LIKES_COUNT_WRITE_BEHIND=True), \
+                mock.patch.object(LikesCountBuffer, 'maybe_flush'):
+            for _ in range(LIKES):
+                LikesCountBuffer.add(Tweet, self.tweet.id, 1)
+            LikesCountBuffer.flush()
+        return time.perf_counter() - started_at
+
+    def test_likes_count_throughput(self):
+        per_request = self.run_per_request()
+        write_behind = self.run_write_behind()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, LIKES * 2)
+
+        print()
+        print('{:<14} {:>10} {:>12}'.format('mode', 'seconds', 'likes/s'))
+        for name, elapsed in (('per-request', per_request), ('write-behind', write_behind)):
+            print('{:<14} {:>10.3f} {:>12.0f}'.format(name, elapsed, LIKES / elapsed))
+        print('speedup: {:.1f}x'.format(per_request / write_behind))
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(sorted_values, percent):
+    # nearest-rank，样本少的时候不做插值，结果一定是某一次真实的耗时
+    if not sorted_values:
+        return 0
+    rank = max(int(round(percent / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def measure(send_request, iterations, warmup=1):
+    """
+    send_request(i) 发出第 i 个请求并返回 response，在进程内调用，不经过网络
+    warmup 的请求不计入统计，用来把 cache 填上（比如 redis 里的 newsfeeds list）
+    返回 latency 的 p50 / p95 / p99（毫秒），每个请求的平均和最大 SQL 数量，以及串行执行的 RPS
+    """
+    for i in range(warmup):
+        send_request(i)
+
+    latencies, query_counts = [], []
+    started_at = time.perf_counter()
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as queries:
+            request_started_at = time.perf_counter()
+            response = send_request(i)
+            latencies.append((time.perf_counter() - request_started_at) * 1000)
+        if response.status_code >= 400:
+            raise AssertionError('request {} failed with {}: {}'.format(
+                i,
+                response.status_code,
+                response.content[:200],
+            ))
+        query_counts.append(len(queries))
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries_avg': round(sum(query_counts) / float(iterations), 2),
+        'queries_max': max(query_counts),
+        'rps': round(iterations / elapsed, 1),
+    }
+
+
+def format_report(results, baseline=None):
+    """
+    baseline 是之前存下来的同样格式的 results，有的话在每一项后面打出变化的百分比
+    """
+    columns = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_avg', 'rps')
+    lines = ['{:<20}'.format('endpoint') + ''.join('{:>22}'.format(c) for c in columns)]
+    for name, result in results.items():
+        cells = []
+        for column in columns:
+            cell = '{}'.format(result[column])
+            if baseline and name in baseline and baseline[name].get(column):
+                change = (result[column] - baseline[name][column]) * 100.0 / baseline[name][column]
+                cell += ' ({:+.0f}%)'.format(change)
+            cells.append('{:>22}'.format(cell))
+        lines.append('{:<20}'.format(name) + ''.join(cells))
+    return '\n'.join(lines)
+
+
+def load_report(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(path, report):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
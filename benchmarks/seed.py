@@ -0,0 +1,121 @@
+import random
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from comments.models import Comment
+from friendships.models import Friendship
+from likes.models import Like
+from likes.registry import LikeableRegistry
+from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
+
+BULK_BATCH_SIZE = 1000
+
+
+class GraphConfig(object):
+    """
+    合成的社交网络的规模，所有参数都可以用环境变量 BENCH_<NAME 大写> 覆盖，比如 BENCH_USERS=1000
+    """
+    defaults = {
+        'users': 100,
+        'followings_per_user': 20,
+        'tweets_per_user': 10,
+        'likes_per_tweet': 3,
+        'comments_per_tweet': 3,
+        'seed': 42,
+    }
+
+    def __init__(self, **kwargs):
+        for name, default in self.defaults.items():
+            setattr(self, name, int(kwargs.get(name, default)))
+
+    @classmethod
+    def from_env(cls, environ):
+        return cls(**{
+            name: environ['BENCH_' + name.upper()]
+            for name in cls.defaults
+            if 'BENCH_' + name.upper() in environ
+        })
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.defaults}
+
+
+def _ids(model_class, **filters):
+    return list(model_class.objects.filter(**filters).order_by('id').values_list('id', flat=True))
+
+
+def seed_graph(config):
+    """
+    用 bulk_create 造一个社交网络：users, friendships, tweets, newsfeeds, comments, likes
+    bulk_create 不会触发 signal，所以 newsfeeds 直接按照 fanout 的结果写进去，
+    likes_count / comments_count 最后用 reconcile_counters 统一算一遍，
+    users 的 profile 和粉丝数、关注数用 recompute_follow_counts 补上
+    同一个 seed 造出来的数据是一样的，不同次的 benchmark 结果才可以互相比较
+    返回 {'user_ids': [...], 'tweet_ids': [...]}
+    """
+    rng = random.Random(config.seed)
+
+    User.objects.bulk_create([
+        User(username='bench{}'.format(i), email='bench{}@bench.com'.format(i))
+        for i in range(config.users)
+    ], batch_size=BULK_BATCH_SIZE)
+    user_ids = _ids(User, username__startswith='bench')
+
+    followings = {}
+    for user_id in user_ids:
+        candidates = [other_id for other_id in user_ids if other_id != user_id]
+        followings[user_id] = rng.sample(
+            candidates,
+            min(config.followings_per_user, len(candidates)),
+        )
+    Friendship.objects.bulk_create([
+        Friendship(from_user_id=from_user_id, to_user_id=to_user_id)
+        for from_user_id, to_user_ids in followings.items()
+        for to_user_id in to_user_ids
+    ], batch_size=BULK_BATCH_SIZE)
+    followers = {user_id: [] for user_id in user_ids}
+    for from_user_id, to_user_ids in followings.items():
+        for to_user_id in to_user_ids:
+            followers[to_user_id].append(from_user_id)
+
+    Tweet.objects.bulk_create([
+        Tweet(user_id=user_id, content='bench tweet {} of {}'.format(i, user_id))
+        for user_id in user_ids
+        for i in range(config.tweets_per_user)
+    ], batch_size=BULK_BATCH_SIZE)
+    tweets = list(Tweet.objects.filter(
+        user_id__in=user_ids,
+    ).order_by('id').values_list('id', 'user_id'))
+
+    NewsFeed.objects.bulk_create([
+        NewsFeed(user_id=user_id, tweet_id=tweet_id)
+        for tweet_id, author_id in tweets
+        for user_id in [author_id] + followers[author_id]
+    ], batch_size=BULK_BATCH_SIZE)
+
+    Comment.objects.bulk_create([
+        Comment(
+            user_id=rng.choice(user_ids),
+            tweet_id=tweet_id,
+            content='bench comment {}'.format(i),
+        )
+        for tweet_id, _ in tweets
+        for i in range(config.comments_per_tweet)
+    ], batch_size=BULK_BATCH_SIZE)
+
+    tweet_content_type_id = LikeableRegistry.get_content_type_id(Tweet)
+    Like.objects.bulk_create([
+        Like(content_type_id=tweet_content_type_id, object_id=tweet_id, user_id=user_id)
+        for tweet_id, _ in tweets
+        for user_id in rng.sample(user_ids, min(config.likes_per_tweet, len(user_ids)))
+    ], batch_size=BULK_BATCH_SIZE)
+
+    call_command('reconcile_counters', stdout=StringIO())
+    call_command('recompute_follow_counts', stdout=StringIO())
+    return {
+        'user_ids': user_ids,
+        'tweet_ids': [tweet_id for tweet_id, _ in tweets],
+    }
@@ -0,0 +1,11 @@
+from utils.paginations import KeysetPagination
+
+
+class CommentPagination(KeysetPagination):
+    """
+    评论默认按照时间正序，从最早的一条开始翻
+    ?order=desc 可以从最新的一条开始倒着翻
+    都是 (tweet, created_at) 联合索引上的一段区间扫描
+    """
+    descending = False
+    order_query_param = 'order'
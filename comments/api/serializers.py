@@ -1,8 +1,10 @@
 from accounts.api.serializers import UserSerializerForComment
 from comments.models import Comment
+from likes.services import LikeService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.hydration import HydratedListSerializer
 
 '''
 [DEBUG日志]：用不到的import要删掉，之前保留了import TweetSerializer，
@@ -14,7 +16,9 @@ from tweets.models import Tweet
 
 class CommentSerializer(serializers.ModelSerializer):
     # 如果不加这个user = UserSerializer(),fields里的user只有id
-    user = UserSerializerForComment()
+    user = UserSerializerForComment(source='cached_user')
+    has_liked = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()
     # tweet = TweetSerializer()
     '''
     只需要返回tweet_id，因为comment是基于某一个tweet,
@@ -28,7 +32,23 @@ class CommentSerializer(serializers.ModelSerializer):
                   'user',
                   'content',
                   'created_at',
-                  'updated_at',)
+                  'updated_at',
+                  'likes_count',
+                  'has_liked',)
+        # 序列化一组 comments 的时候，所有评论的 user 用一次 multi-get 取出来
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('user',)
+
+    def batch_load(self, instances):
+        # 一组 comments 的 has_liked 用一条 query 查出来
+        LikeService.prefetch_has_liked(self.context, instances)
+        LikeService.prefetch_likes_count(self.context, instances)
+
+    def get_has_liked(self, obj):
+        return LikeService.has_liked(self.context, obj)
+
+    def get_likes_count(self, obj):
+        return LikeService.get_likes_count(self.context, obj)
 
 
 class CommentSerializerForCreate(serializers.ModelSerializer):
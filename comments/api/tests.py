@@ -135,3 +135,63 @@ class CommentApiTests(TestCase):
             'user_id': self.linghu.id,
         })
         self.assertEqual(len(response.data['comments']), 2)
+
+    def test_pagination(self):
+        comments = [
+            self.create_comment(self.create_user('user{}'.format(i)), self.tweet, str(i))
+            for i in range(7)
+        ]
+        ids = [comment.id for comment in comments]
+
+        # 默认从最早的开始
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'page_size': 3,
+        })
+        self.assertEqual([c['id'] for c in response.data['comments']], ids[:3])
+        self.assertEqual(response.data['has_next_page'], True)
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'page_size': 3,
+            'after': response.data['after_cursor'],
+        })
+        self.assertEqual([c['id'] for c in response.data['comments']], ids[3:6])
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'page_size': 3,
+            'after': response.data['after_cursor'],
+        })
+        self.assertEqual([c['id'] for c in response.data['comments']], ids[6:])
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 从最新的开始
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'page_size': 3,
+            'order': 'desc',
+        })
+        self.assertEqual([c['id'] for c in response.data['comments']], ids[:3:-1])
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'page_size': 3,
+            'order': 'desc',
+            'before': response.data['before_cursor'],
+        })
+        self.assertEqual([c['id'] for c in response.data['comments']], ids[3:0:-1])
+        self.assertEqual(response.data['has_next_page'], True)
+
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'order': 'newest',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_query_count(self):
+        for i in range(5):
+            self.create_comment(self.create_user('user{}'.format(i)), self.tweet)
+        self.clear_cache()
+        # filterset 检查 tweet 是否存在一条，查 comments 一条，批量查 users 一条
+        # 和评论的数量无关
+        with self.assertNumQueries(3):
+            response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(len(response.data['comments']), 5)
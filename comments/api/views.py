@@ -2,6 +2,7 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
+from comments.api.paginations import CommentPagination
 from comments.api.permissions import IsObjectOwner
 from comments.models import Comment
 from comments.api.serializers import (
@@ -24,6 +25,7 @@ class CommentViewSet(viewsets.GenericViewSet):
     serializer_class = CommentSerializerForCreate
     queryset = Comment.objects.all()
     filterset_fields = ('tweet_id',)
+    pagination_class = CommentPagination
 
     # POST /api/comments/ -> create
     # GET /api/comments/?tweet_id=1 -> list  末尾没有/！！，找了好久的bug，气死我了
@@ -58,11 +60,22 @@ class CommentViewSet(viewsets.GenericViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
             """
-        queryset = self.get_queryset()
-        comments = self.filter_queryset(queryset).order_by('created_at')
-        serializer = CommentSerializer(comments, many=True)
+        # 每次只取一页，热门的 tweet 评论再多，一个 response 最多也只有 max_page_size 条
+        # 对应 SQL: where tweet_id = xxx and (created_at > x or (created_at = x and id > y))
+        # order by created_at, id limit page_size + 1
+        # 这一页的评论的 user 在 CommentSerializer 的 list serializer 里一次性批量取出来
+        queryset = self.filter_queryset(self.get_queryset())
+        comments = self.paginate_queryset(queryset)
+        serializer = CommentSerializer(
+            comments,
+            context={'request': request},
+            many=True,
+        )
         return Response(
-            {'comments': serializer.data},
+            {
+                'comments': serializer.data,
+                **self.paginator.get_page_info(),
+            },
             status=status.HTTP_200_OK,
         )
 
@@ -85,7 +98,7 @@ class CommentViewSet(viewsets.GenericViewSet):
         # save 方法会触发 serializer 里的 create 方法，点进 save 的具体实现里可以看到
         comment = serializer.save()
         return Response(
-            CommentSerializer(comment).data,
+            CommentSerializer(comment, context={'request': request}).data,
             status=status.HTTP_201_CREATED,
         )
 
@@ -106,7 +119,7 @@ class CommentViewSet(viewsets.GenericViewSet):
         # save 是根据 instance 参数有没有传来决定是触发 create 还是 update
         comment = serializer.save()
         return Response(
-            CommentSerializer(comment).data,
+            CommentSerializer(comment, context={'request': request}).data,
             status=status.HTTP_200_OK,
         )
 
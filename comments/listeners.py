@@ -0,0 +1,38 @@
+from django.db.models import F
+from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+
+
+def _update_comments_count(instance, delta):
+    if instance.tweet_id is None:
+        return
+    Tweet.objects.filter(id=instance.tweet_id).update(
+        comments_count=F('comments_count') + delta,
+    )
+    MemcachedHelper.invalidate_cached_object(Tweet, instance.tweet_id)
+
+
+def incr_comments_count(sender, instance, created, **kwargs):
+    if not created:
+        return
+    _update_comments_count(instance, 1)
+
+
+def decr_comments_count(sender, instance, **kwargs):
+    _update_comments_count(instance, -1)
+
+
+def push_comment_to_cache(sender, instance, created, **kwargs):
+    if not created or instance.tweet_id is None:
+        return
+
+    from comments.services import CommentService
+    CommentService.push_comment_to_cache(instance)
+
+
+def invalidate_cached_comments(sender, instance, **kwargs):
+    if instance.tweet_id is None:
+        return
+
+    from comments.services import CommentService
+    CommentService.invalidate_cached_comments(instance.tweet_id)
@@ -1,9 +1,17 @@
 from django.contrib.auth.models import User
-from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 
+from comments.listeners import (
+    decr_comments_count,
+    incr_comments_count,
+    invalidate_cached_comments,
+    push_comment_to_cache,
+)
 from likes.models import Like
+from likes.registry import LikeableRegistry
 from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
 
 
 class Comment(models.Model):
@@ -16,6 +24,8 @@ class Comment(models.Model):
     content = models.TextField(max_length=140)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 由 likes/listeners.py 维护
+    likes_count = models.IntegerField(default=0)
 
     class Meta:
         # 有在某个 tweet 下排序所有 comments 的需求
@@ -33,6 +43,20 @@ class Comment(models.Model):
     @property
     def like_set(self):
         return Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(Comment),
+            content_type_id=LikeableRegistry.get_content_type_id(Comment),
             object_id=self.id,
         ).order_by('-created_at')
+
+    @property
+    def cached_user(self):
+        return MemcachedHelper.get_related_object_through_cache(self, 'user')
+
+
+MemcachedHelper.register(Comment)
+# comment 可以被 like
+LikeableRegistry.register(Comment)
+post_save.connect(incr_comments_count, sender=Comment)
+post_delete.connect(decr_comments_count, sender=Comment)
+# 每个 tweet 的 comments 在 redis 里的 cache，见 comments/services.py
+post_save.connect(push_comment_to_cache, sender=Comment)
+post_delete.connect(invalidate_cached_comments, sender=Comment)
@@ -0,0 +1,42 @@
+from comments.models import Comment
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_helper import RedisHelper
+
+TWEET_COMMENTS_PATTERN = 'tweet_comments:{tweet_id}'
+
+
+class CommentService(object):
+    """
+    每个 tweet 最新的 REDIS_LIST_LENGTH_LIMIT 条 comments 缓存在 redis list 里，
+    TweetSerializerWithComments 渲染评论的时候不需要再去数据库里查
+    - 发评论的时候 push 到 list 的头上，见 comments/listeners.py
+    - 删评论的时候把整个 list 删掉，下次读的时候重新 load
+    - 改评论不需要动 list，评论的内容以 memcached 里的为准，memcached 在 save 的时候已经失效了
+    """
+
+    @classmethod
+    def get_cached_comments(cls, tweet_id):
+        """
+        返回按照时间正序排好的最新的 REDIS_LIST_LENGTH_LIMIT 条 comments
+        评论本身和评论的 user 都是用 multi-get 从 memcached 里批量取出来的
+        """
+        queryset = Comment.objects.filter(tweet_id=tweet_id).order_by('-created_at', '-id')
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=tweet_id)
+        comments = RedisHelper.load_objects(key, queryset, stats_name='tweet_comments')
+
+        # redis list 里的 likes_count 可能已经过期了，换成 memcached 里最新的
+        objects = MemcachedHelper.get_objects_through_cache(
+            Comment,
+            [comment.id for comment in comments],
+        )
+        comments = [objects[comment.id] for comment in comments if comment.id in objects]
+        return sorted(comments, key=lambda comment: (comment.created_at, comment.id))
+
+    @classmethod
+    def push_comment_to_cache(cls, comment):
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.push_object(key, comment)
+
+    @classmethod
+    def invalidate_cached_comments(cls, tweet_id):
+        RedisHelper.invalidate(TWEET_COMMENTS_PATTERN.format(tweet_id=tweet_id))
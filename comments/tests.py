@@ -1,4 +1,6 @@
+from comments.services import CommentService, TWEET_COMMENTS_PATTERN
 from testing.testcases import TestCase
+from utils.redis_client import RedisClient
 
 
 # 先测试Model,再migrate
@@ -24,4 +26,56 @@ class CommentModelTests(TestCase):
         self.create_like(dongxie, self.comment)
         self.assertEqual(self.comment.like_set.count(), 2)
 
+    def test_likes_count(self):
+        self.create_like(self.linghu, self.comment)
+        dongxie = self.create_user('dongxie')
+        self.create_like(dongxie, self.comment)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 2)
+        # 给 comment 点赞不会改到 tweet 的计数
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+        self.assertEqual(self.tweet.comments_count, 1)
+
+
+class CommentServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def test_get_cached_comments(self):
+        conn = RedisClient.get_connection()
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=self.tweet.id)
+        comments = [
+            self.create_comment(self.dongxie, self.tweet, str(i))
+            for i in range(3)
+        ]
+        self.create_comment(self.dongxie, self.create_tweet(self.dongxie))
+
+        # 按照时间正序
+        cached_comments = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual([c.id for c in cached_comments], [c.id for c in comments])
+        self.assertEqual(conn.llen(key), 3)
+
+        # 新的评论 push 进 cache
+        comment = self.create_comment(self.linghu, self.tweet, 'new')
+        cached_comments = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual(cached_comments[-1].id, comment.id)
+        self.assertEqual(conn.llen(key), 4)
+
+        # 修改评论和点赞之后读到的是最新的
+        comment.content = 'updated'
+        comment.save()
+        self.create_like(self.dongxie, comment)
+        cached_comments = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual(cached_comments[-1].content, 'updated')
+        self.assertEqual(cached_comments[-1].likes_count, 1)
+        self.assertEqual(conn.llen(key), 4)
 
+        # 删除评论会让整个 cache 失效
+        comment.delete()
+        self.assertEqual(conn.exists(key), 0)
+        cached_comments = CommentService.get_cached_comments(self.tweet.id)
+        self.assertEqual([c.id for c in cached_comments], [c.id for c in comments])
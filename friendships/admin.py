@@ -1,5 +1,5 @@
 from django.contrib import admin
-from friendships.models import Friendship
+from friendships.models import Friendship, FollowSuggestion
 
 
 @admin.register(Friendship)
@@ -8,6 +8,11 @@ class FriendshipAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 
+@admin.register(FollowSuggestion)
+class FollowSuggestionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'suggested_user', 'mutual_count', 'created_at')
+
+
 '''
 在 localhost/admin/管理界面的呈现方式
 '''
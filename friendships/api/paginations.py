@@ -0,0 +1,18 @@
+from utils.paginations import KeysetPagination
+
+
+class FollowSuggestionPagination(KeysetPagination):
+    """
+    可能认识的人按照共同关注的人数从多到少翻页，cursor 是 <mutual_count>_<id>
+    都是 (user, mutual_count) 联合索引上的一段区间扫描
+    """
+    cursor_field = 'mutual_count'
+
+    def format_cursor_value(self, value):
+        return str(value)
+
+    def parse_cursor_value(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            return None
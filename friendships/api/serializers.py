@@ -1,9 +1,13 @@
 from django.contrib.auth.models import User
 
 from accounts.api.serializers import UserSerializerForFriendship
-from friendships.models import Friendship
+from friendships.models import FollowSuggestion, Friendship
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from utils.hydration import HydratedListSerializer
+
+# 批量查关注状态、批量关注和取关一次最多能传多少个 user id
+MAX_BATCH_USER_IDS = 300
 
 
 class FriendshipSerializerForCreate(serializers.ModelSerializer):
@@ -42,29 +46,59 @@ class FriendshipSerializerForCreate(serializers.ModelSerializer):
     def create(self, validated_data):
         from_user_id = validated_data['from_user_id']
         to_user_id = validated_data['to_user_id']
-        return Friendship.objects.create(
+        # 重复关注的判断用的是 redis 里的 set，万一和数据库不一致，
+        # 用 get_or_create 兜底，不会因为 unique_together 报错
+        instance, _ = Friendship.objects.get_or_create(
             from_user_id=from_user_id,
             to_user_id=to_user_id,
         )
+        return instance
+
+
+class FriendshipBatchSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BATCH_USER_IDS,
+    )
+
+    def validate_user_ids(self, user_ids):
+        # 去重，保留原来的顺序
+        return list(dict.fromkeys(user_ids))
 
 
 # 可以通过 source=xxx 指定去访问每个 model instance 的 xxx 方法
 # 即 model_instance.xxx 来获得数据
 # https://www.django-rest-framework.org/api-guide/serializers/#specifying-fields-explicitly
 class FollowerSerializer(serializers.ModelSerializer):
-    user = UserSerializerForFriendship(source='from_user')
+    user = UserSerializerForFriendship(source='cached_from_user')
     # created_at = serializers.DateTimeField()
     # 可以注释掉，因为Friendship这个model里面本身也定义了created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         model = Friendship
         fields = ('user', 'created_at')
+        # 一页粉丝的 user 用一次 multi-get 取出来，memcached 里没有的再用一次 in_bulk 去数据库里取
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('from_user',)
 
 
 class FollowingSerializer(serializers.ModelSerializer):
-    user = UserSerializerForFriendship(source='to_user')
+    user = UserSerializerForFriendship(source='cached_to_user')
     # created_at = serializers.DateTimeField()
 
     class Meta:
         model = Friendship
         fields = ('user', 'created_at')
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('to_user',)
+
+
+class FollowSuggestionSerializer(serializers.ModelSerializer):
+    user = UserSerializerForFriendship(source='cached_suggested_user')
+
+    class Meta:
+        model = FollowSuggestion
+        fields = ('user', 'mutual_count')
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('suggested_user',)
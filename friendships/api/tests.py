@@ -1,11 +1,20 @@
-from friendships.models import Friendship
+from friendships.api.serializers import MAX_BATCH_USER_IDS
+from friendships.models import FollowSuggestion, Friendship
+from newsfeeds.models import NewsFeed
+from newsfeeds.tasks import backfill_newsfeeds_task, cleanup_newsfeeds_task
 from rest_framework.test import APIClient
+from rest_framework.throttling import ScopedRateThrottle
+from unittest import mock
 from testing.testcases import TestCase
 
 FOLLOW_URL = '/api/friendships/{}/follow/'
 UNFOLLOW_URL = '/api/friendships/{}/unfollow/'
 FOLLOWERS_URL = '/api/friendships/{}/followers/'
 FOLLOWINGS_URL = '/api/friendships/{}/followings/'
+STATUSES_URL = '/api/friendships/statuses/'
+BATCH_FOLLOW_URL = '/api/friendships/batch_follow/'
+BATCH_UNFOLLOW_URL = '/api/friendships/batch_unfollow/'
+SUGGESTIONS_URL = '/api/friendships/suggestions/'
 
 
 class FriendshipApiTests(TestCase):
@@ -98,6 +107,150 @@ class FriendshipApiTests(TestCase):
         self.assertEqual(response.data['deleted'], 0)
         self.assertEqual(Friendship.objects.count(), count)
 
+    def test_follow_and_unfollow_update_newsfeeds(self):
+        tweet = self.create_tweet(self.linghu)
+        # follow 之后把 linghu 的 tweets 补进 dongxie 的 newsfeed
+        self.dongxie_client.post(FOLLOW_URL.format(self.linghu.id))
+        self.assertEqual(
+            NewsFeed.objects.filter(user=self.dongxie, tweet=tweet).exists(),
+            True,
+        )
+        # unfollow 之后删掉
+        self.dongxie_client.post(UNFOLLOW_URL.format(self.linghu.id))
+        self.assertEqual(
+            NewsFeed.objects.filter(user=self.dongxie, tweet=tweet).exists(),
+            False,
+        )
+
+    def test_follow_is_throttled(self):
+        with mock.patch.dict(ScopedRateThrottle.THROTTLE_RATES, {'friendship': '2/min'}):
+            response = self.dongxie_client.post(FOLLOW_URL.format(self.linghu.id))
+            self.assertEqual(response.status_code, 201)
+            response = self.dongxie_client.post(UNFOLLOW_URL.format(self.linghu.id))
+            self.assertEqual(response.status_code, 200)
+            response = self.dongxie_client.post(FOLLOW_URL.format(self.linghu.id))
+            self.assertEqual(response.status_code, 429)
+            # 每个用户单独计数
+            response = self.linghu_client.post(FOLLOW_URL.format(self.dongxie.id))
+            self.assertEqual(response.status_code, 201)
+
+    def test_statuses(self):
+        following = Friendship.objects.filter(from_user=self.dongxie).first().to_user
+        url = '{}?user_ids={},{}'.format(STATUSES_URL, following.id, self.linghu.id)
+        # 需要登录
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.status_code, 403)
+        # user_ids 不能为空，也不能超过上限
+        response = self.dongxie_client.get(STATUSES_URL)
+        self.assertEqual(response.status_code, 400)
+        response = self.dongxie_client.get('{}?user_ids={}'.format(
+            STATUSES_URL,
+            ','.join(str(i) for i in range(1, MAX_BATCH_USER_IDS + 2)),
+        ))
+        self.assertEqual(response.status_code, 400)
+        response = self.dongxie_client.get('{}?user_ids=a'.format(STATUSES_URL))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.dongxie_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['statuses'], [
+            {'user_id': following.id, 'has_followed': True},
+            {'user_id': self.linghu.id, 'has_followed': False},
+        ])
+        # 第二次只用 redis 里的 set，不查 friendship 表
+        with self.assertNumQueries(0):
+            self.dongxie_client.get(url)
+
+    def test_batch_follow_and_unfollow(self):
+        tweet = self.create_tweet(self.linghu)
+        users = [self.create_user('user{}'.format(i)) for i in range(3)]
+        user_ids = [self.linghu.id] + [user.id for user in users]
+
+        response = self.anonymous_client.post(BATCH_FOLLOW_URL, {'user_ids': user_ids})
+        self.assertEqual(response.status_code, 403)
+        response = self.dongxie_client.post(BATCH_FOLLOW_URL, {'user_ids': []})
+        self.assertEqual(response.status_code, 400)
+
+        count = Friendship.objects.count()
+        # 关注了多少人都只放一个补 newsfeed 的任务
+        with mock.patch(
+            'newsfeeds.services.backfill_newsfeeds_task.delay',
+            wraps=backfill_newsfeeds_task.delay,
+        ) as delay:
+            response = self.dongxie_client.post(
+                BATCH_FOLLOW_URL,
+                {'user_ids': user_ids + [self.dongxie.id, user_ids[0]]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        delay.assert_called_once_with(self.dongxie.id, user_ids)
+        self.assertEqual(response.data['followed_user_ids'], user_ids)
+        self.assertEqual(Friendship.objects.count(), count + 4)
+        # 被关注的人的 tweets 会补进 newsfeed
+        self.assertEqual(
+            NewsFeed.objects.filter(user=self.dongxie, tweet=tweet).exists(),
+            True,
+        )
+        # 重复关注静默成功
+        response = self.dongxie_client.post(
+            BATCH_FOLLOW_URL,
+            {'user_ids': user_ids},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['followed_user_ids'], [])
+
+        with mock.patch(
+            'newsfeeds.services.cleanup_newsfeeds_task.delay',
+            wraps=cleanup_newsfeeds_task.delay,
+        ) as delay:
+            response = self.dongxie_client.post(
+                BATCH_UNFOLLOW_URL,
+                {'user_ids': user_ids[:2]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(delay.call_count, 1)
+        self.assertSetEqual(set(response.data['unfollowed_user_ids']), set(user_ids[:2]))
+        self.assertEqual(Friendship.objects.count(), count + 2)
+        self.assertEqual(
+            NewsFeed.objects.filter(user=self.dongxie, tweet=tweet).exists(),
+            False,
+        )
+
+    def test_suggestions(self):
+        for i in range(3):
+            FollowSuggestion.objects.create(
+                user=self.linghu,
+                suggested_user=self.create_user('suggested{}'.format(i)),
+                mutual_count=i,
+            )
+        FollowSuggestion.objects.create(user=self.dongxie, suggested_user=self.linghu)
+
+        response = self.anonymous_client.get(SUGGESTIONS_URL)
+        self.assertEqual(response.status_code, 403)
+
+        # 按共同关注的人数从多到少
+        response = self.linghu_client.get(SUGGESTIONS_URL, {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(s['user']['username'], s['mutual_count']) for s in response.data['suggestions']],
+            [('suggested2', 2), ('suggested1', 1)],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+        response = self.linghu_client.get(SUGGESTIONS_URL, {
+            'page_size': 2,
+            'before': response.data['before_cursor'],
+        })
+        self.assertEqual(
+            [s['user']['username'] for s in response.data['suggestions']],
+            ['suggested0'],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        response = self.linghu_client.get(SUGGESTIONS_URL, {'before': 'bad_1'})
+        self.assertEqual(response.status_code, 400)
+
     def test_followings(self):
         url = FOLLOWINGS_URL.format(self.dongxie.id)
         # post is not allowed
@@ -147,3 +300,59 @@ class FriendshipApiTests(TestCase):
             response.data['followers'][1]['user']['username'],
             'dongxie_follower0',
         )
+
+    def test_followers_pagination(self):
+        celebrity = self.create_user('celebrity')
+        for i in range(7):
+            self.create_friendship(self.create_user('fan{}'.format(i)), celebrity)
+        url = FOLLOWERS_URL.format(celebrity.id)
+
+        self.clear_cache()
+        # 一条查 friendships，一条批量查 users，和一页有多少人无关
+        with self.assertNumQueries(2):
+            response = self.anonymous_client.get(url, {'page_size': 4})
+        self.assertEqual(
+            [f['user']['username'] for f in response.data['followers']],
+            ['fan6', 'fan5', 'fan4', 'fan3'],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+        response = self.anonymous_client.get(url, {
+            'page_size': 4,
+            'before': response.data['before_cursor'],
+        })
+        self.assertEqual(
+            [f['user']['username'] for f in response.data['followers']],
+            ['fan2', 'fan1', 'fan0'],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 下拉刷新，拿到新的粉丝
+        after_cursor = response.data['after_cursor']
+        self.create_friendship(self.create_user('new_fan'), celebrity)
+        response = self.anonymous_client.get(url, {'after': after_cursor, 'page_size': 3})
+        self.assertEqual(
+            [f['user']['username'] for f in response.data['followers']],
+            ['fan5', 'fan4', 'fan3'],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+    def test_followings_pagination(self):
+        fan = self.create_user('fan')
+        for i in range(5):
+            self.create_friendship(fan, self.create_user('idol{}'.format(i)))
+        url = FOLLOWINGS_URL.format(fan.id)
+        response = self.anonymous_client.get(url, {'page_size': 3})
+        self.assertEqual(
+            [f['user']['username'] for f in response.data['followings']],
+            ['idol4', 'idol3', 'idol2'],
+        )
+        response = self.anonymous_client.get(url, {
+            'page_size': 3,
+            'before': response.data['before_cursor'],
+        })
+        self.assertEqual(
+            [f['user']['username'] for f in response.data['followings']],
+            ['idol1', 'idol0'],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
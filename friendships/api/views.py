@@ -2,13 +2,20 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from friendships.models import Friendship
+from rest_framework.throttling import ScopedRateThrottle
+from friendships.api.paginations import FollowSuggestionPagination
+from friendships.models import FollowSuggestion, Friendship
+from friendships.services import FriendshipService
 from friendships.api.serializers import (
+    FriendshipBatchSerializer,
     FollowingSerializer,
     FollowerSerializer,
+    FollowSuggestionSerializer,
     FriendshipSerializerForCreate,
 )
 from django.contrib.auth.models import User
+from newsfeeds.services import NewsFeedService
+from utils.paginations import KeysetPagination
 
 
 class FriendshipViewSet(viewsets.GenericViewSet):
@@ -19,6 +26,10 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     # queryset.filter(pk=1) 查询一下这个 object 在不在
     serializer_class = FriendshipSerializerForCreate
     queryset = User.objects.all()
+    pagination_class = KeysetPagination
+    # follow / unfollow 会触发异步的 newsfeed 补全和清理，限制频率，避免批量关注把数据库打满
+    # 频率在 settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] 里配置
+    throttle_scope = 'friendship'
     '''
     detail: 声明该action的路径是否与单一资源对应，及是否是xxx/<pk>/action方法名/
     True 表示路径格式是xxx/<pk>/action方法名/
@@ -36,24 +47,38 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         # 和直接设定user（User），然后就会有一个user_id 同理
         # to_uer 和 user 是同一种东西
         # GET /api/friendships/1/followers 去查看用户1的followers
-        # 在Friendship Model中定义了ordering，order_by可以删掉
-        friendships = Friendship.objects.filter(to_user_id=pk)  # .order_by('-created_at')
+        # 大 V 的粉丝可能有几百万，每次只取一页，用到 (to_user_id, created_at) 的联合索引
+        # where to_user_id = pk and (created_at < x or (created_at = x and id < y))
+        # order by created_at desc, id desc limit page_size + 1
+        friendships = self.paginate_queryset(Friendship.objects.filter(to_user_id=pk))
         serializer = FollowerSerializer(friendships, many=True)
         return Response(
-            {'followers': serializer.data},
+            {
+                'followers': serializer.data,
+                **self.paginator.get_page_info(),
+            },
             status=status.HTTP_200_OK,
         )
 
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followings(self, request, pk):
-        friendships = Friendship.objects.filter(from_user_id=pk)  # .order_by('-created_at')
+        # 用到 (from_user_id, created_at) 的联合索引
+        friendships = self.paginate_queryset(Friendship.objects.filter(from_user_id=pk))
         serializer = FollowingSerializer(friendships, many=True)
         return Response(
-            {'followings': serializer.data},
+            {
+                'followings': serializer.data,
+                **self.paginator.get_page_info(),
+            },
             status=status.HTTP_200_OK,
         )
 
-    @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
+    @action(
+        methods=['POST'],
+        detail=True,
+        permission_classes=[IsAuthenticated],
+        throttle_classes=[ScopedRateThrottle],
+    )
     def follow(self, request, pk):
         # POST /api/friendships/<pk>/follow follow<pk>用户
 
@@ -64,7 +89,8 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         # 特殊判断重复follow的情况（比如前端猛点好多少次follow)
         # 静默处理，不报错，因为这类重复操作因为网络延迟的原因会比较多，没必要当做错误处理
         # 也可以在serializer的raise exception里报错，写了注释可以看一看
-        if Friendship.objects.filter(from_user=request.user, to_user=pk).exists():
+        # 查 redis 里 request.user 关注的人的 set，不需要查数据库
+        if FriendshipService.has_followed(request.user.id, follow_user.id):
             return Response({
                 'success': True,
                 'duplicate': True,
@@ -78,13 +104,21 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 'success': False,
                 'errors': serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
+        # 关注之后 redis 里的 set 和粉丝数的 cache 会在 friendships/listeners.py 里更新
         instance = serializer.save()
+        # 异步地把被关注的人最新的 tweets 补进自己的 newsfeed
+        NewsFeedService.backfill_newsfeeds(request.user.id, [follow_user.id])
         return Response(
             FollowingSerializer(instance).data,
             status=status.HTTP_201_CREATED,
         )
 
-    @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
+    @action(
+        methods=['POST'],
+        detail=True,
+        permission_classes=[IsAuthenticated],
+        throttle_classes=[ScopedRateThrottle],
+    )
     def unfollow(self, request, pk):
         # pk不存在时会返回错误
         self.get_object()
@@ -97,15 +131,102 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 'success': False,
                 'message': 'You cannot unfollow yourself',
             }, status=status.HTTP_400_BAD_REQUEST)
-        # https://docs.djangoproject.com/en/3.1/ref/models/querysets/#delete
-        # Queryset 的 delete 操作返回两个值，一个是删了多少数据，一个是具体每种类型删了多少
-        # 为什么会出现多种类型数据的删除？因为可能因为 foreign key 设置了 cascade 出现级联
-        # 删除，也就是比如 A model 的某个属性是 B model 的 foreign key，并且设置了
-        # on_delete=models.CASCADE, 那么当 B 的某个数据被删除的时候，A 中的关联也会被删除。
-        # 所以 CASCADE 是很危险的，我们一般最好不要用，而是用 on_delete=models.SET_NULL (Model里的设置)
-        # 取而代之，这样至少可以避免误删除操作带来的多米诺效应。
-        deleted, _ = Friendship.objects.filter(
-            from_user=request.user,
-            to_user=pk,
-        ).delete()
+        # 不用 Friendship.objects.filter(...).delete()，并发取关的时候粉丝数会被减两次
+        # 见 FriendshipService.unfollow
+        deleted = 1 if FriendshipService.unfollow(request.user.id, int(pk)) else 0
+        if deleted:
+            # 异步地把被取关的人的 tweets 从自己的 newsfeed 里分批删掉
+            NewsFeedService.cleanup_newsfeeds(request.user.id, [int(pk)])
         return Response({'success': True, 'deleted': deleted})
+
+    @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated])
+    def statuses(self, request):
+        # GET /api/friendships/statuses/?user_ids=1,2,3
+        # 列表页上每个人的关注按钮，一次请求查完，只用到 redis 里当前用户关注的人的 set
+        user_ids = [
+            user_id
+            for user_id in request.query_params.get('user_ids', '').split(',')
+            if user_id
+        ]
+        serializer = FriendshipBatchSerializer(data={'user_ids': user_ids})
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        user_ids = serializer.validated_data['user_ids']
+        statuses = FriendshipService.get_follow_statuses(request.user.id, user_ids)
+        return Response({
+            'statuses': [
+                {'user_id': user_id, 'has_followed': statuses[user_id]}
+                for user_id in user_ids
+            ],
+        }, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        throttle_classes=[ScopedRateThrottle],
+    )
+    def batch_follow(self, request):
+        # POST /api/friendships/batch_follow/ {"user_ids": [1, 2, 3]}
+        # 注册之后的推荐关注页一次关注多个人，所有的 friendship 用一条 bulk_create 写进去
+        serializer = FriendshipBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        followed_ids = FriendshipService.follow_many(
+            request.user.id,
+            serializer.validated_data['user_ids'],
+        )
+        # 所有新关注的人一起放进一个补 newsfeed 的任务
+        NewsFeedService.backfill_newsfeeds(request.user.id, followed_ids)
+        return Response({
+            'success': True,
+            'followed_user_ids': followed_ids,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        throttle_classes=[ScopedRateThrottle],
+    )
+    def batch_unfollow(self, request):
+        # POST /api/friendships/batch_unfollow/ {"user_ids": [1, 2, 3]}
+        serializer = FriendshipBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        unfollowed_ids = FriendshipService.unfollow_many(
+            request.user.id,
+            serializer.validated_data['user_ids'],
+        )
+        NewsFeedService.cleanup_newsfeeds(request.user.id, unfollowed_ids)
+        return Response({
+            'success': True,
+            'unfollowed_user_ids': unfollowed_ids,
+        }, status=status.HTTP_200_OK)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=FollowSuggestionPagination,
+    )
+    def suggestions(self, request):
+        # GET /api/friendships/suggestions/ 可能认识的人，按共同关注的人数从多到少
+        # 离线算好的结果，见 python manage.py compute_follow_suggestions
+        suggestions = self.paginate_queryset(
+            FollowSuggestion.objects.filter(user_id=request.user.id),
+        )
+        serializer = FollowSuggestionSerializer(suggestions, many=True)
+        return Response({
+            'suggestions': serializer.data,
+            **self.paginator.get_page_info(),
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,17 @@
+def friendship_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+
+    from accounts.services import UserService
+    from friendships.services import FollowSuggestionService, FriendshipService
+    FriendshipService.add_to_cached_id_sets(instance.from_user_id, instance.to_user_id)
+    UserService.update_follow_counts(instance.from_user_id, [instance.to_user_id], 1)
+    FollowSuggestionService.remove_suggestions(instance.from_user_id, [instance.to_user_id])
+
+
+def friendship_deleted(sender, instance, **kwargs):
+    # 粉丝数不在这里减：post_delete 在 DELETE 没有删到任何行的时候也会发，并发取关的时候会减两次
+    # 取关要用 FriendshipService.unfollow / unfollow_many，看 DELETE 影响的行数再改计数
+    # 这里只把 redis 里的 set 更新一下，SREM 是幂等的，其他地方删掉的也不会留在 cache 里
+    from friendships.services import FriendshipService
+    FriendshipService.remove_from_cached_id_sets(instance.from_user_id, instance.to_user_id)
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from friendships.services import FOLLOW_SUGGESTION_TOP_K, FollowSuggestionService
+
+
+class Command(BaseCommand):
+    """
+    python manage.py compute_follow_suggestions [--batch-size 200] [--top-k 50]
+    按 user id 分批重新计算每个用户可能认识的人，每一批整批替换掉旧的结果
+    batch 越大查询越少，但是一批用户的二度关系都要放在内存里，关注的人多的话 batch 要调小
+    """
+    help = 'Precompute top-K follow suggestions by mutual follows in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=FOLLOW_SUGGESTION_TOP_K)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        top_k = options['top_k']
+
+        users, suggestions = 0, 0
+        last_id = 0
+        while True:
+            # 按 id 翻页，不用 OFFSET
+            user_ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            suggestions += FollowSuggestionService.refresh_suggestions(user_ids, top_k)
+            users += len(user_ids)
+
+        self.stdout.write('{} users, {} suggestions computed'.format(users, suggestions))
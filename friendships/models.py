@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
+from friendships.listeners import friendship_created, friendship_deleted
+from utils.memcached_helper import MemcachedHelper
 
 '''
 为什么要设一个 related_name='following_friendship_set' ，否则会报错？
@@ -39,3 +42,54 @@ class Friendship(models.Model):
 
     def __str__(self):
         return '{} followed {}'.format(self.from_user_id, self.to_user_id)
+
+    @property
+    def cached_from_user(self):
+        return MemcachedHelper.get_related_object_through_cache(self, 'from_user')
+
+    @property
+    def cached_to_user(self):
+        return MemcachedHelper.get_related_object_through_cache(self, 'to_user')
+
+
+class FollowSuggestion(models.Model):
+    """
+    可能认识的人，离线算好存在这里，读的时候直接按 (user, mutual_count) 的联合索引翻页
+    user 关注的人里有 mutual_count 个人关注了 suggested_user
+    用 python manage.py compute_follow_suggestions 重新计算
+    这里的数据都是算出来的，user 或者 suggested_user 被删掉之后这条推荐就没有意义了，
+    所以和 Friendship 不一样，用 CASCADE 一起删掉，不会留下 suggested_user 是 null 的推荐
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='follow_suggestion_set',
+    )
+    suggested_user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    mutual_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = (('user', 'mutual_count'),)
+        unique_together = (('user', 'suggested_user'),)
+        ordering = ('-mutual_count',)
+
+    def __str__(self):
+        return '{} may know {} ({} mutual)'.format(
+            self.user_id,
+            self.suggested_user_id,
+            self.mutual_count,
+        )
+
+    @property
+    def cached_suggested_user(self):
+        return MemcachedHelper.get_related_object_through_cache(self, 'suggested_user')
+
+
+# 关注 / 取关的时候增量更新 redis 里的粉丝 id 和关注 id 的 set
+post_save.connect(friendship_created, sender=Friendship)
+post_delete.connect(friendship_deleted, sender=Friendship)
@@ -1,4 +1,24 @@
-from friendships.models import Friendship
+import heapq
+from collections import Counter, defaultdict
+
+from accounts.services import UserService
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Q
+from friendships.models import FollowSuggestion, Friendship
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+
+# redis 里存每个用户的粉丝 id 和关注的人的 id
+FOLLOWERS_PATTERN = 'followers:{user_id}'
+FOLLOWINGS_PATTERN = 'followings:{user_id}'
+EMPTY_SET_PLACEHOLDER = 0
+ID_SET_LOAD_BATCH_SIZE = 1000
+# 每个用户最多存多少个可能认识的人
+FOLLOW_SUGGESTION_TOP_K = 50
+# 一条 IN Query 里最多放多少个 id
+ID_IN_QUERY_BATCH_SIZE = 1000
 
 
 class FriendshipService(object):
@@ -34,3 +54,351 @@ class FriendshipService(object):
             to_user=user,
         ).prefetch_related('from_user')
         return [friendship.from_user for friendship in friendships]
+
+    @classmethod
+    def _load_id_set(cls, key, id_queryset):
+        """
+        把一个 values_list('xxx_id', flat=True) 的 queryset 存成 redis 里的一个 set，返回读到的 id set
+        用 iterator 分批从数据库里读，分批 SADD
+        先写到一个临时的 key 里，写完再 RENAME，避免别的 request 读到写了一半的 set
+        读数据库的过程中有关注 / 取关的话，增量更新没有写进去，这一次就不写 cache，见 RedisHelper.commit_loading_key
+        """
+        conn = RedisClient.get_connection()
+        version = RedisHelper.get_version(key)
+        loading_key = RedisHelper.get_loading_key(key)
+        # 空的 set 在 redis 里是存不了的，放一个占位的 0 (user id 从 1 开始)，
+        # 表示这个 set 已经 load 过了，否则没有粉丝的用户每次都会去数据库里查
+        conn.sadd(loading_key, EMPTY_SET_PLACEHOLDER)
+        object_ids = set()
+        batch = []
+        for object_id in id_queryset.iterator(chunk_size=ID_SET_LOAD_BATCH_SIZE):
+            batch.append(object_id)
+            if len(batch) >= ID_SET_LOAD_BATCH_SIZE:
+                conn.sadd(loading_key, *batch)
+                object_ids.update(batch)
+                batch = []
+        if batch:
+            conn.sadd(loading_key, *batch)
+            object_ids.update(batch)
+        conn.expire(loading_key, settings.REDIS_KEY_EXPIRE_TIME)
+        RedisHelper.commit_loading_key(loading_key, key, version)
+        return object_ids
+
+    @classmethod
+    def _is_loaded(cls, key):
+        # 只有带着占位的 0 的 set 才是完整 load 过的，增量更新的时候 key 刚好被删掉，
+        # SADD 会新建一个不完整的 set，这种 set 没有占位，当作没有 load 过
+        conn = RedisClient.get_connection()
+        return bool(conn.sismember(key, EMPTY_SET_PLACEHOLDER))
+
+    @classmethod
+    def _get_id_set(cls, key, id_queryset):
+        conn = RedisClient.get_connection()
+        if not cls._is_loaded(key):
+            return cls._load_id_set(key, id_queryset)
+        return {
+            int(object_id)
+            for object_id in conn.smembers(key)
+            if int(object_id) != EMPTY_SET_PLACEHOLDER
+        }
+
+    @classmethod
+    def get_follower_ids(cls, user_id):
+        # fanout 只需要粉丝的 id，不需要把 User 取出来
+        # cache miss 的时候只查 friendship 表，会用到 (to_user_id, created_at) 的联合索引
+        key = FOLLOWERS_PATTERN.format(user_id=user_id)
+        # 不需要排序，order_by() 去掉 Meta 里默认的 ordering
+        queryset = Friendship.objects.filter(
+            to_user_id=user_id,
+        ).order_by().values_list('from_user_id', flat=True)
+        return list(cls._get_id_set(key, queryset))
+
+    @classmethod
+    def iter_follower_ranges(cls, user_id, batch_size):
+        """
+        把 user 的粉丝按照 (created_at, id) 切成每段 batch_size 个，yield (after, until)
+        after / until 是 (created_at, id) 的 cursor，after 是 None 表示从头开始，until 是 None 表示一直到最后
+        每一段只查出这一段最后一行的 cursor，走 (to_user_id, created_at) 的联合索引，
+        粉丝 id 留给处理这一段的地方自己去读，不管有多少粉丝，这里都只有两个 cursor 在内存里
+        不用 iterator(chunk_size=...) 流式地读粉丝 id，mysqlclient 会把整个结果集都读进内存
+        """
+        queryset = Friendship.objects.filter(to_user_id=user_id).order_by('created_at', 'id')
+        after = None
+        while True:
+            rows = list(
+                cls._filter_after(queryset, after)
+                .values_list('created_at', 'id')[batch_size - 1:batch_size]
+            )
+            if not rows:
+                break
+            yield after, rows[0]
+            after = rows[0]
+        # 最后不满 batch_size 的一段
+        if cls._filter_after(queryset, after).exists():
+            yield after, None
+
+    @classmethod
+    def get_follower_ids_in_range(cls, user_id, after, until):
+        # iter_follower_ranges 切出来的一段粉丝的 id，最多 batch_size 个
+        queryset = Friendship.objects.filter(to_user_id=user_id)
+        queryset = cls._filter_after(queryset, after)
+        if until is not None:
+            created_at, friendship_id = until
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=friendship_id),
+            )
+        return list(queryset.order_by().values_list('from_user_id', flat=True))
+
+    @classmethod
+    def _filter_after(cls, queryset, cursor):
+        if cursor is None:
+            return queryset
+        created_at, friendship_id = cursor
+        return queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=friendship_id),
+        )
+
+    @classmethod
+    def get_following_ids(cls, user_id):
+        # cache miss 的时候会用到 (from_user_id, created_at) 的联合索引
+        key = FOLLOWINGS_PATTERN.format(user_id=user_id)
+        queryset = Friendship.objects.filter(
+            from_user_id=user_id,
+        ).order_by().values_list('to_user_id', flat=True)
+        return list(cls._get_id_set(key, queryset))
+
+    @classmethod
+    def has_followed(cls, from_user_id, to_user_id):
+        # from_user 有没有关注 to_user，只需要一次 SISMEMBER
+        key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        conn = RedisClient.get_connection()
+        if not cls._is_loaded(key):
+            return to_user_id in cls.get_following_ids(from_user_id)
+        return bool(conn.sismember(key, to_user_id))
+
+    @classmethod
+    def get_follow_statuses(cls, from_user_id, to_user_ids):
+        """
+        批量判断 from_user 有没有关注 to_user_ids 里的每个人，返回 {to_user_id: bool}
+        直接用 redis 里 from_user 关注的人的 set，不管问多少个人都不需要查数据库
+        """
+        following_ids = set(cls.get_following_ids(from_user_id))
+        return {
+            to_user_id: to_user_id in following_ids
+            for to_user_id in to_user_ids
+        }
+
+    @classmethod
+    def follow_many(cls, from_user_id, to_user_ids):
+        """
+        一次关注多个人，返回这一次真正插进去的 user ids，只有这些会更新计数和 cache，调用的地方也只给这些补 newsfeed
+        已经关注过的、自己、不存在的用户会被跳过
+        所有的 friendship 用一条 bulk_create 写进去
+        """
+        following_ids = set(cls.get_following_ids(from_user_id))
+        candidate_ids = [
+            to_user_id
+            for to_user_id in to_user_ids
+            if to_user_id != from_user_id and to_user_id not in following_ids
+        ]
+        if not candidate_ids:
+            return []
+        existing_ids = set(
+            User.objects.filter(id__in=candidate_ids).values_list('id', flat=True)
+        )
+        friendships = [
+            Friendship(from_user_id=from_user_id, to_user_id=to_user_id)
+            for to_user_id in candidate_ids
+            if to_user_id in existing_ids
+        ]
+        if not friendships:
+            return []
+        # redis 里的 set 万一和数据库不一致，或者并发的请求已经关注了，
+        # ignore_conflicts 兜底，不会因为 unique_together 报错
+        Friendship.objects.bulk_create(friendships, ignore_conflicts=True)
+        # 被跳过的行不能再算一次粉丝数，也不能再补一次 newsfeed。bulk_create 拿不到哪些行插进去了，
+        # 用 (from_user_id, to_user_id) 的 unique 索引查回来，created_at 是 insert 的时候在 python 里生成的，
+        # 和这一次的一样才是这一次插进去的
+        inserted_at = dict(
+            Friendship.objects.filter(
+                from_user_id=from_user_id,
+                to_user_id__in=[friendship.to_user_id for friendship in friendships],
+            ).values_list('to_user_id', 'created_at')
+        )
+        new_ids = [
+            friendship.to_user_id
+            for friendship in friendships
+            if inserted_at.get(friendship.to_user_id) == friendship.created_at
+        ]
+        if not new_ids:
+            return []
+        # bulk_create 不会触发 post_save，friendships/listeners.py 里做的事情要在这里手动做
+        for to_user_id in new_ids:
+            cls.add_to_cached_id_sets(from_user_id, to_user_id)
+        UserService.update_follow_counts(from_user_id, new_ids, 1)
+        FollowSuggestionService.remove_suggestions(from_user_id, new_ids)
+        return new_ids
+
+    @classmethod
+    def unfollow(cls, from_user_id, to_user_id):
+        """
+        取关，返回这次调用是不是真的删掉了一个 friendship
+        queryset.delete() 会先 SELECT 再 DELETE，并且给 SELECT 出来的每一行都发 post_delete，
+        两个并发的取关都会 SELECT 到同一行，粉丝数会被减两次。
+        这里只执行一条 DELETE，影响的行数是 1 的时候才改计数和 cache，并发的时候只有一个能删到
+        """
+        with transaction.atomic():
+            unfollowed = cls._delete_friendship(from_user_id, to_user_id)
+            if unfollowed:
+                cls._after_unfollow(from_user_id, [to_user_id])
+        return unfollowed
+
+    @classmethod
+    def unfollow_many(cls, from_user_id, to_user_ids):
+        """
+        一次取关多个人，返回这一次真正取关了的 user ids
+        和 unfollow 一样每个人一条 DELETE，看影响的行数，调用的地方最多 MAX_BATCH_USER_IDS 个，
+        每条 DELETE 都只用到 (from_user_id, to_user_id) 的 unique 索引
+        """
+        with transaction.atomic():
+            unfollowed_ids = [
+                to_user_id
+                for to_user_id in to_user_ids
+                if cls._delete_friendship(from_user_id, to_user_id)
+            ]
+            if unfollowed_ids:
+                cls._after_unfollow(from_user_id, unfollowed_ids)
+        return unfollowed_ids
+
+    @classmethod
+    def _delete_friendship(cls, from_user_id, to_user_id):
+        connection = connections[Friendship.objects.db]
+        quote_name = connection.ops.quote_name
+        statement = 'DELETE FROM {} WHERE {} = %s AND {} = %s'.format(
+            quote_name(Friendship._meta.db_table),
+            quote_name(Friendship._meta.get_field('from_user').column),
+            quote_name(Friendship._meta.get_field('to_user').column),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(statement, [from_user_id, to_user_id])
+            return cursor.rowcount == 1
+
+    @classmethod
+    def _after_unfollow(cls, from_user_id, to_user_ids):
+        # 没有走 delete()，post_delete 不会触发，friendships/listeners.py 里做的事情要在这里手动做
+        for to_user_id in to_user_ids:
+            cls.remove_from_cached_id_sets(from_user_id, to_user_id)
+        UserService.update_follow_counts(from_user_id, to_user_ids, -1)
+
+    @classmethod
+    def add_to_cached_id_sets(cls, from_user_id, to_user_id):
+        # 增量更新，只更新已经 load 过的 set，没有 load 过的等下次读的时候从数据库 load
+        cls._update_cached_id_set(FOLLOWINGS_PATTERN, from_user_id, to_user_id, 'sadd')
+        cls._update_cached_id_set(FOLLOWERS_PATTERN, to_user_id, from_user_id, 'sadd')
+
+    @classmethod
+    def remove_from_cached_id_sets(cls, from_user_id, to_user_id):
+        cls._update_cached_id_set(FOLLOWINGS_PATTERN, from_user_id, to_user_id, 'srem')
+        cls._update_cached_id_set(FOLLOWERS_PATTERN, to_user_id, from_user_id, 'srem')
+
+    @classmethod
+    def _update_cached_id_set(cls, pattern, user_id, member_id, command):
+        conn = RedisClient.get_connection()
+        key = pattern.format(user_id=user_id)
+        # 先改版本号，正在 load 的 set 就知道自己可能漏掉了这一次修改
+        RedisHelper.bump_version(key)
+        if cls._is_loaded(key):
+            getattr(conn, command)(key, member_id)
+
+    @classmethod
+    def get_follower_counts(cls, user_ids):
+        """
+        批量获取粉丝数，返回 {user_id: followers_count}
+        用的是 profile 上用 F() 维护的 followers_count，不需要去 friendship 表里 COUNT(*)
+        profile 走 memcached，一次 multi-get，没有 profile 的用户当作 0
+        """
+        profiles = UserService.get_profiles(user_ids)
+        return {
+            user_id: profiles[user_id].followers_count if user_id in profiles else 0
+            for user_id in user_ids
+        }
+
+
+class FollowSuggestionService(object):
+    """
+    可能认识的人：我关注的人关注了谁，被越多我关注的人关注，排得越靠前
+    离线分批计算，每一批用户只需要两轮 IN Query 把关注关系读出来，之后都在内存里用 Counter 数，
+    不会对每个用户单独去数据库里查，结果只保留 top K 写进 FollowSuggestion 表
+    """
+
+    @classmethod
+    def get_following_id_sets(cls, user_ids):
+        """
+        批量读出每个用户关注的人，返回 {user_id: {to_user_id, ...}}
+        每 ID_IN_QUERY_BATCH_SIZE 个用户一条 IN Query，用到 (from_user_id, created_at) 的联合索引
+        """
+        user_ids = list(user_ids)
+        following_id_sets = defaultdict(set)
+        for start in range(0, len(user_ids), ID_IN_QUERY_BATCH_SIZE):
+            queryset = Friendship.objects.filter(
+                from_user_id__in=user_ids[start:start + ID_IN_QUERY_BATCH_SIZE],
+            ).order_by().values_list('from_user_id', 'to_user_id')
+            for from_user_id, to_user_id in queryset.iterator(chunk_size=ID_SET_LOAD_BATCH_SIZE):
+                following_id_sets[from_user_id].add(to_user_id)
+        return following_id_sets
+
+    @classmethod
+    def compute_suggestions(cls, user_ids, top_k=FOLLOW_SUGGESTION_TOP_K):
+        """
+        返回 {user_id: [(suggested_user_id, mutual_count), ...]}，按 mutual_count 从大到小
+        已经关注了的人和自己不会出现在结果里
+        """
+        following_id_sets = cls.get_following_id_sets(user_ids)
+        # 二度关系：我关注的人关注的人，这一批用户关注的人合在一起只读一次
+        followee_ids = set()
+        for following_ids in following_id_sets.values():
+            followee_ids.update(following_ids)
+        second_degree_id_sets = cls.get_following_id_sets(followee_ids)
+
+        suggestions = {}
+        for user_id in user_ids:
+            following_ids = following_id_sets.get(user_id, set())
+            mutual_counts = Counter()
+            for followee_id in following_ids:
+                mutual_counts.update(second_degree_id_sets.get(followee_id, ()))
+            for excluded_id in following_ids | {user_id}:
+                mutual_counts.pop(excluded_id, None)
+            # 只保留 top K，mutual_count 一样的时候 user id 小的在前面，保证结果是确定的
+            suggestions[user_id] = heapq.nsmallest(
+                top_k,
+                mutual_counts.items(),
+                key=lambda item: (-item[1], item[0]),
+            )
+        return suggestions
+
+    @classmethod
+    def refresh_suggestions(cls, user_ids, top_k=FOLLOW_SUGGESTION_TOP_K):
+        """
+        重新计算一批用户的可能认识的人，整批替换掉旧的结果，返回写进去了多少条
+        """
+        suggestions = cls.compute_suggestions(user_ids, top_k)
+        with transaction.atomic():
+            FollowSuggestion.objects.filter(user_id__in=user_ids).delete()
+            rows = FollowSuggestion.objects.bulk_create([
+                FollowSuggestion(
+                    user_id=user_id,
+                    suggested_user_id=suggested_user_id,
+                    mutual_count=mutual_count,
+                )
+                for user_id, items in suggestions.items()
+                for suggested_user_id, mutual_count in items
+            ])
+        return len(rows)
+
+    @classmethod
+    def remove_suggestions(cls, user_id, suggested_user_ids):
+        # 已经关注了的人不需要再推荐，关注的时候增量删掉，不用等下一次离线计算
+        FollowSuggestion.objects.filter(
+            user_id=user_id,
+            suggested_user_id__in=suggested_user_ids,
+        ).delete()
@@ -0,0 +1,247 @@
+from django.core.management import call_command
+from django.db import connection
+from friendships.models import FollowSuggestion, Friendship
+from friendships.services import (
+    FOLLOWINGS_PATTERN,
+    FollowSuggestionService,
+    FriendshipService,
+)
+from io import StringIO
+from testing.testcases import TestCase
+from unittest import mock
+
+
+class FriendshipServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+
+    def test_get_following_ids(self):
+        user1 = self.create_user('user1')
+        user2 = self.create_user('user2')
+        for to_user in [user1, user2, self.dongxie]:
+            self.create_friendship(self.linghu, to_user)
+
+        # 第一次从数据库 load，之后都走 redis
+        user_id_set = set(FriendshipService.get_following_ids(self.linghu.id))
+        self.assertSetEqual(user_id_set, {user1.id, user2.id, self.dongxie.id})
+        with self.assertNumQueries(0):
+            FriendshipService.get_following_ids(self.linghu.id)
+
+        # 关注 / 取关会增量更新 redis 里的 set
+        Friendship.objects.filter(from_user=self.linghu, to_user=self.dongxie).delete()
+        user3 = self.create_user('user3')
+        self.create_friendship(self.linghu, user3)
+        with self.assertNumQueries(0):
+            user_id_set = set(FriendshipService.get_following_ids(self.linghu.id))
+        self.assertSetEqual(user_id_set, {user1.id, user2.id, user3.id})
+
+    def test_get_follower_ids(self):
+        # 没有粉丝的情况也只查一次数据库
+        self.assertEqual(FriendshipService.get_follower_ids(self.linghu.id), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(FriendshipService.get_follower_ids(self.linghu.id), [])
+
+        self.create_friendship(self.dongxie, self.linghu)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                FriendshipService.get_follower_ids(self.linghu.id),
+                [self.dongxie.id],
+            )
+
+    def test_has_followed(self):
+        self.assertEqual(FriendshipService.has_followed(self.linghu.id, self.dongxie.id), False)
+        self.assertEqual(FriendshipService.has_followed(self.dongxie.id, self.linghu.id), False)
+        self.create_friendship(self.linghu, self.dongxie)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                FriendshipService.has_followed(self.linghu.id, self.dongxie.id),
+                True,
+            )
+            self.assertEqual(
+                FriendshipService.has_followed(self.dongxie.id, self.linghu.id),
+                False,
+            )
+
+    def test_follow_during_id_set_load(self):
+        user1 = self.create_user('user1')
+        key = FOLLOWINGS_PATTERN.format(user_id=self.linghu.id)
+        queryset = Friendship.objects.filter(
+            from_user_id=self.linghu.id,
+        ).order_by().values_list('to_user_id', flat=True)
+        test = self
+
+        class FollowWhileLoading(object):
+            # 模拟读数据库和 RENAME 之间，另一个 request 关注了 user1
+            def iterator(self, chunk_size):
+                object_ids = list(queryset)
+                test.create_friendship(test.linghu, user1)
+                return iter(object_ids)
+
+        self.assertEqual(FriendshipService._get_id_set(key, FollowWhileLoading()), set())
+        # 旧的 set 没有写进 cache，下次读的时候重新 load，不会漏掉这次关注
+        self.assertEqual(FriendshipService.has_followed(self.linghu.id, user1.id), True)
+
+    def test_get_follow_statuses(self):
+        user1 = self.create_user('user1')
+        self.create_friendship(self.linghu, user1)
+        FriendshipService.get_following_ids(self.linghu.id)
+        with self.assertNumQueries(0):
+            statuses = FriendshipService.get_follow_statuses(
+                self.linghu.id,
+                [user1.id, self.dongxie.id, 10000],
+            )
+        self.assertEqual(statuses, {user1.id: True, self.dongxie.id: False, 10000: False})
+
+    def test_iter_follower_ranges(self):
+        followers = [self.create_user('follower{}'.format(i)) for i in range(7)]
+        for follower in followers:
+            self.create_friendship(follower, self.linghu)
+        # created_at 相同的时候按 id 切，不会漏也不会重复
+        Friendship.objects.filter(from_user__in=followers[2:5]).update(
+            created_at=Friendship.objects.get(from_user=followers[2]).created_at,
+        )
+
+        # 每一段只查一行，和粉丝数无关
+        with self.assertNumQueries(4):
+            ranges = list(FriendshipService.iter_follower_ranges(self.linghu.id, 3))
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[-1][1], None)
+        batches = [
+            FriendshipService.get_follower_ids_in_range(self.linghu.id, after, until)
+            for after, until in ranges
+        ]
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual(
+            sorted(follower_id for batch in batches for follower_id in batch),
+            [follower.id for follower in followers],
+        )
+
+        # 粉丝数正好是 batch_size 的整数倍的时候没有最后那一段
+        ranges = list(FriendshipService.iter_follower_ranges(self.linghu.id, 7))
+        self.assertEqual(len(ranges), 1)
+        self.assertEqual(ranges[0][0], None)
+
+    def test_concurrent_unfollow(self):
+        self.create_friendship(self.linghu, self.dongxie)
+        racing = {'done': False}
+
+        def unfollow_first(execute, sql, params, many, context):
+            # 模拟另一个 request 在这一条 DELETE 执行之前已经取关了
+            if sql.startswith('DELETE') and not racing['done']:
+                racing['done'] = True
+                self.assertEqual(FriendshipService.unfollow(self.linghu.id, self.dongxie.id), True)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(unfollow_first):
+            self.assertEqual(FriendshipService.unfollow(self.linghu.id, self.dongxie.id), False)
+        self.assertEqual(FriendshipService.get_follower_counts([self.dongxie.id])[self.dongxie.id], 0)
+        self.assertEqual(FriendshipService.has_followed(self.linghu.id, self.dongxie.id), False)
+
+    def test_follow_many_and_unfollow_many(self):
+        user1 = self.create_user('user1')
+        user2 = self.create_user('user2')
+        self.create_friendship(self.linghu, user1)
+        # 缓存里的粉丝数和粉丝 set 都要更新
+        FriendshipService.get_follower_ids(user2.id)
+        self.assertEqual(FriendshipService.get_follower_counts([user2.id])[user2.id], 0)
+
+        # 已经关注过的、自己、不存在的用户都会被跳过
+        followed_ids = FriendshipService.follow_many(
+            self.linghu.id,
+            [user1.id, user2.id, self.linghu.id, 10000, self.dongxie.id],
+        )
+        self.assertEqual(followed_ids, [user2.id, self.dongxie.id])
+        self.assertEqual(Friendship.objects.filter(from_user=self.linghu).count(), 3)
+        with self.assertNumQueries(0):
+            self.assertSetEqual(
+                set(FriendshipService.get_following_ids(self.linghu.id)),
+                {user1.id, user2.id, self.dongxie.id},
+            )
+            self.assertEqual(FriendshipService.get_follower_ids(user2.id), [self.linghu.id])
+        self.assertEqual(FriendshipService.get_follower_counts([user2.id])[user2.id], 1)
+
+        # cache 里还没有、但是数据库里已经有了（比如并发的请求刚插进去）的不会再算一次
+        user3 = self.create_user('user3')
+        Friendship.objects.bulk_create([Friendship(from_user=self.linghu, to_user=user3)])
+        FriendshipService.get_follower_counts([user3.id])
+        with mock.patch.object(FriendshipService, 'get_following_ids', return_value=[]):
+            followed_ids = FriendshipService.follow_many(self.linghu.id, [user3.id])
+        self.assertEqual(followed_ids, [])
+        self.assertEqual(FriendshipService.get_follower_counts([user3.id])[user3.id], 0)
+
+        unfollowed_ids = FriendshipService.unfollow_many(
+            self.linghu.id,
+            [user2.id, 10000],
+        )
+        self.assertEqual(unfollowed_ids, [user2.id])
+        self.assertEqual(FriendshipService.has_followed(self.linghu.id, user2.id), False)
+        self.assertEqual(FriendshipService.get_follower_counts([user2.id])[user2.id], 0)
+
+
+class FollowSuggestionServiceTests(TestCase):
+
+    def setUp(self):
+        # linghu 关注了 a, b, c
+        # a, b, c 都关注了 x，a, b 关注了 y，c 关注了 z 和 linghu
+        self.linghu = self.create_user('linghu')
+        self.a, self.b, self.c, self.x, self.y, self.z = [
+            self.create_user(name) for name in ['a', 'b', 'c', 'x', 'y', 'z']
+        ]
+        for followee in [self.a, self.b, self.c]:
+            self.create_friendship(self.linghu, followee)
+        for follower in [self.a, self.b, self.c]:
+            self.create_friendship(follower, self.x)
+        for follower in [self.a, self.b]:
+            self.create_friendship(follower, self.y)
+        self.create_friendship(self.c, self.z)
+        self.create_friendship(self.c, self.linghu)
+
+    def test_compute_suggestions(self):
+        user_ids = [self.linghu.id, self.a.id, self.z.id]
+        # 不管一批有多少用户，都只有两条 query
+        with self.assertNumQueries(2):
+            suggestions = FollowSuggestionService.compute_suggestions(user_ids)
+        # 自己和已经关注了的人不会出现
+        self.assertEqual(suggestions[self.linghu.id], [
+            (self.x.id, 3),
+            (self.y.id, 2),
+            (self.z.id, 1),
+        ])
+        self.assertEqual(suggestions[self.a.id], [])
+        self.assertEqual(suggestions[self.z.id], [])
+
+        # 只保留 top K
+        suggestions = FollowSuggestionService.compute_suggestions([self.linghu.id], top_k=2)
+        self.assertEqual(suggestions[self.linghu.id], [(self.x.id, 3), (self.y.id, 2)])
+
+    def test_refresh_and_remove_suggestions(self):
+        FollowSuggestionService.refresh_suggestions([self.linghu.id])
+        # 重新计算会替换掉旧的结果，不会重复
+        FollowSuggestionService.refresh_suggestions([self.linghu.id])
+        self.assertEqual(
+            list(FollowSuggestion.objects.filter(
+                user=self.linghu,
+            ).values_list('suggested_user_id', 'mutual_count')),
+            [(self.x.id, 3), (self.y.id, 2), (self.z.id, 1)],
+        )
+        # 关注之后就不再推荐
+        self.create_friendship(self.linghu, self.x)
+        FriendshipService.follow_many(self.linghu.id, [self.y.id])
+        self.assertEqual(
+            list(FollowSuggestion.objects.filter(
+                user=self.linghu,
+            ).values_list('suggested_user_id', flat=True)),
+            [self.z.id],
+        )
+        # 被推荐的人注销了，推荐也跟着删掉，不会出现 suggested_user 是 null 的推荐
+        self.z.delete()
+        self.assertEqual(FollowSuggestion.objects.filter(user=self.linghu).count(), 0)
+
+    def test_compute_follow_suggestions_command(self):
+        out = StringIO()
+        call_command('compute_follow_suggestions', '--batch-size', '2', stdout=out)
+        # linghu: x, y, z；c: a, b（c 关注的 linghu 关注了 a, b）
+        self.assertIn('7 users, 5 suggestions computed', out.getvalue())
+        self.assertEqual(FollowSuggestion.objects.filter(user=self.c).count(), 2)
@@ -1,49 +1,47 @@
 from accounts.api.serializers import UserSerializer
-from comments.models import Comment
-from django.contrib.contenttypes.models import ContentType
+from accounts.services import UserService
 from likes.models import Like
+from likes.registry import LikeableRegistry
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from tweets.models import Tweet
+from utils.hydration import HydratedListSerializer
+from utils.memcached_helper import MemcachedHelper
 
 
 class LikeSerializer(serializers.ModelSerializer):
-    user = UserSerializer()
+    user = UserSerializer(source='cached_user')
 
     class Meta:
         model = Like
         fields = ('user', 'created_at')
+        # 一页 likes 的 user 用一次 multi-get 取出来
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('user',)
 
+    def batch_load(self, likes):
+        # user 里的粉丝数和关注数，一页的 profile 也用一次 multi-get 取出来
+        UserService.hydrate_profiles([like.cached_user for like in likes])
 
-class LikeSerializerForCreate(serializers.ModelSerializer):
-    content_type = serializers.ChoiceField(choices=['comment', 'tweet'])
+
+class LikeTargetSerializer(serializers.Serializer):
+    # 可以被 like 的类型都在 LikeableRegistry 里，比如 'comment', 'tweet'
+    content_type = serializers.ChoiceField(choices=LikeableRegistry.get_names())
     object_id = serializers.IntegerField()
 
-    class Meta:
-        model = Like
-        fields = ('content_type', 'object_id')
+    def validate(self, data):
+        data['model_class'] = LikeableRegistry.get_model_class(data['content_type'])
+        return data
 
-    def _get_model_class(self, data):
-        if data['content_type'] == 'comment':
-            return Comment
-        if data['content_type'] == 'tweet':
-            return Tweet
-        return None
+
+class LikeSerializerForCreate(LikeTargetSerializer):
 
     def validate(self, data):
-        model_class = self._get_model_class(data)
-        if model_class is None:
-            raise ValidationError({'content_type': 'Content type does not exist'})
-        liked_object = model_class.objects.filter(id=data['object_id']).first()
+        data = super(LikeSerializerForCreate, self).validate(data)
+        # 被 like 的 object 走 memcached，不用每次点赞都去数据库里查一下存不存在
+        liked_object = MemcachedHelper.get_object_through_cache(
+            data['model_class'],
+            data['object_id'],
+        )
         if liked_object is None:
             raise ValidationError({'object_id': 'Object does not exist'})
         return data
-
-    def create(self, validated_data):
-        model_class = self._get_model_class(validated_data)
-        instance, _ = Like.objects.get_or_create(
-            content_type=ContentType.objects.get_for_model(model_class),
-            object_id=validated_data['object_id'],
-            user=self.context['request'].user,
-        )
-        return instance
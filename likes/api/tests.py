@@ -2,6 +2,7 @@ from testing.testcases import TestCase
 
 
 LIKE_BASE_URL = '/api/likes/'
+LIKE_CANCEL_URL = '/api/likes/cancel/'
 
 
 class LikeApiTests(TestCase):
@@ -18,10 +19,6 @@ class LikeApiTests(TestCase):
         response = self.anonymous_client.post(LIKE_BASE_URL, data)
         self.assertEqual(response.status_code, 403)
 
-        # get is not allowed
-        response = self.linghu_client.get(LIKE_BASE_URL, data)
-        self.assertEqual(response.status_code, 405)
-
         # post success
         response = self.linghu_client.post(LIKE_BASE_URL, data)
         self.assertEqual(response.status_code, 201)
@@ -42,10 +39,6 @@ class LikeApiTests(TestCase):
         response = self.anonymous_client.post(LIKE_BASE_URL, data)
         self.assertEqual(response.status_code, 403)
 
-        # get is not allowed
-        response = self.linghu_client.get(LIKE_BASE_URL, data)
-        self.assertEqual(response.status_code, 405)
-
         # wrong content_type
         response = self.linghu_client.post(LIKE_BASE_URL, {
             'content_type': 'coment',
@@ -73,3 +66,95 @@ class LikeApiTests(TestCase):
         self.assertEqual(comment.like_set.count(), 1)
         self.dongxie_client.post(LIKE_BASE_URL, data)
         self.assertEqual(comment.like_set.count(), 2)
+
+    def test_changed(self):
+        tweet = self.create_tweet(self.linghu)
+        data = {'content_type': 'tweet', 'object_id': tweet.id}
+
+        response = self.linghu_client.post(LIKE_BASE_URL, data)
+        self.assertEqual(response.data['changed'], True)
+        self.assertEqual(response.data['user']['id'], self.linghu.id)
+        created_at = response.data['created_at']
+        # 重复点赞返回原来的那个 like
+        response = self.linghu_client.post(LIKE_BASE_URL, data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['changed'], False)
+        self.assertEqual(response.data['created_at'], created_at)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+
+    def test_cancel(self):
+        tweet = self.create_tweet(self.linghu)
+        comment = self.create_comment(self.dongxie, tweet)
+        data = {'content_type': 'comment', 'object_id': comment.id}
+        self.create_like(self.linghu, comment)
+        self.create_like(self.dongxie, comment)
+
+        # 必须登录
+        response = self.anonymous_client.post(LIKE_CANCEL_URL, data)
+        self.assertEqual(response.status_code, 403)
+        # 参数不对
+        response = self.linghu_client.post(LIKE_CANCEL_URL, {'content_type': 'comment'})
+        self.assertEqual(response.status_code, 400)
+        response = self.linghu_client.post(LIKE_CANCEL_URL, {
+            'content_type': 'coment',
+            'object_id': comment.id,
+        })
+        self.assertEqual(response.status_code, 400)
+
+        # 取消点赞
+        response = self.linghu_client.post(LIKE_CANCEL_URL, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changed'], True)
+        self.assertEqual(comment.like_set.count(), 1)
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 1)
+
+        # 重复取消，什么都不会发生
+        response = self.linghu_client.post(LIKE_CANCEL_URL, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changed'], False)
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 1)
+
+    def test_list(self):
+        tweet = self.create_tweet(self.linghu)
+        users = [self.create_user('liker{}'.format(i)) for i in range(5)]
+        for user in users:
+            self.create_like(user, tweet)
+        self.create_like(self.linghu, self.create_comment(self.linghu, tweet))
+
+        # 参数不对
+        response = self.anonymous_client.get(LIKE_BASE_URL, {'content_type': 'tweet'})
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(LIKE_BASE_URL, {
+            'content_type': 'user',
+            'object_id': tweet.id,
+        })
+        self.assertEqual(response.status_code, 400)
+
+        # 最新点赞的在前面，不登录也可以看
+        data = {'content_type': 'tweet', 'object_id': tweet.id, 'page_size': 3}
+        self.clear_cache()
+        # 一条查 likes，一条批量查 users，一条批量查 users 的 profile
+        with self.assertNumQueries(3):
+            response = self.anonymous_client.get(LIKE_BASE_URL, data)
+        # users 和 profiles 都在 memcached 里了，只需要查 likes
+        with self.assertNumQueries(1):
+            response = self.anonymous_client.get(LIKE_BASE_URL, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['likes']],
+            ['liker4', 'liker3', 'liker2'],
+        )
+        self.assertEqual(response.data['has_next_page'], True)
+
+        response = self.anonymous_client.get(LIKE_BASE_URL, {
+            **data,
+            'before': response.data['before_cursor'],
+        })
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['likes']],
+            ['liker1', 'liker0'],
+        )
+        self.assertEqual(response.data['has_next_page'], False)
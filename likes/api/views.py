@@ -1,18 +1,57 @@
 from likes.api.serializers import (
     LikeSerializer,
     LikeSerializerForCreate,
+    LikeTargetSerializer,
 )
 from likes.models import Like
+from likes.registry import LikeableRegistry
+from likes.services import LikeService
 from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from utils.decorators import required_params
+from utils.paginations import KeysetPagination
 
 
 class LikeViewSet(viewsets.GenericViewSet):
     queryset = Like.objects.all()
-    permission_classes = [IsAuthenticated]
     serializer_class = LikeSerializerForCreate
+    pagination_class = KeysetPagination
+
+    # 点赞和取消点赞都是幂等的，重复调用不会报错，changed 表示这一次有没有真的改变点赞的状态
+    # GET /api/likes/?content_type=tweet&object_id=1 -> list
+    # POST /api/likes/ -> create
+    # POST /api/likes/cancel/ -> cancel
+
+    def get_permissions(self):
+        # 谁点了赞不登录也可以看
+        if self.action == 'list':
+            return [AllowAny()]
+        return [IsAuthenticated()]
+
+    @required_params(params=['content_type', 'object_id'])
+    def list(self, request, *args, **kwargs):
+        serializer = LikeTargetSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({
+                'message': 'Please check input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # 对应 SQL: where content_type_id = x and object_id = y
+        # and (created_at < z or (created_at = z and id < w)) order by created_at desc, id desc
+        # 用到 likes 上 (content_type, object_id, created_at) 的联合索引，每页只扫 page_size + 1 行
+        # 这一页点赞的 user 在 LikeSerializer 的 list serializer 里一次性批量取出来
+        likes = self.paginate_queryset(Like.objects.filter(
+            content_type_id=LikeableRegistry.get_content_type_id(
+                serializer.validated_data['model_class'],
+            ),
+            object_id=serializer.validated_data['object_id'],
+        ))
+        return Response({
+            'likes': LikeSerializer(likes, many=True).data,
+            **self.paginator.get_page_info(),
+        }, status=status.HTTP_200_OK)
 
     @required_params(request_attr='data', params=['content_type', 'object_id'])
     def create(self, request, *args, **kwargs):
@@ -25,8 +64,31 @@ class LikeViewSet(viewsets.GenericViewSet):
                 'message': 'Please check input',
                 'errors': serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
-        instance = serializer.save()
-        return Response(
-            LikeSerializer(instance).data,
-            status=status.HTTP_201_CREATED,
+        instance, changed = LikeService.like(
+            request.user.id,
+            serializer.validated_data['model_class'],
+            serializer.validated_data['object_id'],
+        )
+        return Response({
+            **LikeSerializer(instance).data,
+            'changed': changed,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False)
+    @required_params(request_attr='data', params=['content_type', 'object_id'])
+    def cancel(self, request, *args, **kwargs):
+        serializer = LikeTargetSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'message': 'Please check input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        changed = LikeService.unlike(
+            request.user.id,
+            serializer.validated_data['model_class'],
+            serializer.validated_data['object_id'],
         )
+        return Response({
+            'success': True,
+            'changed': changed,
+        }, status=status.HTTP_200_OK)
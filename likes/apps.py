@@ -1,5 +1,30 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models.signals import post_migrate
+
+logger = logging.getLogger(__name__)
+
+
+def clear_likeable_registry(sender, **kwargs):
+    from likes.registry import LikeableRegistry
+    LikeableRegistry.clear()
 
 
 class LikesConfig(AppConfig):
     name = 'likes'
+
+    def ready(self):
+        from likes.registry import LikeableRegistry
+        post_migrate.connect(clear_likeable_registry)
+        # 所有 app 的 models 在 ready 之前都已经 import 过了，可以 like 的 model 都已经 register 了
+        # 单元测试的时候这里连的还不是测试数据库，等用到的时候再 warm
+        if settings.TESTING:
+            return
+        try:
+            LikeableRegistry.warm()
+        except DatabaseError:
+            # 还没有 migrate 或者数据库连不上的时候（比如 makemigrations），用到的时候再 warm
+            logger.warning('likeable registry is not warmed up', exc_info=True)
@@ -0,0 +1,21 @@
+from likes.registry import LikeableRegistry
+
+
+def _update_likes_count(instance, delta):
+    # LikeableRegistry 里已经有 content_type_id 到 model 的映射，不需要查数据库
+    model_class = LikeableRegistry.get_model_class_for_content_type_id(instance.content_type_id)
+    if model_class is None:
+        return
+
+    from likes.services import LikeService
+    LikeService.update_likes_count(model_class, instance.object_id, delta)
+
+
+def incr_likes_count(sender, instance, created, **kwargs):
+    if not created:
+        return
+    _update_likes_count(instance, 1)
+
+
+def decr_likes_count(sender, instance, **kwargs):
+    _update_likes_count(instance, -1)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from likes.services import LikesCountBuffer
+
+
+class Command(BaseCommand):
+    """
+    python manage.py flush_likes_count
+    把 redis 里攒下来的点赞数增量马上写回数据库
+    平时每个进程会按照 LIKES_COUNT_FLUSH_INTERVAL 自己 flush，这个 command 可以放进 crontab 兜底，
+    或者在部署、重启之前手动跑一次
+    """
+    help = 'Flush pending write-behind likes count deltas to the database'
+
+    def handle(self, *args, **options):
+        flushed = LikesCountBuffer.flush()
+        self.stdout.write('{} objects flushed'.format(flushed))
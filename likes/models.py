@@ -2,6 +2,9 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from likes.listeners import decr_likes_count, incr_likes_count
+from utils.memcached_helper import MemcachedHelper
 
 
 class Like(models.Model):
@@ -33,3 +36,11 @@ class Like(models.Model):
             self.content_type,
             self.object_id,
         )
+
+    @property
+    def cached_user(self):
+        return MemcachedHelper.get_related_object_through_cache(self, 'user')
+
+
+post_save.connect(incr_likes_count, sender=Like)
+post_delete.connect(decr_likes_count, sender=Like)
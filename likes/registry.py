@@ -0,0 +1,64 @@
+from django.contrib.contenttypes.models import ContentType
+
+
+class LikeableRegistry(object):
+    """
+    可以被 like 的 model 都在这里登记，name（api 里用的字符串）<-> model <-> content_type_id
+    在 models.py 的最后调用 LikeableRegistry.register(Model)，和 MemcachedHelper.register 一样
+    LikesConfig.ready 的时候用一条 query 把所有 content type 取出来（warm），
+    之后 like 相关的代码查 content type 都不需要再访问数据库
+    """
+    _models_by_name = {}
+    _content_type_ids = {}
+    _models_by_content_type_id = {}
+
+    @classmethod
+    def register(cls, model_class, name=None):
+        if name is None:
+            name = model_class._meta.model_name
+        cls._models_by_name[name] = model_class
+
+    @classmethod
+    def get_names(cls):
+        return sorted(cls._models_by_name.keys())
+
+    @classmethod
+    def get_model_class(cls, name):
+        return cls._models_by_name.get(name)
+
+    @classmethod
+    def is_registered(cls, model_class):
+        return model_class in cls._models_by_name.values()
+
+    @classmethod
+    def warm(cls):
+        # get_for_models 一条 query 取出所有的，数据库里没有的会自动创建
+        content_types = ContentType.objects.get_for_models(*cls._models_by_name.values())
+        cls._content_type_ids = {
+            model_class: content_type.id
+            for model_class, content_type in content_types.items()
+        }
+        cls._models_by_content_type_id = {
+            content_type.id: model_class
+            for model_class, content_type in content_types.items()
+        }
+
+    @classmethod
+    def clear(cls):
+        # migrate（包括单元测试建库）之后 content type 的 id 可能变了，下次用到的时候重新 warm
+        cls._content_type_ids = {}
+        cls._models_by_content_type_id = {}
+
+    @classmethod
+    def get_content_type_id(cls, model_class):
+        content_type_id = cls._content_type_ids.get(model_class)
+        if content_type_id is None:
+            cls.warm()
+            content_type_id = cls._content_type_ids[model_class]
+        return content_type_id
+
+    @classmethod
+    def get_model_class_for_content_type_id(cls, content_type_id):
+        if content_type_id not in cls._models_by_content_type_id:
+            cls.warm()
+        return cls._models_by_content_type_id.get(content_type_id)
@@ -0,0 +1,330 @@
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Value, When
+
+from likes.models import Like
+from likes.registry import LikeableRegistry
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
+
+logger = logging.getLogger(__name__)
+
+LIKE_STATUS_CONTEXT_KEY = 'like_status'
+PENDING_LIKES_COUNT_CONTEXT_KEY = 'pending_likes_count'
+PENDING_LIKES_COUNT_KEY = 'pending_likes_count'
+# 正在 flush 的增量，写回数据库 commit 之后才删掉，失败或者进程挂了的话下一次 flush 会重试
+FLUSHING_LIKES_COUNT_KEY = 'pending_likes_count:flushing'
+FLUSH_LOCK_KEY = 'pending_likes_count:lock'
+FLUSH_LOCK_TIMEOUT = 60
+
+
+class LikesCountBuffer(object):
+    """
+    write-behind 的点赞计数
+    热门的 tweet 同时有成千上万个人点赞的时候，每个赞都 update 同一行，全部排队等同一把行锁
+    改成先在 redis 的一个 hash 里 HINCRBY，field 是 <app.model>:<object_id>，value 是还没写回数据库的增量
+    每隔 LIKES_COUNT_FLUSH_INTERVAL 秒把攒下来的增量一次性写回去，每个 object 只需要一条 F() update
+    读的时候用数据库里的值加上 redis 里还没写回去的增量
+    """
+    _last_flush_at = 0
+
+    @classmethod
+    def get_field(cls, model_class, object_id):
+        return '{}:{}'.format(model_class._meta.label_lower, object_id)
+
+    @classmethod
+    def add(cls, model_class, object_id, delta):
+        conn = RedisClient.get_connection()
+        conn.hincrby(PENDING_LIKES_COUNT_KEY, cls.get_field(model_class, object_id), delta)
+        cls.maybe_flush()
+
+    @classmethod
+    def get_pending(cls, model_class, object_ids):
+        """
+        返回 {object_id: 还没写回数据库的增量}，正在 flush 还没有 commit 的也算在内
+        """
+        object_ids = list(object_ids)
+        if not object_ids:
+            return {}
+        conn = RedisClient.get_connection()
+        fields = [cls.get_field(model_class, object_id) for object_id in object_ids]
+        pending = {}
+        for key in [PENDING_LIKES_COUNT_KEY, FLUSHING_LIKES_COUNT_KEY]:
+            for object_id, value in zip(object_ids, conn.hmget(key, fields)):
+                if value is not None:
+                    pending[object_id] = pending.get(object_id, 0) + int(value)
+        return pending
+
+    @classmethod
+    def maybe_flush(cls):
+        # 每个进程自己计时，到时间了就丢一个异步任务去 flush，request 不用等
+        now = time.time()
+        if now - cls._last_flush_at < settings.LIKES_COUNT_FLUSH_INTERVAL:
+            return
+        cls._last_flush_at = now
+        # tasks 里 import 了这个文件，放在最上面会循环 import
+        from likes.tasks import flush_likes_count_task
+        flush_likes_count_task.delay()
+
+    @classmethod
+    def flush(cls):
+        """
+        把攒下来的增量写回数据库，返回更新了多少个 objects
+        先把 hash RENAME 成 FLUSHING_LIKES_COUNT_KEY，RENAME 是原子的，flush 的过程中新来的增量会写进新的 hash，
+        FLUSHING_LIKES_COUNT_KEY 在数据库 commit 之后才删掉，写数据库失败或者进程挂了都不会丢，
+        下一次 flush 先重试它。commit 和删 key 之间挂掉的话这一批会被加两次，
+        这种情况用 python manage.py reconcile_counters 修
+        同一时间只有一个 flush，用 redis 里的一把锁保证
+        """
+        conn = RedisClient.get_connection()
+        if not conn.exists(FLUSHING_LIKES_COUNT_KEY) and not conn.exists(PENDING_LIKES_COUNT_KEY):
+            return 0
+        lock = uuid.uuid4().hex
+        if not conn.set(FLUSH_LOCK_KEY, lock, ex=FLUSH_LOCK_TIMEOUT, nx=True):
+            # 别的进程正在 flush
+            return 0
+        try:
+            flushed = 0
+            if conn.exists(FLUSHING_LIKES_COUNT_KEY):
+                # 上一次 flush 失败留下来的
+                flushed += cls._flush_batch(conn)
+            try:
+                conn.rename(PENDING_LIKES_COUNT_KEY, FLUSHING_LIKES_COUNT_KEY)
+            except Exception:
+                # 没有新的增量
+                return flushed
+            return flushed + cls._flush_batch(conn)
+        finally:
+            if conn.get(FLUSH_LOCK_KEY) == lock.encode('utf-8'):
+                conn.delete(FLUSH_LOCK_KEY)
+
+    @classmethod
+    def _flush_batch(cls, conn):
+        pending = conn.hgetall(FLUSHING_LIKES_COUNT_KEY)
+
+        deltas = []
+        for field, value in pending.items():
+            label, object_id = field.decode('utf-8').rsplit(':', 1)
+            if int(value) != 0:
+                deltas.append((apps.get_model(label), int(object_id), int(value)))
+        try:
+            with transaction.atomic():
+                for model_class, object_id, delta in deltas:
+                    model_class.objects.filter(id=object_id).update(
+                        likes_count=F('likes_count') + delta,
+                    )
+        except Exception:
+            logger.exception('failed to flush likes count, will retry')
+            raise
+        conn.delete(FLUSHING_LIKES_COUNT_KEY)
+        for model_class, object_id, _ in deltas:
+            MemcachedHelper.invalidate_cached_object(model_class, object_id)
+        return len(deltas)
+
+
+class LikeService(object):
+
+    @classmethod
+    def get_target(cls, obj):
+        # 被 like 的 object 用 (content_type_id, object_id) 表示
+        return LikeableRegistry.get_content_type_id(obj.__class__), obj.id
+
+    @classmethod
+    def update_likes_count(cls, model_class, object_id, delta):
+        if settings.LIKES_COUNT_WRITE_BEHIND:
+            # 事务回滚的话 like 没有写进去，计数也不能加，所以等 commit 之后再记到 redis 里
+            transaction.on_commit(lambda: LikesCountBuffer.add(model_class, object_id, delta))
+            return
+        # 用 F() 在数据库里原子地 +1 / -1，不能先读出来再加，并发的时候会丢数据
+        # SQL: update twitter_tweet set likes_count = likes_count + 1 where id = xxx
+        model_class.objects.filter(id=object_id).update(
+            likes_count=F('likes_count') + delta,
+        )
+        # update 不会触发 post_save，需要手动把 memcached 里的旧数据删掉
+        MemcachedHelper.invalidate_cached_object(model_class, object_id)
+
+    @classmethod
+    def like(cls, user_id, model_class, object_id):
+        """
+        幂等的点赞，返回 (like, changed)，changed 表示这次调用是不是真的新增了一个 like
+        bulk_create(ignore_conflicts=True) 是一条 INSERT IGNORE（sqlite 是 INSERT OR IGNORE，
+        postgres 是 ON CONFLICT DO NOTHING），靠 (user, content_type, object_id) 的 unique 索引去重，
+        不需要先 SELECT 再 INSERT，前端连点两下并发进来也只会有一个成功
+        """
+        like = Like(
+            user_id=user_id,
+            content_type_id=LikeableRegistry.get_content_type_id(model_class),
+            object_id=object_id,
+        )
+        with transaction.atomic():
+            Like.objects.bulk_create([like], ignore_conflicts=True)
+            # bulk_create 拿不到影响的行数，也不会给 like 设置 id，再查一次
+            # created_at 是 insert 的时候在 python 里生成的，和这次的一样才是这次插进去的
+            existing = Like.objects.filter(
+                user_id=user_id,
+                content_type_id=like.content_type_id,
+                object_id=object_id,
+            ).first()
+            if existing is None:
+                # mysql 的 INSERT IGNORE 连外键错误也会忽略掉，一行都没有说明不是重复点赞
+                raise IntegrityError('failed to insert like for {}:{}'.format(
+                    model_class._meta.label_lower,
+                    object_id,
+                ))
+            changed = existing.created_at == like.created_at
+            if changed:
+                # 没有走 save()，post_save 不会触发，计数在同一个事务里自己改
+                cls.update_likes_count(model_class, object_id, 1)
+        return existing, changed
+
+    @classmethod
+    def unlike(cls, user_id, model_class, object_id):
+        """
+        幂等的取消点赞，返回这次调用是不是真的删掉了一个 like
+        queryset.delete() 会先 SELECT 再 DELETE，并且给 SELECT 出来的每一行都发 post_delete，
+        两个并发的取消点赞都会 SELECT 到同一行，计数会被减两次。
+        这里只执行一条 DELETE，影响的行数是 1 的时候才减计数，并发的时候只有一个能删到
+        """
+        content_type_id = LikeableRegistry.get_content_type_id(model_class)
+        connection = connections[Like.objects.db]
+        quote_name = connection.ops.quote_name
+        statement = 'DELETE FROM {} WHERE {} = %s AND {} = %s AND {} = %s'.format(
+            quote_name(Like._meta.db_table),
+            quote_name(Like._meta.get_field('user').column),
+            quote_name(Like._meta.get_field('content_type').column),
+            quote_name(Like._meta.get_field('object_id').column),
+        )
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(statement, [user_id, content_type_id, object_id])
+                changed = cursor.rowcount == 1
+            if changed:
+                # 没有走 delete()，post_delete 不会触发，计数在同一个事务里自己改
+                cls.update_likes_count(model_class, object_id, -1)
+        return changed
+
+    @classmethod
+    def get_like_status(cls, targets, user_id=None, with_counts=True):
+        """
+        targets 是一组 (content_type_id, object_id)
+        返回 {(content_type_id, object_id): {'has_liked': bool, 'likes_count': int}}
+        每种 content type 只执行一条 query：
+        - with_counts=True: 在 (content_type, object_id, created_at) 的索引上 GROUP BY object_id，
+          同时算出点赞数和 user 有没有点过赞
+        - with_counts=False: 只查 user 点过赞的那些，用 (user, content_type, object_id) 的 unique 索引，
+          被点赞很多次的 object 也不需要数一遍所有的 likes，返回的 likes_count 是 None
+          tweet 和 comment 上已经有反范式化的 likes_count 了，序列化的时候用这种
+        """
+        object_ids_by_content_type = defaultdict(set)
+        for content_type_id, object_id in targets:
+            object_ids_by_content_type[content_type_id].add(object_id)
+
+        status = {
+            (content_type_id, object_id): {
+                'has_liked': False,
+                'likes_count': 0 if with_counts else None,
+            }
+            for content_type_id, object_ids in object_ids_by_content_type.items()
+            for object_id in object_ids
+        }
+        for content_type_id, object_ids in object_ids_by_content_type.items():
+            queryset = Like.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=object_ids,
+            ).order_by()
+            if with_counts:
+                # order_by() 去掉默认排序，否则会被加进 GROUP BY
+                rows = queryset.values('object_id').annotate(
+                    likes_count=Count('id'),
+                    has_liked=Max(Case(
+                        When(user_id=user_id, then=Value(1)),
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    )),
+                )
+                for row in rows:
+                    status[(content_type_id, row['object_id'])] = {
+                        'has_liked': user_id is not None and row['has_liked'] == 1,
+                        'likes_count': row['likes_count'],
+                    }
+            elif user_id is not None:
+                liked_ids = queryset.filter(user_id=user_id).values_list('object_id', flat=True)
+                for object_id in liked_ids:
+                    status[(content_type_id, object_id)]['has_liked'] = True
+        return status
+
+    @classmethod
+    def _get_user_id(cls, context):
+        request = context.get('request')
+        if request is None or not request.user.is_authenticated:
+            return None
+        return request.user.id
+
+    @classmethod
+    def prefetch_has_liked(cls, context, objects):
+        """
+        序列化一组 objects 之前调用，把当前用户有没有点赞一次性查出来放在 serializer 的 context 里
+        同一个 context 里已经查过的不会重复查
+        """
+        user_id = cls._get_user_id(context)
+        if user_id is None:
+            return
+        like_status = context.setdefault(LIKE_STATUS_CONTEXT_KEY, {})
+        targets = [
+            target
+            for target in {cls.get_target(obj) for obj in objects if obj is not None}
+            if target not in like_status
+        ]
+        if not targets:
+            return
+        status = cls.get_like_status(targets, user_id=user_id, with_counts=False)
+        like_status.update({
+            target: target_status['has_liked']
+            for target, target_status in status.items()
+        })
+
+    @classmethod
+    def prefetch_likes_count(cls, context, objects):
+        """
+        序列化一组 objects 之前调用，每种 model 用一次 HMGET 把 redis 里还没写回数据库的点赞数取出来
+        """
+        if not settings.LIKES_COUNT_WRITE_BEHIND:
+            return
+        pending = context.setdefault(PENDING_LIKES_COUNT_CONTEXT_KEY, {})
+        object_ids_by_model = defaultdict(set)
+        for obj in objects:
+            if obj is not None and (obj.__class__, obj.id) not in pending:
+                object_ids_by_model[obj.__class__].add(obj.id)
+        for model_class, object_ids in object_ids_by_model.items():
+            deltas = LikesCountBuffer.get_pending(model_class, object_ids)
+            for object_id in object_ids:
+                pending[(model_class, object_id)] = deltas.get(object_id, 0)
+
+    @classmethod
+    def get_likes_count(cls, context, obj):
+        # 数据库（memcached）里的值加上还没写回数据库的增量
+        if not settings.LIKES_COUNT_WRITE_BEHIND:
+            return obj.likes_count
+        key = (obj.__class__, obj.id)
+        if key not in context.get(PENDING_LIKES_COUNT_CONTEXT_KEY, {}):
+            cls.prefetch_likes_count(context, [obj])
+        return obj.likes_count + context[PENDING_LIKES_COUNT_CONTEXT_KEY][key]
+
+    @classmethod
+    def has_liked(cls, context, obj):
+        # 没登录的用户都是没有点过赞
+        if cls._get_user_id(context) is None:
+            return False
+        target = cls.get_target(obj)
+        like_status = context.get(LIKE_STATUS_CONTEXT_KEY, {})
+        if target not in like_status:
+            # 单独序列化一个 object 的时候没有 prefetch 过，查一次
+            cls.prefetch_has_liked(context, [obj])
+            like_status = context[LIKE_STATUS_CONTEXT_KEY]
+        return like_status[target]
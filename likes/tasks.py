@@ -0,0 +1,8 @@
+from likes.services import LikesCountBuffer
+from utils.task_queue import task
+
+
+@task
+def flush_likes_count_task():
+    flushed = LikesCountBuffer.flush()
+    return '{} likes count flushed.'.format(flushed)
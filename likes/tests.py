@@ -0,0 +1,244 @@
+from comments.models import Comment
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from likes.registry import LikeableRegistry
+from likes.services import (
+    FLUSH_LOCK_KEY,
+    FLUSH_LOCK_TIMEOUT,
+    LikeService,
+    LikesCountBuffer,
+)
+from unittest import mock
+from rest_framework.test import APIRequestFactory
+from testing.testcases import TestCase
+from tweets.models import Tweet
+from utils.redis_client import RedisClient
+
+
+class LikeServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweets = [self.create_tweet(self.linghu) for _ in range(3)]
+        self.comment = self.create_comment(self.linghu, self.tweets[0])
+
+    def count_statements(self, context):
+        # 单元测试里 transaction.atomic 是用 savepoint 实现的，不算在内
+        return len([
+            query for query in context.captured_queries
+            if 'SAVEPOINT' not in query['sql']
+        ])
+
+    def test_get_like_status(self):
+        self.create_like(self.linghu, self.tweets[0])
+        self.create_like(self.dongxie, self.tweets[0])
+        self.create_like(self.dongxie, self.tweets[1])
+        self.create_like(self.linghu, self.comment)
+        targets = [LikeService.get_target(tweet) for tweet in self.tweets]
+        targets.append(LikeService.get_target(self.comment))
+
+        # 每种 content type 一条 query
+        with self.assertNumQueries(2):
+            status = LikeService.get_like_status(targets, user_id=self.linghu.id)
+        self.assertEqual(
+            [(status[t]['has_liked'], status[t]['likes_count']) for t in targets],
+            [(True, 2), (False, 1), (False, 0), (True, 1)],
+        )
+
+        with self.assertNumQueries(2):
+            status = LikeService.get_like_status(
+                targets,
+                user_id=self.dongxie.id,
+                with_counts=False,
+            )
+        self.assertEqual(
+            [status[t]['has_liked'] for t in targets],
+            [True, True, False, False],
+        )
+
+        # 没有 user 的时候只有点赞数
+        status = LikeService.get_like_status(targets)
+        self.assertEqual(
+            [(status[t]['has_liked'], status[t]['likes_count']) for t in targets],
+            [(False, 2), (False, 1), (False, 0), (False, 1)],
+        )
+
+    def test_like_and_unlike(self):
+        tweet = self.tweets[0]
+        like, changed = LikeService.like(self.dongxie.id, Tweet, tweet.id)
+        self.assertEqual(changed, True)
+        self.assertEqual(like.user_id, self.dongxie.id)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+
+        # 重复点赞，只有一条 INSERT 和一条 SELECT
+        with CaptureQueriesContext(connection) as context:
+            same_like, changed = LikeService.like(self.dongxie.id, Tweet, tweet.id)
+        self.assertEqual(self.count_statements(context), 2)
+        self.assertEqual(changed, False)
+        self.assertEqual(same_like.id, like.id)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+
+        self.assertEqual(LikeService.unlike(self.dongxie.id, Tweet, tweet.id), True)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(LikeService.unlike(self.dongxie.id, Tweet, tweet.id), False)
+        self.assertEqual(self.count_statements(context), 1)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+        self.assertEqual(tweet.like_set.count(), 0)
+
+    def test_concurrent_unlike(self):
+        tweet = self.tweets[0]
+        LikeService.like(self.dongxie.id, Tweet, tweet.id)
+        racing = {'done': False}
+
+        def unlike_first(execute, sql, params, many, context):
+            # 模拟另一个 request 在这一条 DELETE 执行之前已经把这个赞取消了
+            if sql.startswith('DELETE') and not racing['done']:
+                racing['done'] = True
+                self.assertEqual(LikeService.unlike(self.dongxie.id, Tweet, tweet.id), True)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(unlike_first):
+            self.assertEqual(LikeService.unlike(self.dongxie.id, Tweet, tweet.id), False)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+
+    def test_has_liked_in_context(self):
+        self.create_like(self.linghu, self.tweets[1])
+        request = APIRequestFactory().get('/')
+        request.user = self.linghu
+        context = {'request': request}
+
+        LikeService.prefetch_has_liked(context, self.tweets)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [LikeService.has_liked(context, tweet) for tweet in self.tweets],
+                [False, True, False],
+            )
+        # 没有 prefetch 过的单独查一次
+        with self.assertNumQueries(1):
+            self.assertEqual(LikeService.has_liked(context, self.comment), False)
+
+
+class LikeableRegistryTests(TestCase):
+
+    def test_registry(self):
+        self.assertEqual(LikeableRegistry.get_names(), ['comment', 'tweet'])
+        self.assertEqual(LikeableRegistry.get_model_class('tweet'), Tweet)
+        self.assertEqual(LikeableRegistry.get_model_class('user'), None)
+
+        # warm 一次之后就不需要再查数据库
+        LikeableRegistry.clear()
+        ContentType.objects.clear_cache()
+        with self.assertNumQueries(1):
+            LikeableRegistry.get_content_type_id(Tweet)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                LikeableRegistry.get_content_type_id(Comment),
+                ContentType.objects.get_for_model(Comment).id,
+            )
+            self.assertEqual(
+                LikeableRegistry.get_model_class_for_content_type_id(
+                    ContentType.objects.get_for_model(Tweet).id,
+                ),
+                Tweet,
+            )
+
+
+@override_settings(LIKES_COUNT_WRITE_BEHIND=True)
+class LikesCountBufferTests(TestCase):
+
+    def setUp(self):
+        self.linghu, self.linghu_client = self.create_user_and_client('linghu')
+        self.tweet = self.create_tweet(self.linghu)
+        # 不让 add 的时候自动 flush
+        patcher = mock.patch.object(LikesCountBuffer, 'maybe_flush')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_add_and_flush(self):
+        comment = self.create_comment(self.linghu, self.tweet)
+        for _ in range(3):
+            LikesCountBuffer.add(Tweet, self.tweet.id, 1)
+        LikesCountBuffer.add(Tweet, self.tweet.id, -1)
+        LikesCountBuffer.add(Comment, comment.id, 1)
+        self.assertEqual(LikesCountBuffer.get_pending(Tweet, [self.tweet.id, 0]), {self.tweet.id: 2})
+
+        # 读的时候加上还没写回去的增量
+        response = self.linghu_client.get('/api/tweets/{}/'.format(self.tweet.id))
+        self.assertEqual(response.data['likes_count'], 2)
+        self.assertEqual(response.data['comments'][0]['likes_count'], 1)
+        response = self.linghu_client.get('/api/tweets/', {'user_id': self.linghu.id})
+        self.assertEqual(response.data['tweets'][0]['likes_count'], 2)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+
+        # 每个 object 一条 update，加上 transaction.atomic 的 savepoint 和 release
+        with self.assertNumQueries(4):
+            self.assertEqual(LikesCountBuffer.flush(), 2)
+        self.assertEqual(LikesCountBuffer.get_pending(Tweet, [self.tweet.id]), {})
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 1)
+        response = self.linghu_client.get('/api/tweets/{}/'.format(self.tweet.id))
+        self.assertEqual(response.data['likes_count'], 2)
+
+        # 没有需要 flush 的
+        with self.assertNumQueries(0):
+            self.assertEqual(LikesCountBuffer.flush(), 0)
+
+    def test_flush_failure_keeps_deltas(self):
+        LikesCountBuffer.add(Tweet, self.tweet.id, 1)
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                LikesCountBuffer.flush()
+        self.assertEqual(LikesCountBuffer.get_pending(Tweet, [self.tweet.id]), {self.tweet.id: 1})
+
+        # 下一次 flush 先重试失败的那一批，再 flush 新来的
+        LikesCountBuffer.add(Tweet, self.tweet.id, 1)
+        self.assertEqual(LikesCountBuffer.get_pending(Tweet, [self.tweet.id]), {self.tweet.id: 2})
+        self.assertEqual(LikesCountBuffer.flush(), 2)
+        self.assertEqual(LikesCountBuffer.get_pending(Tweet, [self.tweet.id]), {})
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+
+    def test_flush_is_locked(self):
+        LikesCountBuffer.add(Tweet, self.tweet.id, 1)
+        conn = RedisClient.get_connection()
+        conn.set(FLUSH_LOCK_KEY, 'other', ex=FLUSH_LOCK_TIMEOUT, nx=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(LikesCountBuffer.flush(), 0)
+        conn.delete(FLUSH_LOCK_KEY)
+        self.assertEqual(LikesCountBuffer.flush(), 1)
+
+
+@override_settings(LIKES_COUNT_WRITE_BEHIND=True, LIKES_COUNT_FLUSH_INTERVAL=0)
+class LikesCountWriteBehindTests(TransactionTestCase):
+    # 计数是在事务 commit 之后才记到 redis 里的，TestCase 里的事务不会 commit，所以用 TransactionTestCase
+
+    def setUp(self):
+        RedisClient.clear()
+
+    def test_like_and_unlike(self):
+        user = User.objects.create_user('linghu')
+        tweet = Tweet.objects.create(user=user, content='write behind')
+        LikeService.like(user.id, Tweet, tweet.id)
+        # LIKES_COUNT_FLUSH_INTERVAL=0，每次都会 flush
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+
+        with mock.patch.object(LikesCountBuffer, 'maybe_flush'):
+            LikeService.unlike(user.id, Tweet, tweet.id)
+            self.assertEqual(LikesCountBuffer.get_pending(Tweet, [tweet.id]), {tweet.id: -1})
+            tweet.refresh_from_db()
+            self.assertEqual(tweet.likes_count, 1)
+        LikesCountBuffer.flush()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
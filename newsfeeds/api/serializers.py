@@ -1,6 +1,8 @@
+from likes.services import LikeService
 from rest_framework import serializers
 from newsfeeds.models import NewsFeed
 from tweets.api.serializers import TweetSerializer
+from utils.hydration import HydratedListSerializer
 
 
 class NewsFeedSerializer(serializers.ModelSerializer):
@@ -10,3 +12,13 @@ class NewsFeedSerializer(serializers.ModelSerializer):
         model = NewsFeed
         # tweet里面包含了谁发的帖子
         fields = ('id', 'created_at', 'user', 'tweet')
+        # 序列化一页 newsfeeds 的时候，先用一条 IN Query 取出所有的 tweets，
+        # 再用一条 IN Query 取出所有 tweets 的 user，不管一页有多少条都是固定的 query 数
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('tweet', 'tweet__user')
+
+    def batch_load(self, instances):
+        # 这一页所有 tweets 的 has_liked 用一条 query 查出来
+        tweets = [newsfeed.tweet for newsfeed in instances]
+        LikeService.prefetch_has_liked(self.context, tweets)
+        LikeService.prefetch_likes_count(self.context, tweets)
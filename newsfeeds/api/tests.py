@@ -1,7 +1,12 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
 from friendships.models import Friendship
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from utils.paginations import EndlessPagination
 
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
@@ -57,3 +62,182 @@ class NewsFeedApiTests(TestCase):
         self.assertEqual(len(response.data['newsfeeds']), 2)
         # newsfeeds是倒序排列，第0条就是dongxie发的
         self.assertEqual(response.data['newsfeeds'][0]['tweet']['id'], posted_tweet_id)
+
+    def test_pagination(self):
+        page_size = EndlessPagination.page_size
+        followed_user = self.create_user('followed')
+        newsfeeds = []
+        for i in range(page_size * 2):
+            tweet = self.create_tweet(followed_user)
+            newsfeed = self.create_newsfeed(user=self.linghu, tweet=tweet)
+            newsfeeds.append(newsfeed)
+        newsfeeds = newsfeeds[::-1]
+
+        # 第一页
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.data['has_next_page'], True)
+        results = response.data['newsfeeds']
+        self.assertEqual(len(results), page_size)
+        self.assertEqual(results[0]['id'], newsfeeds[0].id)
+        self.assertEqual(results[page_size - 1]['id'], newsfeeds[page_size - 1].id)
+
+        # 上滑加载第二页
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': results[page_size - 1]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        results = response.data['newsfeeds']
+        self.assertEqual(len(results), page_size)
+        self.assertEqual(results[0]['id'], newsfeeds[page_size].id)
+        self.assertEqual(results[page_size - 1]['id'], newsfeeds[2 * page_size - 1].id)
+
+        # 下拉刷新，没有新的内容
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': newsfeeds[0].created_at,
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(len(response.data['newsfeeds']), 0)
+
+        # 有新的内容之后，下拉刷新可以拿到
+        tweet = self.create_tweet(followed_user)
+        new_newsfeed = self.create_newsfeed(user=self.linghu, tweet=tweet)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__gt': newsfeeds[0].created_at,
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(len(response.data['newsfeeds']), 1)
+        self.assertEqual(response.data['newsfeeds'][0]['id'], new_newsfeed.id)
+
+        # cursor 格式不对
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': 'not a datetime',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(NEWSFEED_PULL_FOLLOWER_THRESHOLD=2)
+    def test_pull_newsfeeds_of_celebrity(self):
+        # dongxie 有 3 个粉丝，超过了阈值，发帖走 pull 模式
+        self.linghu_client.post(FOLLOW_URL.format(self.dongxie.id))
+        for i in range(2):
+            user, client = self.create_user_and_client('fan{}'.format(i))
+            client.post(FOLLOW_URL.format(self.dongxie.id))
+        response = self.dongxie_client.post(POST_TWEETS_URL, {
+            'content': 'hello from dongxie',
+        })
+        celebrity_tweet_id = response.data['id']
+        # 只写了 dongxie 自己的 newsfeed，没有 push 给粉丝
+        self.assertEqual(NewsFeed.objects.filter(tweet_id=celebrity_tweet_id).count(), 1)
+
+        # 普通用户发帖还是 push
+        followed = self.create_user('followed')
+        self.create_friendship(self.linghu, followed)
+        pushed_tweet = self.create_tweet(followed)
+        NewsFeedService.fanout_to_followers(pushed_tweet)
+        self.assertEqual(NewsFeed.objects.filter(
+            user=self.linghu,
+            tweet=pushed_tweet,
+        ).exists(), True)
+
+        # linghu 读 newsfeed 的时候 pull 和 push 的合在一起，按时间倒序
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        results = response.data['newsfeeds']
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['tweet']['id'], pushed_tweet.id)
+        self.assertEqual(results[1]['tweet']['id'], celebrity_tweet_id)
+
+    @override_settings(NEWSFEED_PULL_FOLLOWER_THRESHOLD=0)
+    def test_pull_pagination(self):
+        page_size = EndlessPagination.page_size
+        celebrity = self.create_user('celebrity')
+        self.create_friendship(self.linghu, celebrity)
+        followed = self.create_user('followed')
+        self.create_friendship(self.linghu, followed)
+
+        # push 和 pull 交替出现
+        tweet_ids = []
+        for i in range(page_size):
+            pulled_tweet = self.create_tweet(celebrity)
+            pushed_tweet = self.create_tweet(followed)
+            self.create_newsfeed(self.linghu, pushed_tweet)
+            tweet_ids.extend([pulled_tweet.id, pushed_tweet.id])
+        tweet_ids = tweet_ids[::-1]
+
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        results = response.data['newsfeeds']
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(
+            [newsfeed['tweet']['id'] for newsfeed in results],
+            tweet_ids[:page_size],
+        )
+
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': results[-1]['created_at'],
+        })
+        results = response.data['newsfeeds']
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [newsfeed['tweet']['id'] for newsfeed in results],
+            tweet_ids[page_size:],
+        )
+
+    @override_settings(NEWSFEED_PULL_FOLLOWER_THRESHOLD=0)
+    def test_pushed_tweets_are_not_pulled_again(self):
+        page_size = EndlessPagination.page_size
+        celebrity = self.create_user('celebrity')
+        self.create_friendship(self.linghu, celebrity)
+        # 还没变成大 V 之前发的帖子 push 过了，push 的时间比发帖时间晚，两个不在同一页
+        old_tweet = self.create_tweet(celebrity)
+        tweet_ids = [self.create_tweet(celebrity).id for _ in range(page_size)]
+        self.create_newsfeed(self.linghu, old_tweet)
+
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        results = response.data['newsfeeds']
+        self.assertEqual(response.data['has_next_page'], True)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {
+            'created_at__lt': results[-1]['created_at'],
+        })
+        results += response.data['newsfeeds']
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [newsfeed['tweet']['id'] for newsfeed in results],
+            [old_tweet.id] + tweet_ids[::-1],
+        )
+
+    def test_list_query_count_is_constant(self):
+        def create_newsfeeds(count):
+            for i in range(count):
+                author = self.create_user('author{}'.format(NewsFeed.objects.count()))
+                self.create_newsfeed(self.linghu, self.create_tweet(author))
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.linghu_client.get(NEWSFEEDS_URL)
+            return len(response.data['newsfeeds']), len(context.captured_queries)
+
+        create_newsfeeds(2)
+        size, small_page_queries = count_queries()
+        self.assertEqual(size, 2)
+
+        create_newsfeeds(EndlessPagination.page_size)
+        self.clear_cache()
+        size, full_page_queries = count_queries()
+        self.assertEqual(size, EndlessPagination.page_size)
+        # 每一条 newsfeed 都是不同的 tweet 和不同的作者，query 数也不会增加
+        self.assertEqual(small_page_queries, full_page_queries)
+
+    def test_has_liked(self):
+        tweets = [self.create_tweet(self.dongxie) for _ in range(3)]
+        for tweet in tweets:
+            self.create_newsfeed(self.linghu, tweet)
+        self.create_like(self.linghu, tweets[1])
+        self.create_like(self.dongxie, tweets[2])
+
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [newsfeed['tweet']['has_liked'] for newsfeed in response.data['newsfeeds']],
+            [False, True, False],
+        )
+        self.assertEqual(
+            [newsfeed['tweet']['likes_count'] for newsfeed in response.data['newsfeeds']],
+            [1, 1, 0],
+        )
@@ -4,10 +4,13 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from newsfeeds.models import NewsFeed
 from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.services import NewsFeedService
+from utils.paginations import EndlessPagination
 
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = EndlessPagination
 
     def get_queryset(self):
         # 自定义 queryset，因为 newsfeed 的查看是有权限的
@@ -17,7 +20,34 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         return NewsFeed.objects.filter(user=self.request.user)
 
     def list(self, request):
-        serializer = NewsFeedSerializer(self.get_queryset(), many=True)
+        # GET /api/newsfeeds/?created_at__lt=xxx 翻页，每次只取一页
+        # 先看 redis 里缓存的最新的 newsfeeds 能不能回答这一页
+        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
+        newsfeeds = self.paginator.paginate_cached_list(cached_newsfeeds, request)
+        if newsfeeds is None:
+            # 翻到了 cache 之外，去数据库查
+            # 对应 SQL: where user_id = xxx and created_at < xxx order by created_at desc limit 21
+            # 会用到 (user, created_at) 的联合索引
+            newsfeeds = self.paginate_queryset(self.get_queryset())
+        has_next_page = self.paginator.has_next_page
+
+        # 关注的大 V 的帖子没有 push 进来，用同样的 cursor 去 pull 一页，再合并成一页
+        pull_tweets_queryset = NewsFeedService.get_pull_tweets_queryset(request.user.id)
+        # 已经 push 过的 tweets 在 get_pull_tweets_queryset 里就排除掉了，不会在不同的页上重复出现
+        if pull_tweets_queryset is not None:
+            tweets = self.paginate_queryset(pull_tweets_queryset)
+            self.paginator.has_next_page = has_next_page or self.paginator.has_next_page
+            newsfeeds = self.paginator.merge_ordered_lists(
+                newsfeeds,
+                NewsFeedService.tweets_to_newsfeeds(request.user, tweets),
+            )
+
+        serializer = NewsFeedSerializer(
+            newsfeeds,
+            context={'request': request},
+            many=True,
+        )
         return Response({
             'newsfeeds': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
         }, status=status.HTTP_200_OK)
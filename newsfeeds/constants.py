@@ -0,0 +1,11 @@
+from django.conf import settings
+
+# 每个 fanout 的子任务负责多少个粉丝
+# 测试的时候改小，才能测到多个 batch 的情况
+FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
+# 每个子任务里 bulk_create 的时候，每条 INSERT 语句最多写多少行
+NEWSFEED_BULK_CREATE_BATCH_SIZE = 500
+# 关注一个人之后，把 ta 最新的多少条 tweets 补进自己的 newsfeed
+NEWSFEED_BACKFILL_SIZE = 20 if not settings.TESTING else 3
+# 取关之后分批删 newsfeed，每批删多少行，避免一条 DELETE 锁住太多行
+NEWSFEED_CLEANUP_BATCH_SIZE = 1000 if not settings.TESTING else 3
@@ -0,0 +1,7 @@
+def push_newsfeed_to_cache(sender, instance, created, **kwargs):
+    # 只有新建的 newsfeed 需要 push 到 cache 里
+    if not created:
+        return
+
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.push_newsfeed_to_cache(instance)
@@ -1,8 +1,43 @@
-from newsfeeds.models import NewsFeed
+from django.conf import settings
+from django.db.models import Exists, OuterRef
 from friendships.services import FriendshipService
+from newsfeeds.models import NewsFeed
+from newsfeeds.tasks import (
+    backfill_newsfeeds_task,
+    cleanup_newsfeeds_task,
+    fanout_newsfeeds_main_task,
+)
+from tweets.models import Tweet
+from utils.redis_helper import RedisHelper
+
+USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
 
 
 class NewsFeedService(object):
+    """
+    push + pull 混合模式的 newsfeed
+    - 普通用户发帖：push，给每个粉丝写一条 NewsFeed
+    - 大 V（粉丝数 > NEWSFEED_PULL_FOLLOWER_THRESHOLD）发帖：只写自己的 NewsFeed，
+      粉丝读 newsfeed 的时候再去 pull 大 V 的 tweets，合并进来
+    这样大 V 发一条帖子不会写几百万行 NewsFeed
+    """
+
+    @classmethod
+    def is_pull_author(cls, user_id):
+        return user_id in cls.filter_pull_author_ids([user_id])
+
+    @classmethod
+    def filter_pull_author_ids(cls, user_ids):
+        # user_ids 里面哪些是走 pull 模式的大 V，粉丝数一次 multi-get 查完
+        if not user_ids:
+            return []
+        counts = FriendshipService.get_follower_counts(user_ids)
+        return [
+            user_id
+            for user_id in user_ids
+            if counts[user_id] > settings.NEWSFEED_PULL_FOLLOWER_THRESHOLD
+        ]
+
     # 在tweets/api/views.py 创建推文时自动分发给粉丝
     @classmethod
     def fanout_to_followers(cls, tweet):
@@ -17,10 +52,97 @@ class NewsFeedService(object):
         #     )
 
         # 正确的方法：使用 bulk_create，会把 insert 语句合成一条
-        newsfeeds = [
-            NewsFeed(user=follower, tweet=tweet)
-            for follower in FriendshipService.get_followers(tweet.user)
+        # 但是粉丝很多的时候，一条超大的 insert 会让发帖的 request 卡很久
+        # 所以现在只同步地把自己的 newsfeed 写好，保证自己马上能看到，
+        # 粉丝的 newsfeed 交给异步任务分批去写，request 直接返回
+        # create 会触发 post_save，自动 push 到 cache 里，见 newsfeeds/listeners.py
+        NewsFeed.objects.create(user_id=tweet.user_id, tweet_id=tweet.id)
+        # 大 V 的帖子不 push，粉丝读的时候 pull
+        if cls.is_pull_author(tweet.user_id):
+            return
+        # 异步任务的参数只传 id，不要传 tweet 这个 model instance
+        fanout_newsfeeds_main_task.delay(tweet.id, tweet.user_id)
+
+    @classmethod
+    def get_pull_author_ids(cls, user_id):
+        # user 关注的人里面，哪些是走 pull 模式的大 V
+        return cls.filter_pull_author_ids(FriendshipService.get_following_ids(user_id))
+
+    @classmethod
+    def get_pull_tweets_queryset(cls, user_id):
+        pull_author_ids = cls.get_pull_author_ids(user_id)
+        if not pull_author_ids:
+            return None
+        # where user_id in (...) and created_at < xxx order by created_at desc
+        # 会用到 tweet 上 (user, created_at) 的联合索引
+        # 大 V 粉丝数超过阈值之前发的帖子已经 push 过了，NewsFeed 的 created_at 是 push 的时间，
+        # 和 tweet 的发帖时间不一样，可能落在另一页上，只在当前页里去重是不够的
+        # 已经有 NewsFeed 的就不再 pull，用的是 newsfeed 上 (user, tweet) 的 unique 索引
+        return Tweet.objects.filter(user_id__in=pull_author_ids).filter(
+            ~Exists(NewsFeed.objects.filter(user_id=user_id, tweet_id=OuterRef('id'))),
+        )
+
+    @classmethod
+    def tweets_to_newsfeeds(cls, user, tweets):
+        # pull 来的 tweets 包装成没有存进数据库的 NewsFeed，这样可以和 push 的一起排序、序列化
+        return [
+            NewsFeed(user=user, tweet=tweet, created_at=tweet.created_at)
+            for tweet in tweets
         ]
-        # 把自己也加上
-        newsfeeds.append(NewsFeed(user=tweet.user, tweet=tweet))
-        NewsFeed.objects.bulk_create(newsfeeds)
+
+    @classmethod
+    def get_cached_newsfeeds(cls, user_id):
+        """
+        redis 里给每个用户存最新的 REDIS_LIST_LENGTH_LIMIT 条 newsfeed
+        cache miss 的时候从数据库 load
+        """
+        queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        newsfeeds = RedisHelper.load_objects(key, queryset, stats_name='user_newsfeeds')
+        # 多个 fanout 的 batch 是并行执行的，push 进 list 的顺序不一定严格按时间，重新排一下
+        # fanout 重试的时候同一条 tweet 可能被 push 了两次，去一下重
+        newsfeeds = sorted(newsfeeds, key=lambda newsfeed: newsfeed.created_at, reverse=True)
+        tweet_ids = set()
+        unique_newsfeeds = []
+        for newsfeed in newsfeeds:
+            if newsfeed.tweet_id in tweet_ids:
+                continue
+            tweet_ids.add(newsfeed.tweet_id)
+            unique_newsfeeds.append(newsfeed)
+        return unique_newsfeeds
+
+    @classmethod
+    def push_newsfeed_to_cache(cls, newsfeed):
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+        RedisHelper.push_object(key, newsfeed)
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, newsfeeds):
+        # fanout 的时候一个 batch 的 newsfeed 用一个 pipeline push，见 RedisHelper.push_objects
+        RedisHelper.push_objects([
+            (USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id), newsfeed)
+            for newsfeed in newsfeeds
+        ])
+
+    @classmethod
+    def invalidate_cached_newsfeeds(cls, user_id):
+        RedisHelper.invalidate(USER_NEWSFEEDS_PATTERN.format(user_id=user_id))
+
+    @classmethod
+    def backfill_newsfeeds(cls, user_id, followee_ids):
+        """
+        关注之后，异步地把被关注的人最新的若干条 tweets 补进自己的 newsfeed
+        大 V 的 tweets 是读的时候 pull 的，不需要补，在任务里判断
+        一次关注多个人的时候只放一个任务，限流是按 request 算的，不能让一个 request 放进几百个任务
+        """
+        if followee_ids:
+            backfill_newsfeeds_task.delay(user_id, list(followee_ids))
+
+    @classmethod
+    def cleanup_newsfeeds(cls, user_id, followee_ids):
+        """
+        取关之后，异步地把被取关的人的 tweets 从自己的 newsfeed 里分批删掉
+        和 backfill_newsfeeds 一样，一次取关多个人也只放一个任务
+        """
+        if followee_ids:
+            cleanup_newsfeeds_task.delay(user_id, list(followee_ids))
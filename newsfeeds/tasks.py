@@ -0,0 +1,164 @@
+from django.db.models import OuterRef, Subquery
+from friendships.services import FriendshipService
+from newsfeeds.constants import (
+    FANOUT_BATCH_SIZE,
+    NEWSFEED_BACKFILL_SIZE,
+    NEWSFEED_BULK_CREATE_BATCH_SIZE,
+    NEWSFEED_CLEANUP_BATCH_SIZE,
+)
+from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
+from utils.task_queue import task
+
+
+@task
+def fanout_newsfeeds_batch_task(tweet_id, tweet_user_id, after, until):
+    # newsfeeds.services 里 import 了这个文件，放在最上面会循环 import
+    from newsfeeds.services import NewsFeedService
+
+    # 每个 batch 只负责 (after, until] 这一段粉丝，见 FriendshipService.iter_follower_ranges
+    # 多个 batch 在 worker pool 里并行执行
+    follower_ids = FriendshipService.get_follower_ids_in_range(tweet_user_id, after, until)
+    # 任务重试或者 follow 的时候 backfill 过的，(user, tweet) 已经存在，跳过这些粉丝，
+    # 否则已经在 cache 里的 newsfeed 会被重复 push 一次
+    existing_ids = set(NewsFeed.objects.filter(
+        user_id__in=follower_ids,
+        tweet_id=tweet_id,
+    ).values_list('user_id', flat=True))
+    new_follower_ids = [
+        follower_id
+        for follower_id in follower_ids
+        if follower_id not in existing_ids
+    ]
+    if not new_follower_ids:
+        return
+    # ignore_conflicts: 上面检查完之后并发的 backfill 又写进去了的，不会因为 unique_together 让整个 batch 失败
+    # backfill 完会让整个 cache 失效，不需要在这里 push
+    NewsFeed.objects.bulk_create(
+        [
+            NewsFeed(user_id=follower_id, tweet_id=tweet_id)
+            for follower_id in new_follower_ids
+        ],
+        batch_size=NEWSFEED_BULK_CREATE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+    # bulk create 不会触发 post_save 的 signal，所以需要手动 push 到 cache 里
+    # sqlite / MySQL 上 bulk_create 不会把 id 回填到 instance 上，直接 push 的话 cache 里的 id 是 None，
+    # 所以从数据库里把刚写进去的行重新读出来再 push
+    # 整个 batch 的 push 放在一个 redis pipeline 里，不是每个粉丝各自几次网络往返
+    NewsFeedService.push_newsfeeds_to_cache(
+        NewsFeed.objects.filter(user_id__in=new_follower_ids, tweet_id=tweet_id),
+    )
+
+
+@task
+def fanout_newsfeeds_main_task(tweet_id, tweet_user_id):
+    # 主任务只负责把粉丝按 (created_at, id) 切成固定大小的 batch，真正的读粉丝 id 和写操作交给子任务
+    # 这样一个大 V 发帖不会变成一个超大的 bulk_create
+    # 放进队列里的只有每个 batch 的两个 cursor，不是粉丝 id，还没执行的子任务再多，
+    # 占的内存也只和 batch 的个数有关；每个子任务自己读出来的粉丝 id 和创建的 NewsFeed 最多一个 batch
+    batch_count = 0
+    for after, until in FriendshipService.iter_follower_ranges(
+        tweet_user_id,
+        FANOUT_BATCH_SIZE,
+    ):
+        fanout_newsfeeds_batch_task.delay(tweet_id, tweet_user_id, after, until)
+        batch_count += 1
+
+    # 粉丝数是 profile 里的计数，不需要为了返回值再 COUNT 一次
+    follower_count = FriendshipService.get_follower_counts([tweet_user_id])[tweet_user_id]
+    return '{} newsfeeds going to fanout, {} batches created.'.format(
+        follower_count,
+        batch_count,
+    )
+
+
+@task
+def backfill_newsfeeds_task(user_id, followee_ids):
+    # batch_follow 一次关注很多人的时候也只有一个任务，一起补，cache 也只失效一次
+    from newsfeeds.services import NewsFeedService
+
+    # 任务执行之前又取关了的，不需要补了
+    followee_ids = [
+        followee_id
+        for followee_id in followee_ids
+        if FriendshipService.has_followed(user_id, followee_id)
+    ]
+    # 大 V 的 tweets 是读的时候 pull 的，不需要补
+    # 要查粉丝数，放在异步任务里做，不占 follow 的 request 的时间
+    pull_author_ids = set(NewsFeedService.filter_pull_author_ids(followee_ids))
+    followee_ids = [
+        followee_id
+        for followee_id in followee_ids
+        if followee_id not in pull_author_ids
+    ]
+
+    # 每个人只补最新的 NEWSFEED_BACKFILL_SIZE 条，用到 tweet 上 (user, created_at) 的联合索引
+    tweet_ids = []
+    for followee_id in followee_ids:
+        tweet_ids.extend(Tweet.objects.filter(
+            user_id=followee_id,
+        ).order_by('-created_at').values_list('id', flat=True)[:NEWSFEED_BACKFILL_SIZE])
+    if not tweet_ids:
+        return '0 newsfeeds backfilled from 0 users.'
+    # 之前关注过又取关，有些 newsfeed 可能还没删掉，ignore_conflicts 跳过已经存在的
+    NewsFeed.objects.bulk_create(
+        [NewsFeed(user_id=user_id, tweet_id=tweet_id) for tweet_id in tweet_ids],
+        batch_size=NEWSFEED_BULK_CREATE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    # created_at 是 auto_now_add，bulk_create 的时候没法指定
+    # 改成 tweet 的发帖时间，补进来的 newsfeed 才会排在正确的位置，而不是全部堆在最上面
+    NewsFeed.objects.filter(user_id=user_id, tweet_id__in=tweet_ids).update(
+        created_at=Subquery(
+            Tweet.objects.filter(id=OuterRef('tweet_id')).values('created_at')[:1]
+        ),
+    )
+    # 补进来的 newsfeed 在 cache 的中间，直接让 cache 失效，下次读的时候重新 load
+    NewsFeedService.invalidate_cached_newsfeeds(user_id)
+    return '{} newsfeeds backfilled from {} users.'.format(len(tweet_ids), len(followee_ids))
+
+
+def _delete_newsfeeds(user_id, tweet_ids):
+    count, _ = NewsFeed.objects.filter(user_id=user_id, tweet_id__in=tweet_ids).delete()
+    return count
+
+
+def _cleanup_newsfeeds(user_id, followee_id):
+    # 按 tweet__user_id 过滤要 join tweet 表，没有索引能用上
+    # 先用 tweet 上 (user, created_at) 的联合索引把被取关的人的 tweet ids 读出来，
+    # 再分批按 (user, tweet) 的 unique 索引删，每次最多删 NEWSFEED_CLEANUP_BATCH_SIZE 行，
+    # 不会长时间锁住大量的行
+    tweet_ids = Tweet.objects.filter(
+        user_id=followee_id,
+    ).order_by().values_list('id', flat=True)
+    deleted = 0
+    batch = []
+    for tweet_id in tweet_ids.iterator():
+        batch.append(tweet_id)
+        if len(batch) == NEWSFEED_CLEANUP_BATCH_SIZE:
+            deleted += _delete_newsfeeds(user_id, batch)
+            batch = []
+    if batch:
+        deleted += _delete_newsfeeds(user_id, batch)
+    return deleted
+
+
+@task
+def cleanup_newsfeeds_task(user_id, followee_ids):
+    # batch_unfollow 一次取关很多人的时候也只有一个任务，cache 也只失效一次
+    from newsfeeds.services import NewsFeedService
+
+    # 任务执行之前又关注回去了的，不能删
+    followee_ids = [
+        followee_id
+        for followee_id in followee_ids
+        if not FriendshipService.has_followed(user_id, followee_id)
+    ]
+    deleted = 0
+    for followee_id in followee_ids:
+        deleted += _cleanup_newsfeeds(user_id, followee_id)
+    if followee_ids:
+        NewsFeedService.invalidate_cached_newsfeeds(user_id)
+    return '{} newsfeeds deleted from {} users.'.format(deleted, len(followee_ids))
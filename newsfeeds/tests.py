@@ -0,0 +1,218 @@
+from django.conf import settings
+from django.test import override_settings
+from newsfeeds.constants import (
+    FANOUT_BATCH_SIZE,
+    NEWSFEED_BACKFILL_SIZE,
+    NEWSFEED_CLEANUP_BATCH_SIZE,
+)
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService, USER_NEWSFEEDS_PATTERN
+from newsfeeds.tasks import (
+    backfill_newsfeeds_task,
+    cleanup_newsfeeds_task,
+    fanout_newsfeeds_main_task,
+)
+from testing.testcases import TestCase
+from unittest import mock
+from utils.local_redis import LocalRedis
+from utils.redis_client import RedisClient
+
+
+class NewsFeedTaskTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+
+    def test_fanout_main_task(self):
+        tweet = self.create_tweet(self.linghu, 'tweet 1')
+        self.create_friendship(self.dongxie, self.linghu)
+        msg = fanout_newsfeeds_main_task(tweet.id, self.linghu.id)
+        self.assertEqual(msg, '1 newsfeeds going to fanout, 1 batches created.')
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1)
+
+        # 粉丝数超过一个 batch，会拆成多个子任务
+        for i in range(FANOUT_BATCH_SIZE * 2):
+            user = self.create_user('follower{}'.format(i))
+            self.create_friendship(user, self.linghu)
+        tweet = self.create_tweet(self.linghu, 'tweet 2')
+        msg = fanout_newsfeeds_main_task(tweet.id, self.linghu.id)
+        self.assertEqual(
+            msg,
+            '{} newsfeeds going to fanout, 3 batches created.'.format(
+                FANOUT_BATCH_SIZE * 2 + 1,
+            ),
+        )
+        self.assertEqual(
+            NewsFeed.objects.filter(tweet=tweet).count(),
+            FANOUT_BATCH_SIZE * 2 + 1,
+        )
+        self.assertEqual(NewsFeed.objects.filter(
+            user=self.linghu,
+            tweet=tweet,
+        ).exists(), False)
+
+    def test_fanout_pushes_saved_newsfeeds_to_cache(self):
+        self.create_friendship(self.dongxie, self.linghu)
+        old_tweet = self.create_tweet(self.linghu, 'old')
+        fanout_newsfeeds_main_task(old_tweet.id, self.linghu.id)
+        # 先让 dongxie 的 newsfeed 进 cache，之后 fanout 的才会被 push 进去
+        NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+
+        tweet = self.create_tweet(self.linghu, 'new')
+        fanout_newsfeeds_main_task(tweet.id, self.linghu.id)
+        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        self.assertEqual(
+            [(newsfeed.id, newsfeed.tweet_id) for newsfeed in cached_newsfeeds],
+            list(NewsFeed.objects.filter(
+                user=self.dongxie,
+            ).order_by('-created_at').values_list('id', 'tweet_id')),
+        )
+        self.assertNotIn(None, [newsfeed.id for newsfeed in cached_newsfeeds])
+
+        # 重试的时候已经存在的 newsfeed 不会再 push 一次
+        fanout_newsfeeds_main_task(tweet.id, self.linghu.id)
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.dongxie.id)
+        self.assertEqual(conn.llen(key), 2)
+
+    def test_fanout_pushes_batch_in_one_pipeline(self):
+        followers = [self.dongxie, self.create_user('xidu')]
+        for follower in followers:
+            self.create_friendship(follower, self.linghu)
+        old_tweet = self.create_tweet(self.linghu, 'old')
+        fanout_newsfeeds_main_task(old_tweet.id, self.linghu.id)
+        for follower in followers:
+            NewsFeedService.get_cached_newsfeeds(follower.id)
+
+        tweet = self.create_tweet(self.linghu, 'new')
+        with mock.patch.object(
+            LocalRedis,
+            'pipeline',
+            autospec=True,
+            side_effect=LocalRedis.pipeline,
+        ) as pipeline:
+            fanout_newsfeeds_main_task(tweet.id, self.linghu.id)
+        # 两个粉丝在同一个 batch 里，只用了一个 pipeline
+        self.assertEqual(pipeline.call_count, 1)
+        for follower in followers:
+            cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(follower.id)
+            self.assertEqual(
+                [newsfeed.tweet_id for newsfeed in cached_newsfeeds],
+                [tweet.id, old_tweet.id],
+            )
+            self.assertNotIn(None, [newsfeed.id for newsfeed in cached_newsfeeds])
+
+    def test_backfill_newsfeeds_task(self):
+        tweets = [
+            self.create_tweet(self.linghu, str(i))
+            for i in range(NEWSFEED_BACKFILL_SIZE + 1)
+        ]
+        # 没有关注的话不补
+        msg = backfill_newsfeeds_task(self.dongxie.id, [self.linghu.id])
+        self.assertEqual(msg, '0 newsfeeds backfilled from 0 users.')
+        self.assertEqual(NewsFeed.objects.count(), 0)
+
+        self.create_friendship(self.dongxie, self.linghu)
+        # 已经存在的 newsfeed 会被跳过，不会报错
+        self.create_newsfeed(self.dongxie, tweets[-1])
+        conn = RedisClient.get_connection()
+        NewsFeedService.get_cached_newsfeeds(self.dongxie.id)
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.dongxie.id)
+        self.assertEqual(conn.exists(key), 1)
+
+        # 一个任务可以补多个人的，没有 tweets 的人也不会出错
+        other = self.create_user('other')
+        self.create_friendship(self.dongxie, other)
+        msg = backfill_newsfeeds_task(self.dongxie.id, [self.linghu.id, other.id])
+        self.assertEqual(msg, '{} newsfeeds backfilled from 2 users.'.format(
+            NEWSFEED_BACKFILL_SIZE,
+        ))
+        self.assertEqual(conn.exists(key), 0)
+        # 只补最新的 NEWSFEED_BACKFILL_SIZE 条，时间和 tweet 的发帖时间一致
+        newsfeeds = NewsFeed.objects.filter(user=self.dongxie).order_by('-created_at')
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+            [tweet.id for tweet in tweets[::-1][:NEWSFEED_BACKFILL_SIZE]],
+        )
+        for newsfeed in newsfeeds:
+            self.assertEqual(newsfeed.created_at, newsfeed.tweet.created_at)
+
+        # 大 V 的 tweets 是读的时候 pull 的，不补
+        with override_settings(NEWSFEED_PULL_FOLLOWER_THRESHOLD=0):
+            msg = backfill_newsfeeds_task(self.dongxie.id, [self.linghu.id])
+        self.assertEqual(msg, '0 newsfeeds backfilled from 0 users.')
+
+    def test_cleanup_newsfeeds_task(self):
+        other = self.create_user('other')
+        other_tweet = self.create_tweet(other)
+        self.create_newsfeed(self.dongxie, other_tweet)
+        for i in range(NEWSFEED_CLEANUP_BATCH_SIZE * 2 + 1):
+            self.create_newsfeed(self.dongxie, self.create_tweet(self.linghu, str(i)))
+
+        # 又关注回去了，不删
+        friendship = self.create_friendship(self.dongxie, self.linghu)
+        msg = cleanup_newsfeeds_task(self.dongxie.id, [self.linghu.id])
+        self.assertEqual(msg, '0 newsfeeds deleted from 0 users.')
+        self.assertEqual(NewsFeed.objects.filter(user=self.dongxie).count(), 8)
+
+        friendship.delete()
+        # 一个任务可以清理多个人的
+        nobody = self.create_user('nobody')
+        msg = cleanup_newsfeeds_task(self.dongxie.id, [self.linghu.id, nobody.id])
+        self.assertEqual(msg, '{} newsfeeds deleted from 2 users.'.format(
+            NEWSFEED_CLEANUP_BATCH_SIZE * 2 + 1,
+        ))
+        # 别人的 newsfeed 不受影响
+        self.assertEqual(
+            list(NewsFeed.objects.filter(user=self.dongxie).values_list('tweet_id', flat=True)),
+            [other_tweet.id],
+        )
+
+
+class NewsFeedServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+
+    def test_get_cached_newsfeeds(self):
+        newsfeed_ids = []
+        for i in range(3):
+            tweet = self.create_tweet(self.dongxie)
+            newsfeed = self.create_newsfeed(self.linghu, tweet)
+            newsfeed_ids.append(newsfeed.id)
+        newsfeed_ids = newsfeed_ids[::-1]
+
+        # cache miss
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.linghu.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+
+        # cache hit
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.linghu.id)
+        self.assertEqual(conn.llen(key), 3)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.linghu.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+        # 从 cache 里取出来的 created_at 精度不能丢
+        self.assertEqual(
+            newsfeeds[0].created_at,
+            NewsFeed.objects.get(id=newsfeed_ids[0]).created_at,
+        )
+
+        # 新建的 newsfeed 会被 push 进 cache
+        tweet = self.create_tweet(self.linghu)
+        new_newsfeed = self.create_newsfeed(self.linghu, tweet)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.linghu.id)
+        newsfeed_ids.insert(0, new_newsfeed.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+
+    def test_cache_is_capped(self):
+        conn = RedisClient.get_connection()
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.linghu.id)
+        for i in range(settings.REDIS_LIST_LENGTH_LIMIT + 3):
+            tweet = self.create_tweet(self.dongxie)
+            self.create_newsfeed(self.linghu, tweet)
+            if i == 0:
+                NewsFeedService.get_cached_newsfeeds(self.linghu.id)
+        self.assertEqual(conn.llen(key), settings.REDIS_LIST_LENGTH_LIMIT)
@@ -48,6 +48,12 @@ sudo mysql -u root << EOF
 EOF
 # fi
 
+# 安装 memcached，User / Tweet 等 object 的 cache 用，见 utils/memcached_helper.py
+sudo apt-get install -y memcached
+
+# 安装 redis，newsfeed 等的 cache 用，见 utils/redis_client.py
+sudo apt-get install -y redis
+
 # 本项目的superuser（admin的那个号），不是通过这个provision文件配置的，是通过vagrant命令行
 # python manage.py createsuperuser 创建的
 # 只有admin有权限查看后台用户
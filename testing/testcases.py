@@ -1,12 +1,15 @@
-from django.contrib.contenttypes.models import ContentType
-
 from comments.models import Comment
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.test import TestCase as DjangoTestCase
 from rest_framework.test import APIClient
 
+from friendships.models import Friendship
 from likes.models import Like
+from likes.registry import LikeableRegistry
+from newsfeeds.models import NewsFeed
 from tweets.models import Tweet
+from utils.redis_client import RedisClient
 
 '''
 防止重名，把Django的TestCase改名成DjangoTestCase
@@ -16,6 +19,17 @@ from tweets.models import Tweet
 
 class TestCase(DjangoTestCase):
 
+    def _pre_setup(self):
+        super(TestCase, self)._pre_setup()
+        # 每个 test 的数据库都会回滚，id 会被重复使用，cache 也要一起清掉
+        # 放在这里就不需要每个 setUp 都记得去调用
+        self.clear_cache()
+
+    def clear_cache(self):
+        RedisClient.clear()
+        for cache in caches.all():
+            cache.clear()
+
     @property
     def anonymous_client(self):
         if hasattr(self, '_anonymous_client'):
@@ -45,12 +59,18 @@ class TestCase(DjangoTestCase):
 
     def create_like(self, user, target):
         instance, _ = Like.objects.get_or_create(
-            content_type=ContentType.objects.get_for_model(target.__class__),
+            content_type_id=LikeableRegistry.get_content_type_id(target.__class__),
             object_id=target.id,
             user=user,
         )
         return instance
 
+    def create_friendship(self, from_user, to_user):
+        return Friendship.objects.create(from_user=from_user, to_user=to_user)
+
+    def create_newsfeed(self, user, tweet):
+        return NewsFeed.objects.create(user=user, tweet=tweet)
+
     def create_user_and_client(self, *args, **kwargs):
         user = self.create_user(*args, **kwargs)
         client = APIClient()
@@ -2,15 +2,41 @@ from accounts.api.serializers import UserSerializerForTweet, UserSerializer
 from rest_framework import serializers
 
 from comments.api.serializers import CommentSerializer
+from comments.services import CommentService
+from likes.services import LikeService
 from tweets.models import Tweet
+from utils.hydration import HydratedListSerializer
 
 
 class TweetSerializer(serializers.ModelSerializer):
-    user = UserSerializerForTweet()
+    user = UserSerializerForTweet(source='cached_user')
+    has_liked = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
-        fields = ('id', 'user', 'created_at', 'content')
+        fields = (
+            'id',
+            'user',
+            'created_at',
+            'content',
+            'comments_count',
+            'likes_count',
+            'has_liked',
+        )
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('user',)
+
+    def batch_load(self, instances):
+        # 一页 tweets 的 has_liked 用一条 query 查出来
+        LikeService.prefetch_has_liked(self.context, instances)
+        LikeService.prefetch_likes_count(self.context, instances)
+
+    def get_has_liked(self, obj):
+        return LikeService.has_liked(self.context, obj)
+
+    def get_likes_count(self, obj):
+        return LikeService.get_likes_count(self.context, obj)
 
 
 class TweetCreateSerializer(serializers.ModelSerializer):
@@ -28,9 +54,32 @@ class TweetCreateSerializer(serializers.ModelSerializer):
 
 
 class TweetSerializerWithComments(serializers.ModelSerializer):
-    user = UserSerializer()
-    comments = CommentSerializer(source='comment_set', many=True)
+    user = UserSerializer(source='cached_user')
+    # 不用 source='comment_set'，那样每次都要去数据库里查所有的 comments，
+    # 热门的 tweet 评论很多的时候会非常慢，改成读 redis 里缓存的最新的若干条
+    comments = serializers.SerializerMethodField()
+    has_liked = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
-        fields = ('id', 'user', 'comments', 'created_at', 'content')
\ No newline at end of file
+        fields = (
+            'id',
+            'user',
+            'comments',
+            'created_at',
+            'content',
+            'comments_count',
+            'likes_count',
+            'has_liked',
+        )
+
+    def get_comments(self, obj):
+        comments = CommentService.get_cached_comments(obj.id)
+        return CommentSerializer(comments, many=True, context=self.context).data
+
+    def get_has_liked(self, obj):
+        return LikeService.has_liked(self.context, obj)
+
+    def get_likes_count(self, obj):
+        return LikeService.get_likes_count(self.context, obj)
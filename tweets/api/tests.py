@@ -1,12 +1,25 @@
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from tweets.models import Tweet
+from tweets.services import USER_TWEETS_PATTERN
+from utils.metrics import (
+    DB_QUERIES,
+    REQUEST_LATENCY,
+    SERIALIZER_LATENCY,
+    clear_metrics,
+)
+from utils.redis_client import RedisClient
 
 
 # 注意要加 '/' 结尾，要不然会产生 301 redirect
 TWEET_LIST_API = '/api/tweets/'
 TWEET_CREATE_API = '/api/tweets/'
 TWEET_RETRIEVE_API = '/api/tweets/{}/'
+METRICS_URL = '/metrics'
 
 
 class TweetApiTests(TestCase):
@@ -51,11 +64,30 @@ class TweetApiTests(TestCase):
         self.create_comment(self.user1, self.create_tweet(self.user2), ...)
         response = self.anonymous_client.get(url)
         self.assertEqual(len(response.data['comments']), 2)
+        self.assertEqual(response.data['comments_count'], 2)
+        self.assertEqual(response.data['likes_count'], 0)
+
+    def test_retrieve_query_count(self):
+        tweet = self.create_tweet(self.user1)
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+        for i in range(10):
+            user = self.create_user('commenter{}'.format(i))
+            self.create_comment(user, tweet)
+        self.anonymous_client.get(url)
+
+        # comments 和 comments 的 user 都在 cache 里，只剩下 get_object 的一条 query
+        with self.assertNumQueries(1):
+            response = self.anonymous_client.get(url)
+        self.assertEqual(len(response.data['comments']), 10)
+        self.assertEqual(response.data['comments'][0]['user']['username'], 'commenter0')
 
     def test_list_api(self):
         # 必须带 user_id
         response = self.anonymous_client.get(TWEET_LIST_API)
         self.assertEqual(response.status_code, 400)
+        # user_id 必须是整数
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
 
         # 正常 request
         response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
@@ -67,6 +99,125 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.data['tweets'][0]['id'], self.tweets2[1].id)
         self.assertEqual(response.data['tweets'][1]['id'], self.tweets2[0].id)
 
+        # '01' 和 '1' 读的是同一个 cache，发帖之后马上能看到
+        user_id = '0{}'.format(self.user1.id)
+        self.anonymous_client.get(TWEET_LIST_API, {'user_id': user_id})
+        response = self.user1_client.post(TWEET_CREATE_API, {'content': 'new tweet'})
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': user_id})
+        self.assertEqual(len(response.data['tweets']), 4)
+
+    def test_pagination(self):
+        # 25 条 tweets 里有 10 条的 created_at 完全一样，翻页的时候要靠 id 来区分
+        tweets = self.tweets1 + [self.create_tweet(self.user1) for _ in range(22)]
+        Tweet.objects.filter(
+            id__in=[tweet.id for tweet in tweets[5:15]],
+        ).update(created_at=tweets[5].created_at)
+        expected_ids = [
+            tweet.id
+            for tweet in sorted(
+                Tweet.objects.filter(user=self.user1),
+                key=lambda tweet: (tweet.created_at, tweet.id),
+                reverse=True,
+            )
+        ]
+
+        # 第一页
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'page_size': 10,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['id'] for t in response.data['tweets']], expected_ids[:10])
+        self.assertEqual(response.data['has_next_page'], True)
+
+        # 用 before 一直往下翻，不会重复也不会遗漏
+        ids = [t['id'] for t in response.data['tweets']]
+        while response.data['has_next_page']:
+            response = self.anonymous_client.get(TWEET_LIST_API, {
+                'user_id': self.user1.id,
+                'page_size': 10,
+                'before': response.data['before_cursor'],
+            })
+            ids += [t['id'] for t in response.data['tweets']]
+        self.assertEqual(ids, expected_ids)
+
+        # after 从离 cursor 最近的开始取，结果还是新的在前面
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'page_size': 10,
+            'after': response.data['after_cursor'],
+        })
+        self.assertEqual([t['id'] for t in response.data['tweets']], expected_ids[10:20])
+        self.assertEqual(response.data['has_next_page'], True)
+
+        # 两个 cursor 之间的空档
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'after': response.data['before_cursor'],
+            'before': response.data['after_cursor'],
+        })
+        self.assertEqual([t['id'] for t in response.data['tweets']], expected_ids[11:19])
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # 默认 page size，以及 page size 的上限
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(len(response.data['tweets']), 20)
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'page_size': 1000,
+        })
+        self.assertEqual(len(response.data['tweets']), 25)
+
+        # 参数不对
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'before': 'abc',
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'page_size': 0,
+        })
+        self.assertEqual(response.status_code, 400)
+
+        # 没有数据的时候 cursor 是 None
+        response = self.anonymous_client.get(TWEET_LIST_API, {
+            'user_id': self.user1.id,
+            'before': '{}_{}'.format(tweets[0].created_at.isoformat(), 0),
+        })
+        self.assertEqual(response.data['tweets'], [])
+        self.assertEqual(response.data['before_cursor'], None)
+
+    def test_pagination_past_cache_window(self):
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        for _ in range(limit + 5 - len(self.tweets1)):
+            self.create_tweet(self.user1)
+        expected_ids = list(Tweet.objects.filter(
+            user=self.user1,
+        ).order_by('-created_at', '-id').values_list('id', flat=True))
+
+        ids, cursor, has_next_page = [], None, True
+        while has_next_page:
+            params = {'user_id': self.user1.id, 'page_size': 10}
+            if cursor is not None:
+                params['before'] = cursor
+            response = self.anonymous_client.get(TWEET_LIST_API, params)
+            ids += [t['id'] for t in response.data['tweets']]
+            cursor = response.data['before_cursor']
+            has_next_page = response.data['has_next_page']
+        self.assertEqual(ids, expected_ids)
+        # cache 里只有最新的 limit 条
+        conn = RedisClient.get_connection()
+        key = USER_TWEETS_PATTERN.format(user_id=self.user1.id)
+        self.assertEqual(conn.llen(key), limit)
+
+        # 新发的帖子马上就能在第一页看到
+        response = self.user1_client.post(TWEET_CREATE_API, {'content': 'a brand new tweet'})
+        new_tweet_id = response.data['id']
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.data['tweets'][0]['id'], new_tweet_id)
+        self.assertEqual(conn.llen(key), limit)
+
     def test_create_api(self):
         # 必须登录
         response = self.anonymous_client.post(TWEET_CREATE_API)
@@ -126,3 +277,79 @@ class TweetApiTests(TestCase):
         e.g. if not serializers.is_valid():
 
         '''
+
+
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        clear_metrics()
+        self.user = self.create_user('user1')
+        self.create_tweet(self.user)
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_server_timing_and_histograms(self):
+        labels = {
+            'view': 'TweetViewSet',
+            'action': 'list',
+            'method': 'GET',
+            'status': 200,
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user.id})
+        self.assertEqual(response.status_code, 200)
+        server_timing = response['Server-Timing']
+        self.assertIn('db;desc="{} queries";dur='.format(len(queries)), server_timing)
+        self.assertIn('serializer;dur=', server_timing)
+        self.assertIn('total;dur=', server_timing)
+
+        # 按 viewset 和 action 记进 histogram
+        self.assertEqual(REQUEST_LATENCY.get(**labels)['count'], 1)
+        self.assertEqual(DB_QUERIES.get(**labels)['sum'], len(queries))
+        self.assertGreater(SERIALIZER_LATENCY.get(**labels)['sum'], 0)
+        self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user.id})
+        self.assertEqual(REQUEST_LATENCY.get(**labels)['count'], 2)
+
+        # 参数不对的请求单独计数
+        self.anonymous_client.get(TWEET_LIST_API)
+        self.assertEqual(REQUEST_LATENCY.get(**{**labels, 'status': 400})['count'], 1)
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_server_timing_can_be_disabled(self):
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user.id})
+        self.assertEqual(response.has_header('Server-Timing'), False)
+
+    @override_settings(METRICS_TOKEN='metrics-token')
+    def test_metrics_endpoint(self):
+        self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user.id})
+        response = self.anonymous_client.get(
+            METRICS_URL,
+            HTTP_AUTHORIZATION='Bearer metrics-token',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode('utf-8')
+        self.assertIn('# TYPE http_request_duration_seconds histogram', content)
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{view="TweetViewSet",action="list",method="GET",status="200"} 1',
+            content,
+        )
+        self.assertIn(
+            'http_request_db_queries_bucket'
+            '{view="TweetViewSet",action="list",method="GET",status="200",le="+Inf"} 1',
+            content,
+        )
+        # RedisHelper 的 cache 命中率也一起暴露出来
+        self.assertIn('cache_requests_total{cache="user_tweets",result="miss"} 1', content)
+
+        # 没有 token 或者 token 不对
+        response = self.anonymous_client.get(METRICS_URL)
+        self.assertEqual(response.status_code, 403)
+        response = self.anonymous_client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.anonymous_client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer 令牌')
+        self.assertEqual(response.status_code, 403)
+        # 没有配置 token 的时候谁都不能访问
+        with override_settings(METRICS_TOKEN=None):
+            response = self.anonymous_client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer None')
+        self.assertEqual(response.status_code, 403)
@@ -3,8 +3,10 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from tweets.api.serializers import TweetSerializer, TweetCreateSerializer, TweetSerializerWithComments
 from tweets.models import Tweet
+from tweets.services import TweetService
 from newsfeeds.services import NewsFeedService
 from utils.decorators import required_params
+from utils.paginations import KeysetPagination
 
 
 class TweetViewSet(viewsets.GenericViewSet):
@@ -13,6 +15,7 @@ class TweetViewSet(viewsets.GenericViewSet):
     """
     queryset = Tweet.objects.all()
     serializer_class = TweetCreateSerializer
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         # 进行权限验证
@@ -24,7 +27,10 @@ class TweetViewSet(viewsets.GenericViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         tweet = self.get_object()
-        return Response(TweetSerializerWithComments(tweet).data)
+        return Response(TweetSerializerWithComments(
+            tweet,
+            context={'request': request},
+        ).data)
 
     @required_params(params=['user_id'])
     def list(self, request):
@@ -38,17 +44,39 @@ class TweetViewSet(viewsets.GenericViewSet):
 
         # 这句查询会被翻译为
         # select * from twitter_tweets
-        # where user_id = xxx
-        # order by created_at desc
+        # where user_id = xxx and (created_at < x or (created_at = x and id < y))
+        # order by created_at desc, id desc
+        # limit page_size + 1
         # 这句 SQL 查询会用到 user 和 created_at 的联合索引
         # 单纯的 user 索引是不够的
-        tweets = Tweet.objects.filter(
-            user_id=request.query_params['user_id']
-        ).order_by('-created_at')
-        serializer = TweetSerializer(tweets, many=True)
+        # 每次只取一页，发了很多帖子的用户的主页也不会一次性把所有的 tweets 都读出来
+        # 先看 redis 里缓存的最新的 tweets 能不能回答这一页，翻到 cache 之外再去数据库查
+        # user_id 会被拼进 cache 的 key 里，'01' 和 '1' 是两个 key，发帖的时候只会 push 到 '1' 那个，
+        # 所以先转成 int，转不了的直接报错
+        try:
+            user_id = int(request.query_params['user_id'])
+        except ValueError:
+            return Response({
+                'message': 'user_id must be an integer',
+                'success': False,
+            }, status=400)
+        cached_tweets = TweetService.get_cached_tweets(user_id)
+        tweets = self.paginator.paginate_cached_list(cached_tweets, request)
+        if tweets is None:
+            tweets = self.paginate_queryset(Tweet.objects.filter(user_id=user_id))
+        else:
+            tweets = TweetService.get_tweets_through_cache(tweets)
+        serializer = TweetSerializer(
+            tweets,
+            context={'request': request},
+            many=True,
+        )
         # 一般来说 json 格式的 response 默认都要用 hash 的格式
         # 而不能用 list 的格式（约定俗成）
-        return Response({'tweets': serializer.data})
+        return Response({
+            'tweets': serializer.data,
+            **self.paginator.get_page_info(),
+        })
 
     def create(self, request, *args, **kwargs):
         """
@@ -71,4 +99,7 @@ class TweetViewSet(viewsets.GenericViewSet):
         tweet = serializer.save()
         # newsfeeds/services/ 创建推文时自动分发给粉丝
         NewsFeedService.fanout_to_followers(tweet)
-        return Response(TweetSerializer(tweet).data, status=201)
+        return Response(
+            TweetSerializer(tweet, context={'request': request}).data,
+            status=201,
+        )
@@ -0,0 +1,14 @@
+def push_tweet_to_cache(sender, instance, created, **kwargs):
+    # TweetCreateSerializer.create 里的 Tweet.objects.create 会触发这里，
+    # 写数据库的同时写 cache，admin 或者 shell 里创建的 tweet 也一样
+    if not created:
+        return
+
+    from tweets.services import TweetService
+    TweetService.push_tweet_to_cache(instance)
+
+
+def invalidate_cached_tweets(sender, instance, **kwargs):
+    # 删掉的 tweet 可能在 list 的任何位置，直接把这个用户的 list 删掉，下次读的时候重新 load
+    from tweets.services import TweetService
+    TweetService.invalidate_cached_tweets(instance.user_id)
@@ -1,8 +1,11 @@
-from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.contrib.auth.models import User
 
 from likes.models import Like
+from likes.registry import LikeableRegistry
+from tweets.listeners import invalidate_cached_tweets, push_tweet_to_cache
+from utils.memcached_helper import MemcachedHelper
 from utils.time_helpers import utc_now
 
 
@@ -20,6 +23,12 @@ class Tweet(models.Model):
     # auto_now 每次更新时都会更新时间
     updated_at = models.DateTimeField(auto_now=True)
 
+    # 反范式化（denormalize）的计数，避免每次都去 COUNT(*)
+    # 由 likes/listeners.py 和 comments/listeners.py 用 F() 原子地 +1 / -1
+    # 如果出现了偏差，用 python manage.py reconcile_counters 修复
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+
     class Meta:
         index_together = (('user', 'created_at'),)
         ordering = ('user', '-created_at')
@@ -55,10 +64,24 @@ class Tweet(models.Model):
     @property
     def like_set(self):
         return Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(Tweet),
+            content_type_id=LikeableRegistry.get_content_type_id(Tweet),
             object_id=self.id,
         ).order_by('-created_at')
 
+    @property
+    def cached_user(self):
+        # 走 memcached，不会每次都去数据库里查 user
+        return MemcachedHelper.get_related_object_through_cache(self, 'user')
+
+
+# tweet 被修改或者删除的时候，把 memcached 里的 tweet 删掉
+MemcachedHelper.register(Tweet)
+# tweet 可以被 like
+LikeableRegistry.register(Tweet)
+# 每个用户的 tweets 在 redis 里的 cache，见 tweets/services.py
+post_save.connect(push_tweet_to_cache, sender=Tweet)
+post_delete.connect(invalidate_cached_tweets, sender=Tweet)
+
 # 定义完model之后要修改数据库--migrate
 # 1. python manage.py makemigartions 前提条件是tweets里面已经有一个migrations文件夹
 # 如果没有migrations文件夹，python manage.py makemigartions tweets （在后面加上app的名字）
@@ -0,0 +1,42 @@
+from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_helper import RedisHelper
+
+USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
+
+
+class TweetService(object):
+    """
+    每个用户最新的 REDIS_LIST_LENGTH_LIMIT 条 tweets 缓存在 redis list 里，用来回答个人主页的翻页
+    - 发帖的时候 push 到 list 的头上（write-through），见 tweets/listeners.py
+    - 删帖的时候把整个 list 删掉，下次读的时候重新 load
+    - 翻到 cache 之外的时候去数据库查
+    list 里的 tweet 只用来决定这一页有哪些 tweets，likes_count 这种会变的字段以 memcached 里的为准
+    """
+
+    @classmethod
+    def get_cached_tweets(cls, user_id):
+        queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+        key = USER_TWEETS_PATTERN.format(user_id=user_id)
+        tweets = RedisHelper.load_objects(key, queryset, stats_name='user_tweets')
+        # 并发发帖的时候 push 的顺序不一定严格按照时间，按照翻页用的 (created_at, id) 重新排一下
+        return sorted(tweets, key=lambda tweet: (tweet.created_at, tweet.id), reverse=True)
+
+    @classmethod
+    def get_tweets_through_cache(cls, tweets):
+        # 从 redis list 里拿到的 tweet 的 likes_count 等字段可能已经过期了，
+        # 用一次 multi-get 从 memcached 换成最新的，已经被删掉的 tweet 就不返回了
+        objects = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [tweet.id for tweet in tweets],
+        )
+        return [objects[tweet.id] for tweet in tweets if tweet.id in objects]
+
+    @classmethod
+    def push_tweet_to_cache(cls, tweet):
+        key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
+        RedisHelper.push_object(key, tweet)
+
+    @classmethod
+    def invalidate_cached_tweets(cls, user_id):
+        RedisHelper.invalidate(USER_TWEETS_PATTERN.format(user_id=user_id))
@@ -1,7 +1,16 @@
+from comments.models import Comment
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from io import StringIO
+from likes.services import LikesCountBuffer
 from testing.testcases import TestCase
 from tweets.models import Tweet
+from tweets.services import TweetService, USER_TWEETS_PATTERN
+from unittest import mock
 from datetime import timedelta
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 from utils.time_helpers import utc_now
 
 
@@ -28,3 +37,168 @@ class TweetTests(TestCase):
         dongxie = self.create_user('dongxie')
         self.create_like(dongxie, self.tweet)
         self.assertEqual(self.tweet.like_set.count(), 2)
+
+    def test_cached_user(self):
+        tweet = Tweet.objects.get(id=self.tweet.id)
+        # 第一次走数据库，之后都从 memcached 里拿
+        with self.assertNumQueries(1):
+            self.assertEqual(tweet.cached_user, self.linghu)
+        tweet = Tweet.objects.get(id=self.tweet.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(tweet.cached_user.username, 'linghu')
+
+        # user 改了之后 cache 会被删掉，不会读到旧的数据
+        self.linghu.username = 'linghuchong'
+        self.linghu.save()
+        tweet = Tweet.objects.get(id=self.tweet.id)
+        self.assertEqual(tweet.cached_user.username, 'linghuchong')
+
+    def test_get_objects_through_cache(self):
+        tweets = [self.tweet] + [self.create_tweet(self.linghu) for i in range(2)]
+        tweet_ids = [tweet.id for tweet in tweets]
+        with self.assertNumQueries(1):
+            objects = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        self.assertEqual(set(objects.keys()), set(tweet_ids))
+
+        # 删掉的 tweet 会从 cache 里删掉，剩下的都是 cache hit
+        tweets[0].delete()
+        with self.assertNumQueries(1):
+            objects = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        self.assertEqual(set(objects.keys()), set(tweet_ids[1:]))
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        with self.assertNumQueries(0):
+            MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids[1:])
+
+    def test_counters(self):
+        dongxie = self.create_user('dongxie')
+        self.create_like(self.linghu, self.tweet)
+        self.create_like(dongxie, self.tweet)
+        comment = self.create_comment(dongxie, self.tweet)
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+        self.assertEqual(self.tweet.comments_count, 1)
+
+        self.tweet.like_set.filter(user=dongxie).delete()
+        comment.delete()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(self.tweet.comments_count, 0)
+
+        # cache 里的 tweet 也要是最新的计数
+        self.create_like(dongxie, self.tweet)
+        tweet = MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id)
+        self.assertEqual(tweet.likes_count, 2)
+
+    def test_reconcile_counters(self):
+        dongxie = self.create_user('dongxie')
+        self.create_like(dongxie, self.tweet)
+        comment = self.create_comment(dongxie, self.tweet)
+        self.create_like(self.linghu, comment)
+        another_tweet = self.create_tweet(dongxie)
+        # 模拟计数出现了偏差
+        Tweet.objects.filter(id=self.tweet.id).update(likes_count=5, comments_count=0)
+        Tweet.objects.filter(id=another_tweet.id).update(likes_count=-1)
+        Comment.objects.filter(id=comment.id).update(likes_count=0)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('tweet.likes_count: 2 fixed', out.getvalue())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 5)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--batch-size', '1', stdout=out)
+        self.assertIn('tweet.likes_count: 2 fixed', out.getvalue())
+        self.assertIn('tweet.comments_count: 1 fixed', out.getvalue())
+        self.assertIn('comment.likes_count: 1 fixed', out.getvalue())
+        self.tweet.refresh_from_db()
+        another_tweet.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 1)
+        self.assertEqual(self.tweet.comments_count, 1)
+        self.assertEqual(another_tweet.likes_count, 0)
+        self.assertEqual(comment.likes_count, 1)
+
+    def test_reconcile_counters_skips_pending_likes(self):
+        Tweet.objects.filter(id=self.tweet.id).update(likes_count=3)
+        # flush 之后又来了还没写回数据库的增量
+        with mock.patch.object(LikesCountBuffer, 'maybe_flush'):
+            LikesCountBuffer.add(Tweet, self.tweet.id, 1)
+        with mock.patch.object(LikesCountBuffer, 'flush'):
+            out = StringIO()
+            call_command('reconcile_counters', stdout=out)
+        self.assertIn('tweet.likes_count: 0 fixed', out.getvalue())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 3)
+
+
+class TweetServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+
+    def test_get_cached_tweets(self):
+        tweet_ids = [self.create_tweet(self.linghu).id for _ in range(3)]
+        conn = RedisClient.get_connection()
+        key = USER_TWEETS_PATTERN.format(user_id=self.linghu.id)
+
+        # cache miss，从数据库 load
+        tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids[::-1])
+        self.assertEqual(conn.llen(key), 3)
+        # cache hit
+        tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids[::-1])
+        stats = RedisHelper.get_stats()
+        self.assertEqual(stats['user_tweets.miss'], 1)
+        self.assertEqual(stats['user_tweets.hit'], 1)
+
+        # 发帖的时候 write-through
+        tweet = self.create_tweet(self.linghu)
+        tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.assertEqual(tweets[0].id, tweet.id)
+        self.assertEqual(conn.llen(key), 4)
+
+        # 删帖的时候整个 list 失效
+        tweet.delete()
+        self.assertEqual(conn.exists(key), 0)
+        tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids[::-1])
+
+    def test_get_tweets_through_cache(self):
+        tweet = self.create_tweet(self.linghu)
+        cached_tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.create_like(self.create_user('dongxie'), tweet)
+
+        # redis 里的 likes_count 是旧的，memcached 里的是新的
+        self.assertEqual(cached_tweets[0].likes_count, 0)
+        tweets = TweetService.get_tweets_through_cache(cached_tweets)
+        self.assertEqual(tweets[0].likes_count, 1)
+
+    def test_push_during_lazy_load(self):
+        conn = RedisClient.get_connection()
+        key = USER_TWEETS_PATTERN.format(user_id=self.linghu.id)
+        queryset = Tweet.objects.filter(user=self.linghu).order_by('-created_at')
+        new_tweet = Tweet(id=0, user=self.linghu)
+
+        class PushWhileLoading(object):
+            # 模拟读数据库和写 cache 之间，别的 request 发了一条新的 tweet
+            def __getitem__(self, item):
+                objects = list(queryset[item])
+                RedisHelper.push_object(key, new_tweet)
+                return objects
+
+        RedisHelper.load_objects(key, PushWhileLoading())
+        # 读到的数据可能缺了新的那一条，不能写进 cache
+        self.assertEqual(conn.exists(key), 0)
+
+        # 两个并发的 cache miss 不会把 list 写成两份
+        class LoadWhileLoading(object):
+            def __getitem__(self, item):
+                objects = list(queryset[item])
+                RedisHelper.load_objects(key, queryset)
+                return objects
+
+        RedisHelper.load_objects(key, LoadWhileLoading())
+        self.assertEqual(conn.llen(key), Tweet.objects.filter(user=self.linghu).count())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,6 +28,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['127.0.0.1', '192.168.33.10', 'localhost']
 
+# 是否在跑单元测试 python manage.py test
+TESTING = ((" ".join(sys.argv)).find('manage.py test') != -1)
+
 # Application definition
 # 用startapp创建的文件夹都记得要加进来，否则不能makemigrations
 
@@ -51,6 +55,7 @@ INSTALLED_APPS = [
     'newsfeeds',
     'comments',
     'likes',
+    'utils',
 ]
 
 REST_FRAMEWORK = {
@@ -59,9 +64,15 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    # 用 ScopedRateThrottle 的 action 按照 throttle_scope 限制每个用户的请求频率
+    'DEFAULT_THROTTLE_RATES': {
+        'friendship': '60/min',
+    },
 }
 
 MIDDLEWARE = [
+    # 每个 request 的 SQL 条数和耗时、serializer 耗时、总耗时，见 utils/middlewares.py
+    'utils.middlewares.RequestMetricsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -145,6 +156,57 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# 线上用 memcached，单元测试用 LocMem，每个进程一份，不需要起 memcached
+# 用法见 utils/memcached_helper.py
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'TIMEOUT': 86400,
+    },
+}
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'TIMEOUT': 86400,
+        },
+    }
+# User / Tweet / Comment 这些 object 在 memcached 里存多久（秒）
+OBJECT_CACHE_TIMEOUT = 86400
+
+# 进程内的异步任务队列，见 utils/task_queue.py
+# 单元测试的时候所有任务同步执行，不需要起 worker
+TASK_QUEUE_WORKERS = 8
+TASK_QUEUE_ALWAYS_EAGER = TESTING
+
+# 粉丝数超过这个值的用户发帖不再 push 给每个粉丝，而是粉丝读 newsfeed 的时候去 pull
+# 见 newsfeeds/services.py
+NEWSFEED_PULL_FOLLOWER_THRESHOLD = 10000
+# redis
+# 线上用 redis-server，单元测试用进程内的 LocalRedis，见 utils/redis_client.py
+REDIS_BACKEND = 'local' if TESTING else 'redis'
+REDIS_HOST = '127.0.0.1'
+REDIS_PORT = 6379
+REDIS_DB = 0 if TESTING else 1
+REDIS_KEY_EXPIRE_TIME = 7 * 86400  # in seconds
+# 每个 list 最多 cache 多少个 objects，比如每个用户最新的多少条 newsfeed
+REDIS_LIST_LENGTH_LIMIT = 200 if not TESTING else 30
+LOCAL_REDIS_MAX_KEYS = 10000
+
+# 点赞数先攒在 redis 里，每隔 LIKES_COUNT_FLUSH_INTERVAL 秒合并写回数据库一次，见 likes/services.py
+# 单元测试默认关掉，直接写数据库，测 write-behind 的时候用 override_settings 打开
+LIKES_COUNT_WRITE_BEHIND = not TESTING
+LIKES_COUNT_FLUSH_INTERVAL = 5
+
+# 每个 request 的耗时写进 response 的 Server-Timing header，见 utils/middlewares.py
+# header 里有 SQL 的条数，谁都能看到，线上默认不打开
+SERVER_TIMING_HEADER = DEBUG
+# /metrics 给 prometheus 抓，请求里要带 Authorization: Bearer <METRICS_TOKEN>
+# 不按 IP 限制，前面有 nginx 之类的反向代理的时候 REMOTE_ADDR 都是 127.0.0.1
+# 在 local_settings.py 里配置，没有配置的时候 /metrics 谁都不能访问
+METRICS_TOKEN = None
+
 try:
     from .local_settings import *
 except:
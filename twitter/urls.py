@@ -23,6 +23,7 @@ from likes.api.views import LikeViewSet
 from newsfeeds.api.views import NewsFeedViewSet
 from rest_framework import routers
 from tweets.api.views import TweetViewSet
+from utils.metrics import metrics_view
 
 # 创建一个新的views要指定url路径
 
@@ -39,6 +40,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include(router.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('metrics', metrics_view),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class UtilsConfig(AppConfig):
+    name = 'utils'
+
+    def ready(self):
+        # serializer 的耗时统计见 utils/middlewares.py
+        from utils.middlewares import install_serializer_timer
+        install_serializer_timer()
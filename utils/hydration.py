@@ -0,0 +1,84 @@
+from django.db import models
+from rest_framework import serializers
+from utils.memcached_helper import MemcachedHelper
+
+
+def hydrate_foreign_key(instances, field_name):
+    """
+    把一组 instances 的某个 ForeignKey 一次性取出来，挂到每个 instance 上
+    比如 hydrate_foreign_key(tweets, 'user') 最多只会执行一条
+    select * from auth_user where id in (...)
+    之后再访问 tweet.user 就不会再去数据库里查了，避免 N + 1 Queries
+    已经取过的（比如 select_related 过或者之前 hydrate 过的）不会重复取
+    返回取到的 related objects
+    """
+    instances = [
+        instance
+        for instance in instances
+        if instance is not None
+    ]
+    if not instances:
+        return []
+
+    field = instances[0]._meta.get_field(field_name)
+    missing_ids = {
+        getattr(instance, field.attname)
+        for instance in instances
+        if not field.is_cached(instance)
+    }
+    missing_ids.discard(None)
+    objects = {}
+    if missing_ids:
+        # 有 object cache 的 model 先用 multi-get 从 cache 里拿，剩下的再去数据库
+        if MemcachedHelper.is_registered(field.related_model):
+            objects = MemcachedHelper.get_objects_through_cache(
+                field.related_model,
+                missing_ids,
+            )
+        else:
+            objects = field.related_model.objects.in_bulk(missing_ids)
+
+    related_objects = []
+    for instance in instances:
+        if not field.is_cached(instance):
+            # 不能直接 setattr(instance, field_name, obj)，取不到的时候 obj 是 None，
+            # 会把 instance 上的 xxx_id 也改掉
+            field.set_cached_value(
+                instance,
+                objects.get(getattr(instance, field.attname)),
+            )
+        related_object = field.get_cached_value(instance)
+        if related_object is not None:
+            related_objects.append(related_object)
+    return related_objects
+
+
+def hydrate(instances, paths):
+    """
+    paths 用 django 的 '__' 写法表示多层的 ForeignKey，比如 ('tweet', 'tweet__user')
+    每一层每一个 model 只会执行一条 IN Query
+    """
+    for path in paths:
+        objects = instances
+        for field_name in path.split('__'):
+            objects = hydrate_foreign_key(objects, field_name)
+
+
+class HydratedListSerializer(serializers.ListSerializer):
+    """
+    序列化一个 list 的时候先把需要的 ForeignKey 都批量取出来，再一个个渲染
+    用法：在 child serializer 的 Meta 里加上
+        list_serializer_class = HydratedListSerializer
+        hydrate_fields = ('tweet', 'tweet__user')
+    child serializer 如果定义了 batch_load(instances)，hydrate 之后会调用一次，
+    用来批量准备 ForeignKey 以外的数据，比如当前用户有没有点过赞
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        instances = list(iterable)
+        hydrate(instances, getattr(self.child.Meta, 'hydrate_fields', ()))
+        batch_load = getattr(self.child, 'batch_load', None)
+        if batch_load is not None:
+            batch_load(instances)
+        return super(HydratedListSerializer, self).to_representation(instances)
@@ -0,0 +1,246 @@
+import time
+from collections import OrderedDict
+from threading import RLock
+
+
+def _to_bytes(value):
+    # 和 redis-py 保持一致，存进去的东西都会变成 bytes，取出来的也是 bytes
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+def _slice(items, start, end):
+    # redis 的 start / end 都是闭区间，并且支持负数下标
+    length = len(items)
+    if start < 0:
+        start = max(length + start, 0)
+    if end < 0:
+        end = length + end
+    return items[start:end + 1]
+
+
+class LocalRedis(object):
+    """
+    进程内的 redis 替代品，只实现了项目里用到的那一部分命令，接口和 redis-py 一致
+    单元测试和本地开发的时候用它，不需要真的起一个 redis-server
+
+    key 的数量有上限，超过的时候按照 LRU 淘汰最久没有被访问的 key，
+    相当于 redis 配置了 maxmemory-policy allkeys-lru
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._expire_at = {}
+        self._lock = RLock()
+
+    def _get(self, key, default=None):
+        key = _to_bytes(key)
+        expire_at = self._expire_at.get(key)
+        if expire_at is not None and expire_at <= time.time():
+            self._delete(key)
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def _set(self, key, value):
+        key = _to_bytes(key)
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            evicted_key, _ = self._data.popitem(last=False)
+            self._expire_at.pop(evicted_key, None)
+
+    def _delete(self, key):
+        key = _to_bytes(key)
+        self._expire_at.pop(key, None)
+        return self._data.pop(key, None) is not None
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._get(key) is not None)
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._delete(key))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._get(key) is None:
+                return False
+            self._expire_at[_to_bytes(key)] = time.time() + seconds
+            return True
+
+    def rename(self, src, dst):
+        with self._lock:
+            value = self._get(src)
+            if value is None:
+                raise KeyError('no such key')
+            expire_at = self._expire_at.get(_to_bytes(src))
+            self._delete(src)
+            self._delete(dst)
+            self._set(dst, value)
+            if expire_at is not None:
+                self._expire_at[_to_bytes(dst)] = expire_at
+            return True
+
+    # string
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._get(key) is not None:
+                return None
+            self._delete(key)
+            self._set(key, _to_bytes(value))
+            if ex is not None:
+                self._expire_at[_to_bytes(key)] = time.time() + ex
+            return True
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self._get(key, b'0')) + amount
+            self._set(key, _to_bytes(value))
+            return value
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expire_at.clear()
+            return True
+
+    # list
+    def lpush(self, key, *values):
+        with self._lock:
+            items = self._get(key, [])
+            items[:0] = [_to_bytes(value) for value in reversed(values)]
+            self._set(key, items)
+            return len(items)
+
+    def lpushx(self, key, *values):
+        # key 存在的时候才 push，不存在的话什么都不做，返回 0
+        with self._lock:
+            if self._get(key) is None:
+                return 0
+            return self.lpush(key, *values)
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._get(key, [])
+            items.extend(_to_bytes(value) for value in values)
+            self._set(key, items)
+            return len(items)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            return list(_slice(self._get(key, []), start, end))
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            items = self._get(key)
+            if items is None:
+                return True
+            items = _slice(items, start, end)
+            if items:
+                self._set(key, items)
+            else:
+                self._delete(key)
+            return True
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._get(key, []))
+
+    # set
+    def sadd(self, key, *values):
+        with self._lock:
+            members = self._get(key, set())
+            size = len(members)
+            members.update(_to_bytes(value) for value in values)
+            self._set(key, members)
+            return len(members) - size
+
+    def srem(self, key, *values):
+        with self._lock:
+            members = self._get(key)
+            if members is None:
+                return 0
+            size = len(members)
+            members.difference_update(_to_bytes(value) for value in values)
+            if not members:
+                self._delete(key)
+            return size - len(members)
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get(key, set()))
+
+    def sismember(self, key, value):
+        with self._lock:
+            return _to_bytes(value) in self._get(key, set())
+
+    def scard(self, key):
+        with self._lock:
+            return len(self._get(key, set()))
+
+    # hash
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            values = self._get(key, {})
+            field = _to_bytes(field)
+            value = int(values.get(field, b'0')) + amount
+            values[field] = _to_bytes(value)
+            self._set(key, values)
+            return value
+
+    def hmget(self, key, fields):
+        with self._lock:
+            values = self._get(key, {})
+            return [values.get(_to_bytes(field)) for field in fields]
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, {}))
+
+    # pipeline
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline(object):
+    """
+    和 redis-py 的 pipeline 一样，调用的命令先攒起来，execute 的时候按顺序一起执行，
+    返回每条命令的结果；进程内没有网络往返，这里只是让接口保持一致
+    """
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self._redis, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def reset(self):
+        self._commands = []
+
+    def execute(self):
+        with self._redis._lock:
+            commands, self._commands = self._commands, []
+            return [command(*args, **kwargs) for command, args, kwargs in commands]
@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+
+cache = caches['default']
+
+
+def invalidate_object_cache(sender, instance, **kwargs):
+    MemcachedHelper.invalidate_cached_object(sender, instance.pk)
+
+
+class MemcachedHelper(object):
+    """
+    按照 model + id 缓存 model instance，读的时候 read-through，写的时候 invalidate
+    只有 register 过的 model 才会走 cache，register 的时候会自动在 post_save / post_delete
+    的时候把 cache 删掉，保证不会读到脏数据
+    """
+    _cached_models = set()
+
+    @classmethod
+    def register(cls, model_class):
+        # 在 models.py 的最后调用 MemcachedHelper.register(Model)
+        cls._cached_models.add(model_class)
+        post_save.connect(invalidate_object_cache, sender=model_class)
+        post_delete.connect(invalidate_object_cache, sender=model_class)
+
+    @classmethod
+    def is_registered(cls, model_class):
+        return model_class in cls._cached_models
+
+    @classmethod
+    def get_key(cls, model_class, object_id):
+        return '{}:{}'.format(model_class._meta.label_lower, object_id)
+
+    @classmethod
+    def get_object_through_cache(cls, model_class, object_id):
+        key = cls.get_key(model_class, object_id)
+
+        # cache hit
+        obj = cache.get(key)
+        if obj:
+            return obj
+
+        # cache miss
+        obj = model_class.objects.filter(id=object_id).first()
+        if obj:
+            cache.set(key, obj, settings.OBJECT_CACHE_TIMEOUT)
+        return obj
+
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        multi-get，返回 {object_id: obj}
+        先用一次 get_many 从 cache 里拿，没有的再用一条 IN Query 从数据库里拿
+        """
+        object_ids = set(object_ids)
+        keys = {
+            cls.get_key(model_class, object_id): object_id
+            for object_id in object_ids
+        }
+        objects = {
+            keys[key]: obj
+            for key, obj in cache.get_many(keys.keys()).items()
+        }
+        missing_ids = object_ids - set(objects.keys())
+        if missing_ids:
+            missing_objects = model_class.objects.in_bulk(missing_ids)
+            cache.set_many({
+                cls.get_key(model_class, object_id): obj
+                for object_id, obj in missing_objects.items()
+            }, settings.OBJECT_CACHE_TIMEOUT)
+            objects.update(missing_objects)
+        return objects
+
+    @classmethod
+    def get_related_object_through_cache(cls, instance, field_name):
+        """
+        比如 get_related_object_through_cache(tweet, 'user')
+        已经取过 tweet.user 的话直接用，没有取过的话走 cache，并且挂到 instance 上
+        """
+        field = instance._meta.get_field(field_name)
+        if not field.is_cached(instance):
+            object_id = getattr(instance, field.attname)
+            obj = None
+            if object_id is not None:
+                obj = cls.get_object_through_cache(field.related_model, object_id)
+            field.set_cached_value(instance, obj)
+        return field.get_cached_value(instance)
+
+    @classmethod
+    def invalidate_cached_object(cls, model_class, object_id):
+        key = cls.get_key(model_class, object_id)
+        cache.delete(key)
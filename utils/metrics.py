@@ -0,0 +1,179 @@
+import hmac
+from bisect import bisect_left
+from threading import Lock
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from utils.redis_helper import RedisHelper
+
+# 秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram(object):
+    """
+    进程内的 histogram，和 prometheus 的 histogram 一样是累计的 bucket
+    每一组 labels 一份，observe 只是在对应的 bucket 上加一，不保存原始数据，内存是固定的
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        # 落在第一个 >= value 的 bucket 里，比最大的 bucket 还大的只算进 +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0,
+                    'count': 0,
+                }
+            values = self._values[key]
+            if index < len(self.buckets):
+                values['buckets'][index] += 1
+            values['sum'] += value
+            values['count'] += 1
+
+    def get(self, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            values = self._values.get(key)
+            return None if values is None else {
+                'buckets': list(values['buckets']),
+                'sum': values['sum'],
+                'count': values['count'],
+            }
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+            for key, values in items:
+                labels = list(zip(self.label_names, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, values['buckets']):
+                    cumulative += count
+                    lines.append('{}_bucket{{{}}} {}'.format(
+                        self.name,
+                        _format_labels(labels + [('le', _format_value(float(bound)))]),
+                        cumulative,
+                    ))
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    self.name,
+                    _format_labels(labels + [('le', '+Inf')]),
+                    values['count'],
+                ))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    self.name,
+                    _format_labels(labels),
+                    _format_value(values['sum']),
+                ))
+                lines.append('{}_count{{{}}} {}'.format(
+                    self.name,
+                    _format_labels(labels),
+                    values['count'],
+                ))
+        return lines
+
+
+VIEW_LABELS = ('view', 'action', 'method', 'status')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Total request latency.',
+    VIEW_LABELS,
+    LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries',
+    'Number of database queries per request.',
+    VIEW_LABELS,
+    QUERY_COUNT_BUCKETS,
+)
+DB_LATENCY = Histogram(
+    'http_request_db_duration_seconds',
+    'Time spent in database queries per request.',
+    VIEW_LABELS,
+    LATENCY_BUCKETS,
+)
+SERIALIZER_LATENCY = Histogram(
+    'http_request_serializer_duration_seconds',
+    'Time spent in DRF serializers per request.',
+    VIEW_LABELS,
+    LATENCY_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_LATENCY, DB_QUERIES, DB_LATENCY, SERIALIZER_LATENCY)
+
+
+def render_cache_stats():
+    # RedisHelper 记录的 cache 命中率，所有进程共用 redis 里的同一个 hash，本身就是累计的 counter
+    lines = [
+        '# HELP cache_requests_total Cache lookups by cache name and result.',
+        '# TYPE cache_requests_total counter',
+    ]
+    for field, value in sorted(RedisHelper.get_stats().items()):
+        name, _, result = field.rpartition('.')
+        lines.append('cache_requests_total{{{}}} {}'.format(
+            _format_labels([('cache', name), ('result', result)]),
+            value,
+        ))
+    return lines
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(render_cache_stats())
+    return '\n'.join(lines) + '\n'
+
+
+def clear_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+def metrics_view(request):
+    """
+    GET /metrics 给 prometheus 抓的纯文本格式
+    histogram 是进程内的，每个进程要单独抓
+    prometheus 的 scrape config 里配置 bearer_token，和 settings.METRICS_TOKEN 一样才能访问
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    # compare_digest 只接受 ASCII 的 str，header 里有非 ASCII 字符的时候会抛 TypeError，统一转成 bytes 再比
+    if not token or not hmac.compare_digest(
+        authorization.encode('utf-8'),
+        'Bearer {}'.format(token).encode('utf-8'),
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
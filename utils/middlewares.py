@@ -0,0 +1,123 @@
+import time
+from functools import wraps
+from threading import local
+
+from django.conf import settings
+from django.db import connection
+from rest_framework import serializers
+from utils.metrics import DB_LATENCY, DB_QUERIES, REQUEST_LATENCY, SERIALIZER_LATENCY
+
+_current = local()
+
+
+class RequestMetrics(object):
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.view = 'unknown'
+        self.action = 'unknown'
+        self.db_queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        # serializer.data 里面还可能再调用别的 serializer.data，只统计最外层的
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper 的 wrapper，每一条 SQL 都会经过这里
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.perf_counter() - started_at
+
+
+def _timed_data(data_property):
+    @wraps(data_property.fget)
+    def data(self):
+        metrics = getattr(_current, 'metrics', None)
+        if metrics is None:
+            return data_property.fget(self)
+        started_at = time.perf_counter()
+        metrics.serializer_depth += 1
+        try:
+            return data_property.fget(self)
+        finally:
+            metrics.serializer_depth -= 1
+            if metrics.serializer_depth == 0:
+                metrics.serializer_time += time.perf_counter() - started_at
+    return property(data)
+
+
+def install_serializer_timer():
+    # Serializer.data 和 ListSerializer.data 最后都会走到 BaseSerializer.data，
+    # 在这里计时就能覆盖所有 view 里的 XxxSerializer(...).data，不需要每个 view 自己计时
+    # 在 utils/apps.py 的 ready 里调用，只会 patch 一次，和 middleware 有没有被实例化无关
+    if getattr(serializers.BaseSerializer, '_request_metrics_installed', False):
+        return
+    serializers.BaseSerializer.data = _timed_data(serializers.BaseSerializer.data)
+    serializers.BaseSerializer._request_metrics_installed = True
+
+
+class RequestMetricsMiddleware(object):
+    """
+    线上用的轻量的 profiling，debug_toolbar 只能在本地用
+    每个 request 记录：SQL 的条数和耗时（connection.execute_wrapper）、serializer 的耗时、总耗时
+    - 按照 DRF 的 viewset 和 action 打标签，记进 utils/metrics.py 里进程内的 histogram，
+      由 /metrics 给 prometheus 抓
+    - settings.SERVER_TIMING_HEADER = True 的时候，写进 response 的 Server-Timing header，
+      浏览器的 devtools 里可以直接看到
+    放在 MIDDLEWARE 的最前面，总耗时才会包括其他 middleware 的时间
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        request.metrics = metrics
+        _current.metrics = metrics
+        try:
+            # DRF 的 Response 在 get_response 里面就已经 render 好了，render 的时间也算在总耗时里
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.metrics = None
+        total_time = time.perf_counter() - metrics.started_at
+
+        labels = {
+            'view': metrics.view,
+            'action': metrics.action,
+            'method': request.method,
+            'status': response.status_code,
+        }
+        REQUEST_LATENCY.observe(total_time, **labels)
+        DB_QUERIES.observe(metrics.db_queries, **labels)
+        DB_LATENCY.observe(metrics.db_time, **labels)
+        SERIALIZER_LATENCY.observe(metrics.serializer_time, **labels)
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = ', '.join([
+                'db;desc="{} queries";dur={:.2f}'.format(
+                    metrics.db_queries,
+                    metrics.db_time * 1000,
+                ),
+                'serializer;dur={:.2f}'.format(metrics.serializer_time * 1000),
+                'total;dur={:.2f}'.format(total_time * 1000),
+            ])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is None:
+            return None
+        # DRF 的 as_view 会把 viewset 的 class 和 {method: action} 挂在 view_func 上
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None:
+            metrics.view = getattr(view_func, '__name__', 'unknown')
+            metrics.action = request.method.lower()
+            return None
+        metrics.view = view_class.__name__
+        actions = getattr(view_func, 'actions', None) or {}
+        metrics.action = actions.get(request.method.lower(), request.method.lower())
+        return None
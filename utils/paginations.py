@@ -0,0 +1,289 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+
+
+def _parse_datetime(value):
+    # 解析不了返回 None，没有带时区的当作 UTC
+    try:
+        value = parse_datetime(value)
+    except ValueError:
+        return None
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+class EndlessPagination(BasePagination):
+    """
+    无限滚动（endless scroll）的翻页方式，用 created_at 作为 cursor，而不是用 page number
+    - 下拉刷新：GET ?created_at__gt=<最新一条的 created_at>，拿比它新的数据
+    - 上滑加载：GET ?created_at__lt=<最后一条的 created_at>，拿比它旧的数据
+    - 两个参数都不带就是第一页
+
+    为什么不用 PageNumberPagination？
+    1. OFFSET 翻页需要数据库先扫过前面所有的行，越往后翻越慢
+    2. 翻页的过程中有新的数据插进来，用 page number 会出现重复或者遗漏
+    用 created_at 做 cursor 的话，每一页都是 (user, created_at) 联合索引上的一段区间扫描，
+    最多只取 page_size + 1 行，不管翻到第几页代价都是一样的
+    """
+    page_size = 20
+
+    def __init__(self):
+        super(EndlessPagination, self).__init__()
+        self.has_next_page = False
+
+    def to_html(self):
+        pass
+
+    def _parse_cursor(self, request, param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        cursor = _parse_datetime(value)
+        if cursor is None:
+            raise ValidationError({param: 'Invalid datetime format.'})
+        return cursor
+
+    def paginate_queryset(self, queryset, request, view=None):
+        created_at__gt = self._parse_cursor(request, 'created_at__gt')
+        created_at__lt = self._parse_cursor(request, 'created_at__lt')
+        if created_at__gt is not None:
+            queryset = queryset.filter(created_at__gt=created_at__gt)
+        if created_at__lt is not None:
+            queryset = queryset.filter(created_at__lt=created_at__lt)
+
+        # 多取一条，用来判断还有没有下一页，省掉一次 COUNT(*)
+        # 下拉刷新的时候如果新数据超过了一页，has_next_page=True 说明中间还有空档，
+        # 前端可以同时带上 created_at__gt 和 created_at__lt 把空档补上
+        queryset = queryset.order_by('-created_at')[:self.page_size + 1]
+        objects = list(queryset)
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
+
+    def paginate_cached_list(self, cached_list, request):
+        """
+        cached_list 是 cache 里按 created_at 倒序存的最新的若干条数据
+        能用 cache 回答这一页就返回这一页，回答不了（这一页有一部分在 cache 之外）就返回 None，
+        调用的地方再去数据库里用 paginate_queryset 查
+        """
+        created_at__gt = self._parse_cursor(request, 'created_at__gt')
+        created_at__lt = self._parse_cursor(request, 'created_at__lt')
+        objects = [
+            obj for obj in cached_list
+            if (created_at__gt is None or obj.created_at > created_at__gt)
+            and (created_at__lt is None or obj.created_at < created_at__lt)
+        ]
+
+        # cache 里就已经凑够了一页还多，这一页肯定是对的
+        if len(objects) > self.page_size:
+            self.has_next_page = True
+            return objects[:self.page_size]
+        # cache 里的数据比长度上限少，说明所有的数据都已经在 cache 里了
+        # 或者下拉刷新要的数据都比 cache 里最旧的那条还新，也都在 cache 里
+        if len(cached_list) < settings.REDIS_LIST_LENGTH_LIMIT or (
+            created_at__gt is not None
+            and created_at__gt >= cached_list[-1].created_at
+        ):
+            self.has_next_page = False
+            return objects
+        # 剩下的情况，数据库里可能还有没 load 进 cache 的数据，直接去数据库查
+        return None
+
+    def merge_ordered_lists(self, *ordered_lists):
+        """
+        把几路各自已经分好页（都是 created_at 倒序，每路最多 page_size 条）的数据合成一页
+        每一路都已经是这一路里最靠前的 page_size 条，所以合并之后的前 page_size 条一定就是正确的一页
+        调用之前 has_next_page 应该已经是各路 has_next_page 的 or
+        """
+        merged = sorted(
+            [item for ordered_list in ordered_lists for item in ordered_list],
+            key=lambda item: item.created_at,
+            reverse=True,
+        )
+        if len(merged) > self.page_size:
+            self.has_next_page = True
+        return merged[:self.page_size]
+
+
+class KeysetPagination(BasePagination):
+    """
+    用 (created_at, id) 做 cursor 的 keyset pagination
+    和 EndlessPagination 的区别是多了 id 作为 tie-breaker：bulk_create 或者并发写入的时候
+    created_at 可能一模一样，只用 created_at 做 cursor 会漏掉或者重复翻到同一时刻的数据
+
+    - ?before=<cursor>  比 cursor 旧的数据，从离 cursor 最近的开始取
+    - ?after=<cursor>   比 cursor 新的数据，从离 cursor 最近的开始取，所以不会跳过中间的数据
+    - 两个都带就是取两个 cursor 之间的空档，按照 before 的方向取
+    - 两个都不带就是第一页，descending=True 从最新的开始，descending=False 从最旧的开始
+    - ?page_size=<n> 每页多少条，不能超过 max_page_size
+    - order_query_param 不为空的时候，可以用 ?<order_query_param>=asc|desc 改变 descending
+
+    返回的数据都按照 descending 指定的顺序排好，has_next_page 表示按照取数据的方向还有没有更多的数据
+    before_cursor / after_cursor 分别是这一页里最旧和最新的一条，直接拿来当下一次的 before / after
+    SQL 是 where created_at < x or (created_at = x and id < y) order by created_at desc, id desc，
+    (user, created_at) 联合索引上的一段区间扫描（InnoDB 的二级索引里本来就带着主键 id），
+    不管翻到第几页代价都是 O(page_size)
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_field = 'created_at'
+    descending = True
+    order_query_param = None
+
+    def __init__(self):
+        super(KeysetPagination, self).__init__()
+        self.has_next_page = False
+        self.page = []
+
+    def to_html(self):
+        pass
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            page_size = 0
+        if page_size <= 0:
+            raise ValidationError({self.page_size_query_param: 'Must be a positive integer.'})
+        return min(page_size, self.max_page_size)
+
+    def get_descending(self, request):
+        if self.order_query_param is None:
+            return self.descending
+        value = request.query_params.get(self.order_query_param)
+        if value is None:
+            return self.descending
+        if value not in ('asc', 'desc'):
+            raise ValidationError({self.order_query_param: 'Must be asc or desc.'})
+        return value == 'desc'
+
+    def format_cursor_value(self, value):
+        # cursor_field 不是时间的子类里覆盖这两个方法，比如按照一个整数排序
+        return value.isoformat()
+
+    def parse_cursor_value(self, value):
+        return _parse_datetime(value)
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.cursor_field)
+        return '{}_{}'.format(self.format_cursor_value(value), obj.id)
+
+    def decode_cursor(self, request, param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        key, _, object_id = value.rpartition('_')
+        key = self.parse_cursor_value(key)
+        if key is None or not object_id.isdigit():
+            raise ValidationError({param: 'Invalid cursor.'})
+        return key, int(object_id)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.descending = self.get_descending(request)
+        page_size = self.get_page_size(request)
+        before = self.decode_cursor(request, 'before')
+        after = self.decode_cursor(request, 'after')
+        field = self.cursor_field
+        if before is not None:
+            queryset = queryset.filter(
+                Q(**{field + '__lt': before[0]}) | Q(**{field: before[0], 'id__lt': before[1]})
+            )
+        if after is not None:
+            queryset = queryset.filter(
+                Q(**{field + '__gt': after[0]}) | Q(**{field: after[0], 'id__gt': after[1]})
+            )
+
+        # 按照取数据的方向排序，多取一条用来判断还有没有更多的数据，省掉一次 COUNT(*)
+        fetch_descending = self._fetch_descending(before, after)
+        if fetch_descending:
+            queryset = queryset.order_by('-' + field, '-id')
+        else:
+            queryset = queryset.order_by(field, 'id')
+        objects = list(queryset[:page_size + 1])
+        self.has_next_page = len(objects) > page_size
+        objects = objects[:page_size]
+        if fetch_descending != self.descending:
+            objects.reverse()
+        self.page = objects
+        return objects
+
+    def paginate_cached_list(self, cached_list, request, limit=None):
+        """
+        cached_list 是 cache 里按照 descending 指定的顺序存的最前面的最多 limit 条数据
+        能用 cache 回答这一页就返回这一页，回答不了（这一页有一部分在 cache 之外）就返回 None，
+        调用的地方再去数据库里用 paginate_queryset 查
+        """
+        if limit is None:
+            limit = settings.REDIS_LIST_LENGTH_LIMIT
+        self.descending = self.get_descending(request)
+        page_size = self.get_page_size(request)
+        before = self.decode_cursor(request, 'before')
+        after = self.decode_cursor(request, 'after')
+        objects = [
+            obj for obj in cached_list
+            if (before is None or self.get_key(obj) < before)
+            and (after is None or self.get_key(obj) > after)
+        ]
+
+        # cache 里的数据比长度上限少，说明所有的数据都已经在 cache 里了
+        # 或者 cursor 落在 cache 的范围之内，cursor 和 cache 的头之间的数据也都在 cache 里
+        complete = len(cached_list) < limit
+        if cached_list and not complete:
+            last_key = self.get_key(cached_list[-1])
+            if self.descending:
+                complete = after is not None and after >= last_key
+            else:
+                complete = before is not None and before <= last_key
+
+        if self._fetch_descending(before, after) == self.descending:
+            # 从 cache 的头往后取，cache 里就已经凑够了一页还多，这一页肯定是对的
+            if len(objects) > page_size:
+                self.has_next_page = True
+                objects = objects[:page_size]
+            elif complete:
+                self.has_next_page = False
+            else:
+                return None
+        else:
+            # 从 cursor 往 cache 的头的方向取离 cursor 最近的一页，需要 cursor 之后的数据都在 cache 里
+            if not complete:
+                return None
+            self.has_next_page = len(objects) > page_size
+            objects = objects[-page_size:] if objects else []
+        self.page = objects
+        return objects
+
+    def get_key(self, obj):
+        return getattr(obj, self.cursor_field), obj.id
+
+    def _fetch_descending(self, before, after):
+        if before is not None:
+            return True
+        if after is not None:
+            return False
+        return self.descending
+
+    def get_page_info(self):
+        """
+        返回给前端的翻页信息，和数据一起放进 response 里
+        """
+        before_cursor, after_cursor = None, None
+        if self.page:
+            oldest, newest = self.page[-1], self.page[0]
+            if not self.descending:
+                oldest, newest = newest, oldest
+            before_cursor = self.encode_cursor(oldest)
+            after_cursor = self.encode_cursor(newest)
+        return {
+            'has_next_page': self.has_next_page,
+            'before_cursor': before_cursor,
+            'after_cursor': after_cursor,
+        }
@@ -0,0 +1,37 @@
+from django.conf import settings
+from utils.local_redis import LocalRedis
+
+
+class RedisClient(object):
+    """
+    settings.REDIS_BACKEND
+    - 'redis': 连真正的 redis-server，线上用
+    - 'local': 进程内的 LocalRedis，单元测试用，不需要起 redis-server
+    两种 backend 的接口是一样的，调用的地方不需要关心用的是哪一种
+    """
+    conn = None
+
+    @classmethod
+    def get_connection(cls):
+        # 使用 singleton 模式，全局只创建一个 connection
+        if cls.conn:
+            return cls.conn
+        if settings.REDIS_BACKEND == 'local':
+            cls.conn = LocalRedis(max_keys=settings.LOCAL_REDIS_MAX_KEYS)
+        else:
+            # 只有真的用到 redis 的时候才 import，测试环境不需要装 redis 这个包
+            import redis
+            cls.conn = redis.Redis(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+            )
+        return cls.conn
+
+    @classmethod
+    def clear(cls):
+        # clear all keys in redis, for testing purpose
+        if not settings.TESTING:
+            raise Exception('You can not flush redis in production environment')
+        conn = cls.get_connection()
+        conn.flushdb()
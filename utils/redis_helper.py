@@ -0,0 +1,159 @@
+import uuid
+
+from django.conf import settings
+from utils.redis_client import RedisClient
+from utils.redis_serializers import DjangoModelSerializer
+
+CACHE_STATS_KEY = 'cache_stats'
+VERSION_KEY_PATTERN = '{key}:version'
+
+
+class RedisHelper(object):
+    """
+    用 redis list 缓存一个 queryset 最前面的 REDIS_LIST_LENGTH_LIMIT 个 objects
+    - 读的时候 cache 里没有就去数据库 load 一次（lazy load）
+    - 写的时候往 list 的头上 push，超过长度上限的就 trim 掉
+    """
+
+    @classmethod
+    def get_version(cls, key):
+        conn = RedisClient.get_connection()
+        value = conn.get(VERSION_KEY_PATTERN.format(key=key))
+        return int(value) if value is not None else 0
+
+    @classmethod
+    def bump_version(cls, key):
+        """
+        每次修改 cache（push / invalidate）之前先把 key 的版本号加一，
+        正在从数据库 load 的地方看到版本号变了，就知道自己读到的数据可能已经过期了
+        """
+        conn = RedisClient.get_connection()
+        version_key = VERSION_KEY_PATTERN.format(key=key)
+        conn.incr(version_key)
+        conn.expire(version_key, settings.REDIS_KEY_EXPIRE_TIME)
+
+    @classmethod
+    def commit_loading_key(cls, loading_key, key, version):
+        """
+        把从数据库 load 好的临时 key RENAME 成正式的 key，返回有没有成功
+        version 是开始读数据库之前的版本号：
+        - RENAME 之前版本号变了，说明读数据库的过程中有 push 或者 invalidate，这时候 key 还不存在，
+          push 没有写进去，读到的数据可能缺了那一条，直接丢掉
+        - RENAME 之后版本号变了，说明检查和 RENAME 之间又有 push，同样可能没写进去，让 cache 失效
+        两个并发的 cache miss 各自写自己的临时 key，RENAME 是原子的，不会把 list 写成两份
+        """
+        conn = RedisClient.get_connection()
+        if cls.get_version(key) != version:
+            conn.delete(loading_key)
+            return False
+        conn.rename(loading_key, key)
+        if cls.get_version(key) != version:
+            conn.delete(key)
+            return False
+        return True
+
+    @classmethod
+    def get_loading_key(cls, key):
+        return '{}:loading:{}'.format(key, uuid.uuid4().hex)
+
+    @classmethod
+    def _load_objects_to_cache(cls, key, objects, version):
+        conn = RedisClient.get_connection()
+
+        serialized_list = []
+        # 最多只 cache REDIS_LIST_LENGTH_LIMIT 那么多个 objects
+        # 超过这个限制的 objects，就去数据库里读取。一般这个限制会比较大，比如 1000
+        # 因此翻页翻到 1000 的用户访问量会比较少，从数据库读取也不是大问题
+        for obj in objects:
+            serialized_data = DjangoModelSerializer.serialize(obj)
+            serialized_list.append(serialized_data)
+
+        if serialized_list:
+            # 先写到一个临时的 key 里，写完再 RENAME，见 commit_loading_key
+            loading_key = cls.get_loading_key(key)
+            conn.rpush(loading_key, *serialized_list)
+            conn.expire(loading_key, settings.REDIS_KEY_EXPIRE_TIME)
+            cls.commit_loading_key(loading_key, key, version)
+
+    @classmethod
+    def load_objects(cls, key, queryset, stats_name=None):
+        """
+        stats_name 不为空的时候，在 cache stats 里记一次 hit 或者 miss，用来监控命中率
+        """
+        conn = RedisClient.get_connection()
+
+        # 如果在 cache 里存在，则直接拿出来，然后返回
+        if conn.exists(key):
+            cls.incr_stats(stats_name, hit=True)
+            serialized_list = conn.lrange(key, 0, -1)
+            objects = []
+            for serialized_data in serialized_list:
+                deserialized_obj = DjangoModelSerializer.deserialize(serialized_data)
+                objects.append(deserialized_obj)
+            return objects
+
+        # cache miss，去数据库里读，然后写进 cache
+        cls.incr_stats(stats_name, hit=False)
+        # 版本号要在读数据库之前取，读的过程中有 push 的话写 cache 的时候才能发现
+        version = cls.get_version(key)
+        # 注意空的 list 是存不进 redis 的，所以没有数据的用户每次都会 miss，
+        # 但这种情况数据库的 query 本身也很便宜
+        objects = list(queryset[:settings.REDIS_LIST_LENGTH_LIMIT])
+        cls._load_objects_to_cache(key, objects, version)
+
+        # 转换为 list 的原因是保持返回类型的统一，因为存在 redis 里的数据是 list 的形式
+        return objects
+
+    @classmethod
+    def push_object(cls, key, obj):
+        conn = RedisClient.get_connection()
+        cls.bump_version(key)
+        # 如果 key 不存在，不需要 push，下次读的时候会从数据库里 load，新的 object 也在里面
+        # 用 LPUSHX 而不是先 EXISTS 再 LPUSH，key 在两步之间被删掉的话会变成一个只有一条数据的 list
+        serialized_data = DjangoModelSerializer.serialize(obj)
+        if conn.lpushx(key, serialized_data):
+            conn.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+
+    @classmethod
+    def push_objects(cls, key_object_pairs):
+        """
+        一次 push 一批 (key, obj)，比如 fanout 的时候给一个 batch 的粉丝各 push 一条 newsfeed
+        每个 key 做的事情和 push_object 一样，但是所有的命令放在一个 pipeline 里，
+        一个 batch 只有一次网络往返，而不是每个 key 四五次
+        pipeline 里的命令是按顺序执行的，每个 key 仍然是先改版本号再 LPUSHX
+        LTRIM 在 key 不存在的时候什么都不做，所以不需要根据 LPUSHX 的结果再决定要不要 trim
+        """
+        if not key_object_pairs:
+            return
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline(transaction=False)
+        for key, obj in key_object_pairs:
+            version_key = VERSION_KEY_PATTERN.format(key=key)
+            pipeline.incr(version_key)
+            pipeline.expire(version_key, settings.REDIS_KEY_EXPIRE_TIME)
+            pipeline.lpushx(key, DjangoModelSerializer.serialize(obj))
+            pipeline.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+        pipeline.execute()
+
+    @classmethod
+    def invalidate(cls, key):
+        # 和 push 一样先改版本号，正在 load 的旧数据就不会再被写进 cache
+        conn = RedisClient.get_connection()
+        cls.bump_version(key)
+        conn.delete(key)
+
+    @classmethod
+    def incr_stats(cls, stats_name, hit):
+        # 所有进程共用 redis 里的一个 hash，field 是 <stats_name>.hit / <stats_name>.miss
+        if stats_name is None:
+            return
+        conn = RedisClient.get_connection()
+        conn.hincrby(CACHE_STATS_KEY, '{}.{}'.format(stats_name, 'hit' if hit else 'miss'))
+
+    @classmethod
+    def get_stats(cls):
+        conn = RedisClient.get_connection()
+        return {
+            field.decode('utf-8'): int(value)
+            for field, value in conn.hgetall(CACHE_STATS_KEY).items()
+        }
@@ -0,0 +1,35 @@
+import json
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class _FullPrecisionJSONEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder 会把 datetime 的微秒截断到毫秒，
+    # 但是 created_at 要拿来排序和做翻页的 cursor，不能丢精度
+    def default(self, o):
+        if hasattr(o, 'isoformat') and hasattr(o, 'microsecond'):
+            return o.isoformat()
+        return super(_FullPrecisionJSONEncoder, self).default(o)
+
+
+class DjangoModelSerializer(object):
+    """
+    把 model instance 序列化成字符串存进 redis，取出来的时候再还原成 model instance
+    用的是 django 自带的 serializer，只会存 model 自己的字段，
+    ForeignKey 只存 id，不会把关联的 object 一起存进去
+    """
+
+    @classmethod
+    def serialize(cls, instance):
+        # Django 的 serializers 默认需要一个 QuerySet 或者 list 类型的数据来进行序列化
+        # 因此需要给 instance 加一个 [] 变成 list
+        data = serializers.serialize('python', [instance])[0]
+        return json.dumps(data, cls=_FullPrecisionJSONEncoder)
+
+    @classmethod
+    def deserialize(cls, serialized_data):
+        # 需要加 .object 来得到原始的 model 类型的 object 数据，要不然得到的数据并不是一个
+        # ORM 的 object，而是一个 DeserializedObject 的类型
+        data = json.loads(serialized_data)
+        return list(serializers.deserialize('python', [data]))[0].object
@@ -0,0 +1,75 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import update_wrapper
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+'''
+一个进程内的异步任务队列，用来把耗时的写操作（比如 fanout）从 HTTP request 里拿出去
+用法和 celery 的 task 一样：
+
+    @task
+    def some_task(a, b):
+        ...
+
+    some_task.delay(1, 2)   # 放进队列，马上返回
+    some_task(1, 2)         # 同步执行
+
+- 任务的参数尽量只传 id 这种简单的值，不要传 model instance，worker 里自己去数据库取最新的
+- delay 是在当前事务 commit 之后才真正放进队列的，保证 worker 一定能读到刚写进去的数据
+- settings.TASK_QUEUE_ALWAYS_EAGER = True 的时候（单元测试），delay 会直接同步执行，
+  不需要起任何外部服务
+- 这是一个单机的 broker 替代品，进程挂了队列里没跑完的任务就丢了。
+  如果以后需要多机和持久化，可以换成 celery，调用方的写法不需要改
+'''
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.TASK_QUEUE_WORKERS,
+                    thread_name_prefix='task_queue',
+                )
+    return _executor
+
+
+class Task(object):
+
+    def __init__(self, func):
+        self.func = func
+        update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def _run_in_worker(self, *args, **kwargs):
+        # worker 线程有自己的数据库连接，和 request 一样在前后清理掉过期的连接
+        close_old_connections()
+        try:
+            return self.func(*args, **kwargs)
+        except Exception:
+            logger.exception('task %s failed', self.func.__name__)
+            raise
+        finally:
+            close_old_connections()
+
+    def delay(self, *args, **kwargs):
+        if settings.TASK_QUEUE_ALWAYS_EAGER:
+            return self.func(*args, **kwargs)
+        transaction.on_commit(
+            lambda: _get_executor().submit(self._run_in_worker, *args, **kwargs)
+        )
+
+
+def task(func):
+    return Task(func)